@@ -0,0 +1,265 @@
+r"""Load test a running instance like a rush of members checking in.
+
+Every virtual user logs in with its own session (through `/login-debug`, so
+the instance must run with `FLASK_ENV=development`) and then, as fast as the
+server answers, picks one action of the mix after the other:
+
+- `home`: the page with the check-in button
+- `checkin`: `POST /`, the check-in itself (without following the redirect)
+- `statistic`: the statistic page of a logged in user
+- `upload`: uploading a certificate, by default an image without a QR code,
+  which fails after the image was scanned
+
+The virtual users are members that have a valid certificate, read from the
+database the instance uses. Seed them first with:
+
+    flask generate-data --users 500 --visits 0 --certificates
+
+At the end the throughput, the latency percentiles and the errors are
+reported per action. A 503 means SQLite gave up waiting for the write lock,
+these are counted as lock timeouts.
+
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 50
+"""
+
+import argparse
+import io
+import json
+import math
+import random
+import sys
+import threading
+from collections import defaultdict
+from datetime import date
+from time import monotonic, perf_counter, sleep
+from typing import Dict, List, Optional
+
+import requests
+
+ACTIONS = ("home", "checkin", "statistic", "upload")
+DEFAULT_MIX = "home=50,checkin=30,statistic=15,upload=5"
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        action, weight = part.split("=")
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action {action}, use one of {ACTIONS}")
+        weights[action] = float(weight)
+    return weights
+
+
+def percentile(values: List[float], p: float) -> float:
+    """The nearest-rank percentile of sorted values."""
+    rank = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def blank_image() -> bytes:
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.new("RGB", (1200, 1600), "white").save(output, format="PNG")
+    return output.getvalue()
+
+
+def member_emails(count: int) -> List[str]:
+    """Members with a valid certificate, from the configured database."""
+    from space_trace import app, db
+    from space_trace.models import User
+
+    with app.app_context():
+        users = (
+            User.query.filter(User.vaccinated_till >= date.today())
+            .order_by(User.id)
+            .limit(count)
+            .all()
+        )
+        emails = [user.email for user in users if "." in user.email.split("@")[0]]
+        db.session.remove()
+    return emails
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    def add(self, action: str, latency: float, status: Optional[int]):
+        with self._lock:
+            self.latencies[action].append(latency)
+            if status is None:
+                self.failures[action] += 1
+            else:
+                self.statuses[action][status] += 1
+
+    def report(self, duration: float) -> dict:
+        actions = {}
+        for action in sorted(self.latencies):
+            latencies = sorted(self.latencies[action])
+            statuses = self.statuses[action]
+            errors = sum(n for status, n in statuses.items() if status >= 500)
+            actions[action] = {
+                "requests": len(latencies),
+                "throughput": len(latencies) / duration,
+                "latency": {f"p{p}": percentile(latencies, p) for p in PERCENTILES},
+                "max": latencies[-1],
+                "statuses": {str(s): n for s, n in sorted(statuses.items())},
+                "lock_timeouts": statuses.get(503, 0),
+                "errors": errors + self.failures[action],
+            }
+
+        total = sum(a["requests"] for a in actions.values())
+        return {
+            "duration": duration,
+            "requests": total,
+            "throughput": total / duration,
+            "lock_timeouts": sum(a["lock_timeouts"] for a in actions.values()),
+            "errors": sum(a["errors"] for a in actions.values()),
+            "actions": actions,
+        }
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, url, email, mix, certificate, results, args):
+        super().__init__(daemon=True)
+        self.url = url.rstrip("/")
+        self.email = email
+        self.actions = list(mix.keys())
+        self.weights = list(mix.values())
+        self.certificate = certificate
+        self.results = results
+        self.deadline = 0.0
+        self.think = args.think
+        self.timeout = args.timeout
+        self.random = random.Random(email)
+        self.session = requests.Session()
+
+    def login(self):
+        response = self.session.get(
+            f"{self.url}/login-debug",
+            params={"email": self.email},
+            allow_redirects=False,
+            timeout=self.timeout,
+        )
+        if response.status_code == 404:
+            raise RuntimeError(
+                "/login-debug is missing, run the instance with "
+                "FLASK_ENV=development"
+            )
+        response.raise_for_status()
+
+    def request(self, action: str) -> requests.Response:
+        if action == "home":
+            return self.session.get(f"{self.url}/", timeout=self.timeout)
+        elif action == "checkin":
+            return self.session.post(
+                f"{self.url}/", allow_redirects=False, timeout=self.timeout
+            )
+        elif action == "statistic":
+            return self.session.get(f"{self.url}/statistic", timeout=self.timeout)
+        elif action == "upload":
+            return self.session.post(
+                f"{self.url}/cert",
+                files={"file": ("certificate.png", self.certificate, "image/png")},
+                allow_redirects=False,
+                timeout=self.timeout,
+            )
+        raise ValueError(action)
+
+    def run(self):
+        while monotonic() < self.deadline:
+            action = self.random.choices(self.actions, self.weights)[0]
+            start = perf_counter()
+            try:
+                status = self.request(action).status_code
+            except requests.RequestException:
+                status = None
+            self.results.add(action, perf_counter() - start, status)
+            if self.think > 0:
+                sleep(self.random.expovariate(1 / self.think))
+
+
+def print_report(report: dict):
+    print(
+        f"{'action':<10} {'requests':>8} {'req/s':>7} "
+        + " ".join(f"{'p' + str(p):>7}" for p in PERCENTILES)
+        + f" {'max':>7} {'locked':>6} {'errors':>6}"
+    )
+    for action, result in report["actions"].items():
+        latencies = " ".join(
+            f"{result['latency'][f'p{p}'] * 1000:7.0f}" for p in PERCENTILES
+        )
+        print(
+            f"{action:<10} {result['requests']:>8} {result['throughput']:>7.1f} "
+            f"{latencies} {result['max'] * 1000:7.0f} "
+            f"{result['lock_timeouts']:>6} {result['errors']:>6}"
+        )
+    print(
+        f"{report['requests']} requests in {report['duration']:.0f}s, "
+        f"{report['throughput']:.1f} req/s, {report['lock_timeouts']} lock "
+        f"timeouts, {report['errors']} errors (latencies in ms)"
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, default=20, help="Virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="In seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weights of the actions")
+    parser.add_argument(
+        "--think", type=float, default=0, help="Mean pause between requests in s"
+    )
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--certificate", help="The image or pdf to upload")
+    parser.add_argument("-o", "--output", help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    emails = member_emails(args.concurrency)
+    if len(emails) < args.concurrency:
+        print(
+            f"🔥 Only {len(emails)} members with a certificate, seed more with: "
+            f"flask generate-data --users {args.concurrency} --visits 0 "
+            "--certificates"
+        )
+        return 1
+
+    if args.certificate is not None:
+        with open(args.certificate, "rb") as file:
+            certificate = file.read()
+    else:
+        certificate = blank_image()
+
+    results = Results()
+    users = [
+        VirtualUser(args.url, email, mix, certificate, results, args)
+        for email in emails
+    ]
+    # Log in before the clock starts
+    for user in users:
+        user.login()
+
+    print(f"🚀 {len(users)} virtual users for {args.duration:.0f}s")
+    start = monotonic()
+    for user in users:
+        user.deadline = start + args.duration
+        user.start()
+    for user in users:
+        user.join()
+
+    report = results.report(monotonic() - start)
+    print_report(report)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
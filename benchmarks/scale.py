@@ -0,0 +1,268 @@
+r"""Time the statistics, exports and contact tracing at growing database sizes.
+
+For every size a SQLite database is seeded once with `flask generate-data`'s
+generator (with a fixed seed, so the data is the same every time) and kept in
+`benchmarks/data`. Every benchmark runs once to warm up and then a few times,
+the median is reported. The caches of the occupancy and the contact graph
+are cleared before every run, so the times are those of a cold worker.
+
+The results are written as JSON and checked against `thresholds.toml`:
+
+- `queries`: the most SQL statements a single call may run, at any size.
+- `seconds.<size>`: the longest a single call may take at that size.
+- `tolerance`: with `--baseline`, how many times slower than the baseline
+  results a benchmark may get.
+
+Run from the root of the repository:
+
+    python -m benchmarks.scale --sizes 10000,100000,1000000 -o results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+import toml
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The queries of the current run, counted for all engines.
+_queries = 0
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    global _queries
+    _queries += 1
+
+
+def database_path(size: int) -> str:
+    return os.path.join(BENCHMARK_DIR, "data", f"scale-{size}.db")
+
+
+def users_for(size: int) -> int:
+    # Roughly the ratio of production: a few hundred visits per member
+    return max(100, size // 300)
+
+
+def seed(size: int, seed: int):
+    from space_trace import db
+    from space_trace.activity import rebuild_activity
+    from space_trace.synthetic import generate_users, generate_visits
+
+    print(f"🌱 Seeding {size} visits into {database_path(size)}")
+    db.create_all()
+    user_ids = generate_users(users_for(size), certificates=True, seed=seed)
+    generate_visits(size, user_ids, days=365, seed=seed)
+    rebuild_activity()
+
+
+def open_database(size: int, seed_value: int):
+    """Point the app to the database of the size, seeding it if needed."""
+    from space_trace import app, db
+
+    path = database_path(size)
+    exists = os.path.exists(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    db.session.remove()
+    # Flask-SQLAlchemy (and the read-only routing) create a new engine when
+    # the URI changes.
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    if not exists:
+        seed(size, seed_value)
+
+
+def benchmarks(client) -> Dict[str, Callable[[], object]]:
+    """The calls to time, by name."""
+    from space_trace import app, db
+    from space_trace.export import get_contacts_of, get_users_between
+    from space_trace.models import User, UserActivity
+    from space_trace.statistics import (
+        active_users,
+        checkins_per_hour,
+        daily_usage,
+        monthly_usage,
+        most_frequent_users,
+    )
+
+    # The most active member has the most contacts.
+    infected = (
+        db.session.query(User)
+        .join(UserActivity, UserActivity.user == User.id)
+        .order_by(UserActivity.total_visits.desc())
+        .first()
+    )
+    db.session.commit()
+
+    # An admin needs a first.last email to render the page.
+    app.config["ADMINS"] = [infected.email]
+    with client.session_transaction() as session:
+        session["username"] = infected.email
+
+    now = datetime.now()
+    start = (now - timedelta(days=14)).replace(hour=0, minute=0, second=0)
+
+    def admin():
+        response = client.get("/admin")
+        assert response.status_code == 200, response.status_code
+
+    return {
+        "daily_usage": lambda: daily_usage(include_archive=True),
+        "monthly_usage": lambda: monthly_usage(include_archive=True),
+        "checkins_per_hour": lambda: checkins_per_hour(include_archive=True),
+        "most_frequent_users": lambda: most_frequent_users(),
+        "most_frequent_users_90d": lambda: most_frequent_users(days=90),
+        "active_users": lambda: active_users(),
+        "get_users_between": lambda: get_users_between(start, now).all(),
+        "get_contacts_of": lambda: get_contacts_of(start, infected.id),
+        "admin": admin,
+    }
+
+
+def clear_caches():
+    from space_trace import db
+    from space_trace.contact_graph import clear_adjacency_cache
+    from space_trace.occupancy import clear_occupancy_cache
+
+    clear_occupancy_cache()
+    clear_adjacency_cache()
+    db.session.remove()
+
+
+def measure(function: Callable[[], object], repeat: int) -> dict:
+    global _queries
+
+    clear_caches()
+    function()
+
+    times = []
+    queries = []
+    for _ in range(repeat):
+        clear_caches()
+        _queries = 0
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+        queries.append(_queries)
+
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "runs": times,
+        "queries": max(queries),
+    }
+
+
+def check(results: List[dict], thresholds: dict, baseline: Optional[dict]):
+    """The failed thresholds, as readable messages."""
+    failures = []
+    baseline_medians = {}
+    if baseline is not None:
+        baseline_medians = {
+            (r["size"], r["benchmark"]): r["median"] for r in baseline["results"]
+        }
+    tolerance = thresholds.get("tolerance", 1.5)
+
+    for result in results:
+        name, size = result["benchmark"], result["size"]
+        max_queries = thresholds.get("queries", {}).get(name)
+        if max_queries is not None and result["queries"] > max_queries:
+            failures.append(
+                f"{name} at {size}: {result['queries']} queries "
+                f"(at most {max_queries})"
+            )
+
+        max_seconds = thresholds.get("seconds", {}).get(str(size), {}).get(name)
+        if max_seconds is not None and result["median"] > max_seconds:
+            failures.append(
+                f"{name} at {size}: {result['median']:.3f}s (at most {max_seconds}s)"
+            )
+
+        before = baseline_medians.get((size, name))
+        if before is not None and result["median"] > before * tolerance:
+            failures.append(
+                f"{name} at {size}: {result['median']:.3f}s, "
+                f"{result['median'] / before:.1f}x the baseline of {before:.3f}s"
+            )
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", default="10000,100000,1000000", help="Visits, comma separated"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="Only these benchmarks, comma separated")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--thresholds", default=os.path.join(BENCHMARK_DIR, "thresholds.toml")
+    )
+    parser.add_argument("--baseline", help="Results of an earlier run to compare")
+    parser.add_argument("-o", "--output", default="benchmark-results.json")
+    args = parser.parse_args(argv)
+
+    from space_trace import app
+
+    # Only measure what the benchmarks do
+    app.config["METRICS_ENABLED"] = False
+    app.config["QUERY_PROFILING"] = False
+    app.config["PAGE_CACHE_TTL"] = 0
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    only = set(args.only.split(",")) if args.only else None
+    results = []
+
+    for size in sizes:
+        with app.app_context():
+            open_database(size, args.seed)
+            with app.test_client() as client:
+                for name, function in benchmarks(client).items():
+                    if only is not None and name not in only:
+                        continue
+                    result = measure(function, args.repeat)
+                    result.update(benchmark=name, size=size)
+                    results.append(result)
+                    print(
+                        f"{size:>9} {name:<24} {result['median'] * 1000:9.1f} ms "
+                        f"{result['queries']:4} queries"
+                    )
+
+    thresholds = toml.load(args.thresholds)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    failures = check(results, thresholds, baseline)
+
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+                "failures": failures,
+            },
+            file,
+            indent=2,
+        )
+
+    for failure in failures:
+        print(f"🔥 {failure}")
+    if len(failures) == 0:
+        print(f"✅ All within the thresholds, results in {args.output}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4 @@
+-- The contact tracing engine sweeps over visits sorted by their timestamp,
+-- which needs an index to not scan the whole table.
+
+CREATE INDEX IF NOT EXISTS idx_visits_timestamp ON visits (timestamp);
@@ -1,6 +1,18 @@
+import sqlite3
+
 import toml
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+
+from space_trace.routing import RoutingSession
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 
 app = Flask(__name__, instance_relative_config=True)
 app.config.from_file("config.toml", load=toml.load)
@@ -10,12 +22,21 @@ app.config.update(
     SESSION_COOKIE_SAMESITE="Lax",
     PERMANENT_SESSION_LIFETIME=90 * 24 * 60 * 60,
 )
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
+
 
+@event.listens_for(Engine, "connect")
+def configure_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
 
-@app.before_first_request
-def create_table():
-    db.create_all()
+    # With WAL readers don't block the writer (and the other way around), and
+    # writers wait for the lock instead of failing with "database is locked".
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={app.config.get('SQLITE_BUSY_TIMEOUT', 5000)}")
+    cursor.close()
 
 
-from space_trace import views, cli
+from space_trace import views, cli, profiling
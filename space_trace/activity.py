@@ -0,0 +1,242 @@
+r"""The per user activity summary (`user_activity`).
+
+Every check-in updates the summary of its user in the same transaction, so
+leaderboards, the admin user list and the cleanup of inactive accounts never
+have to scan the visits.
+
+The visits in the last 7, 30 and 365 days are counted relative to the
+`window_day` of a row. When the day changes, `refresh_activity` moves the
+windows forward by subtracting the visits that fell out of them, which only
+reads the visits of the days in between (via `idx_visits_timestamp`).
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
+from space_trace import app, db, invalidation
+from space_trace.models import (
+    ArchivedVisit,
+    ExpiryNotification,
+    User,
+    UserActivity,
+    Visit,
+)
+
+# The windows (in days) for which the summary counts visits.
+WINDOWS = (7, 30, 365)
+
+_activity = UserActivity.__table__
+_visits = Visit.__table__
+_archive = ArchivedVisit.__table__
+_notifications = ExpiryNotification.__table__
+
+_window_columns = {days: _activity.c[f"visits_{days}d"] for days in WINDOWS}
+
+
+def window_start(day: date, days: int) -> datetime:
+    """The first moment of a window of days ending with (and including) day."""
+    return datetime.combine(day - timedelta(days=days - 1), time())
+
+
+def _visit_rows(user_id: Optional[int] = None):
+    # Archived visits still count, so the summary survives the archival.
+    parts = []
+    for table in (_visits, _archive):
+        query = db.select([table.c.user, table.c.timestamp])
+        if user_id is not None:
+            query = query.where(table.c.user == user_id)
+        parts.append(query)
+    return db.union_all(*parts).subquery("all_visits")
+
+
+def _activity_rows(today: date, user_id: Optional[int] = None):
+    visits = _visit_rows(user_id)
+    columns = [
+        visits.c.user,
+        db.func.count().label("total_visits"),
+        db.func.min(visits.c.timestamp).label("first_visit"),
+        db.func.max(visits.c.timestamp).label("last_visit"),
+        db.literal(today, db.Date).label("window_day"),
+    ]
+    for days in WINDOWS:
+        in_window = visits.c.timestamp >= window_start(today, days)
+        columns.append(
+            db.func.sum(db.case((in_window, 1), else_=0)).label(f"visits_{days}d")
+        )
+    return db.select(columns).group_by(visits.c.user)
+
+
+def _insert_activity(connection, rows):
+    names = [column.name for column in rows.selected_columns]
+    connection.execute(_activity.insert().from_select(names, rows))
+
+
+def rebuild_user_activity(connection, user_id: int, today: Optional[date] = None):
+    """Recompute the summary of one user from their visits.
+
+    :param connection: A connection or session, the caller commits.
+    """
+    if today is None:
+        today = date.today()
+
+    connection.execute(_activity.delete().where(_activity.c.user == user_id))
+    _insert_activity(connection, _activity_rows(today, user_id))
+
+
+def rebuild_activity(today: Optional[date] = None) -> int:
+    """Recompute the summaries of all users from all their visits.
+
+    This scans all visits, it is only needed once after upgrading or when
+    visits were deleted.
+
+    :return: The number of users with visits.
+    """
+    if today is None:
+        today = date.today()
+
+    db.session.execute(_activity.delete())
+    _insert_activity(db.session, _activity_rows(today))
+    db.session.commit()
+    return UserActivity.query.count()
+
+
+def record_visit(connection, user_id: int, timestamp: datetime):
+    """Count a new visit in the summary of its user.
+
+    Must run in the transaction that inserted the visit, after the insert.
+
+    :param connection: A connection or session, the caller commits.
+    """
+    today = date.today()
+    c = _activity.c
+    values = {
+        "total_visits": c.total_visits + 1,
+        "first_visit": db.case(
+            (c.first_visit > timestamp, timestamp), else_=c.first_visit
+        ),
+        "last_visit": db.case(
+            (c.last_visit < timestamp, timestamp), else_=c.last_visit
+        ),
+    }
+    for days, column in _window_columns.items():
+        if timestamp >= window_start(today, days):
+            values[column.name] = column + 1
+
+    result = connection.execute(
+        _activity.update()
+        .where(c.user == user_id)
+        .where(c.window_day == today)
+        .values(values)
+    )
+    if result.rowcount == 0:
+        # Either the first visit of the user or the windows are outdated, both
+        # only need the visits of this user.
+        rebuild_user_activity(connection, user_id, today)
+
+
+def _count_between(table, start: datetime, end: datetime):
+    return (
+        db.select([db.func.count()])
+        .where(table.c.user == _activity.c.user)
+        .where(table.c.timestamp >= start)
+        .where(table.c.timestamp < end)
+        .scalar_subquery()
+    )
+
+
+def refresh_activity(today: Optional[date] = None) -> int:
+    """Move the windows of all summaries forward to today.
+
+    Cheap and idempotent, only the first call of a day does any work.
+
+    :return: The number of updated summaries.
+    """
+    if today is None:
+        today = date.today()
+
+    c = _activity.c
+    updated = 0
+
+    # Nothing in the windows of these rows is recent enough any more.
+    horizon = today - timedelta(days=max(WINDOWS))
+    result = db.session.execute(
+        _activity.update()
+        .where(c.window_day <= horizon)
+        .values({column.name: 0 for column in _window_columns.values()})
+        .values(window_day=today)
+    )
+    updated += result.rowcount
+
+    stale_days = [
+        day
+        for (day,) in db.session.query(UserActivity.window_day)
+        .filter(UserActivity.window_day < today)
+        .distinct()
+    ]
+    for day in stale_days:
+        values = {"window_day": today}
+        for days, column in _window_columns.items():
+            # The visits that were in the window on day, but aren't anymore.
+            start, end = window_start(day, days), window_start(today, days)
+            values[column.name] = (
+                column
+                - _count_between(_visits, start, end)
+                - _count_between(_archive, start, end)
+            )
+        result = db.session.execute(
+            _activity.update().where(c.window_day == day).values(values)
+        )
+        updated += result.rowcount
+
+    db.session.commit()
+    return updated
+
+
+def inactive_users(days: int) -> List[User]:
+    """The users that haven't checked in for days (or never did).
+
+    Users without a summary (like right after upgrading, before it was
+    filled) are checked against their visits, so they are never taken for
+    inactive by mistake. Admins are never considered inactive.
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    recent_visits = [
+        db.exists().where(table.c.user == User.id).where(table.c.timestamp >= cutoff)
+        for table in (_visits, _archive)
+    ]
+    return (
+        User.query.outerjoin(UserActivity, UserActivity.user == User.id)
+        .filter(
+            db.or_(
+                UserActivity.last_visit < cutoff,
+                db.and_(
+                    UserActivity.user.is_(None),
+                    User.created_at < cutoff,
+                    *[~visited for visited in recent_visits],
+                ),
+            )
+        )
+        .filter(User.email.notin_(app.config["ADMINS"]))
+        .order_by(User.email)
+        .all()
+    )
+
+
+def delete_users(user_ids: List[int], batch_size: int = 100):
+    """Delete users with all their visits and their summary."""
+    for i in range(0, len(user_ids), batch_size):
+        ids = user_ids[i : i + batch_size]
+        timestamps = [
+            timestamp
+            for table in (_visits, _archive)
+            for (timestamp,) in db.session.execute(
+                db.select([table.c.timestamp]).where(table.c.user.in_(ids))
+            )
+        ]
+        for table in (_visits, _archive, _activity, _notifications):
+            db.session.execute(table.delete().where(table.c.user.in_(ids)))
+        db.session.query(User).filter(User.id.in_(ids)).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        invalidation.invalidate_visits(timestamps)
@@ -1,4 +1,5 @@
 from functools import wraps
+from typing import Optional
 
 import flask
 from flask import (
@@ -10,21 +11,25 @@ from flask import (
     url_for,
     flash,
 )
-from onelogin.saml2.auth import OneLogin_Saml2_Auth
-from onelogin.saml2.utils import OneLogin_Saml2_Utils
-
 from space_trace import app, db
+from space_trace.http_cache import cached_page
 from space_trace.models import User
 
 
-def maybe_load_user(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
+def load_user() -> Optional[User]:
+    """The logged in user, only queried once per request."""
+    if "user" not in flask.g:
         user = None
         if "username" in session:
             user = User.query.filter(User.email == session["username"]).first()
-
         flask.g.user = user
+    return flask.g.user
+
+
+def maybe_load_user(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        load_user()
         return f(*args, **kwargs)
 
     return wrapper
@@ -36,12 +41,10 @@ def require_login(f):
         if "username" not in session:
             return redirect(url_for("login"))
 
-        user = User.query.filter(User.email == session["username"]).first()
-        if user is None:
+        if load_user() is None:
             session.pop("username", None)
             return redirect(url_for("login"))
 
-        flask.g.user = user
         return f(*args, **kwargs)
 
     return wrapper
@@ -85,7 +88,22 @@ def prepare_flask_request(request):
     }
 
 
+def saml_auth(req: dict, path: str):
+    # python3-saml (with xmlsec and lxml) takes a while to import and is only
+    # needed to log in, so it's imported on first use.
+    from onelogin.saml2.auth import OneLogin_Saml2_Auth
+
+    return OneLogin_Saml2_Auth(req, custom_base_path=path)
+
+
+def saml_self_url(req: dict) -> str:
+    from onelogin.saml2.utils import OneLogin_Saml2_Utils
+
+    return OneLogin_Saml2_Utils.get_self_url(req)
+
+
 @app.get("/login")
+@cached_page
 def login():
     return render_template("login.html")
 
@@ -93,7 +111,7 @@ def login():
 @app.post("/login-st")
 def login_st():
     req = prepare_flask_request(request)
-    auth = OneLogin_Saml2_Auth(req, custom_base_path=app.config["SAML_ST_PATH"])
+    auth = saml_auth(req, app.config["SAML_ST_PATH"])
 
     return_to = "https://covid.tust.at/"
     sso_built_url = auth.login(return_to)
@@ -104,7 +122,7 @@ def login_st():
 @app.route("/saml-st", methods=["POST", "GET"])
 def saml_response_st():
     req = prepare_flask_request(request)
-    auth = OneLogin_Saml2_Auth(req, custom_base_path=app.config["SAML_ST_PATH"])
+    auth = saml_auth(req, app.config["SAML_ST_PATH"])
     errors = []
 
     request_id = None
@@ -130,7 +148,7 @@ def saml_response_st():
     session["username"] = email
     session.permanent = True
 
-    self_url = OneLogin_Saml2_Utils.get_self_url(req)
+    self_url = saml_self_url(req)
     if "RelayState" in request.form and self_url != request.form["RelayState"]:
         # To avoid 'Open Redirect' attacks, before execute the redirection
         # confirm the value of the request.form['RelayState'] is a trusted URL.
@@ -142,7 +160,7 @@ def saml_response_st():
 @app.post("/login-rt")
 def login_rt():
     req = prepare_flask_request(request)
-    auth = OneLogin_Saml2_Auth(req, custom_base_path=app.config["SAML_RT_PATH"])
+    auth = saml_auth(req, app.config["SAML_RT_PATH"])
 
     return_to = "https://covid.tust.at/"
     sso_built_url = auth.login(return_to)
@@ -153,7 +171,7 @@ def login_rt():
 @app.route("/saml-rt", methods=["POST", "GET"])
 def saml_response_rt():
     req = prepare_flask_request(request)
-    auth = OneLogin_Saml2_Auth(req, custom_base_path=app.config["SAML_RT_PATH"])
+    auth = saml_auth(req, app.config["SAML_RT_PATH"])
     errors = []
 
     request_id = None
@@ -179,7 +197,7 @@ def saml_response_rt():
     session["username"] = email
     session.permanent = True
 
-    self_url = OneLogin_Saml2_Utils.get_self_url(req)
+    self_url = saml_self_url(req)
     if "RelayState" in request.form and self_url != request.form["RelayState"]:
         # To avoid 'Open Redirect' attacks, before execute the redirection
         # confirm the value of the request.form['RelayState'] is a trusted URL.
@@ -193,8 +211,13 @@ def login_debug():
     if app.env != "development":
         abort(404)
 
-    email = app.config["DEBUG_EMAIL"]
-    team = app.config["DEBUG_TEAM"]
+    # Other users (like the virtual users of a load test) can log in with
+    # /login-debug?email=first.last@example.com&team=racing
+    email = request.args.get("email", app.config["DEBUG_EMAIL"])
+    team = request.args.get("team", app.config["DEBUG_TEAM"])
+    if team not in ("space", "racing"):
+        abort(400)
+
     session["username"] = email
     session.permanent = True
     user = User.query.filter(User.email == email).first()
@@ -0,0 +1,243 @@
+r"""Online backups of the SQLite database.
+
+Copying `trace.db` while the workers write to it can produce a broken copy,
+and `.dump` holds a lock for as long as it takes. `flask backup` instead
+uses SQLite's online backup API: a few pages at a time, with a pause after
+every step, so check-ins get the disk in between. The copy reads from a
+single read transaction, which with WAL never blocks a writer and keeps the
+copy consistent (without it, every write restarts the backup).
+
+Every snapshot is gzip compressed with its SHA-256 checksum next to it (in
+the format of `sha256sum`), and only the newest `BACKUP_KEEP` are kept.
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime
+from time import perf_counter, sleep
+from typing import List, Optional
+
+from space_trace import app, db
+
+PREFIX = "trace-"
+SUFFIX = ".db.gz"
+
+# Give up if other connections keep changing the database under the backup.
+_MAX_RESTARTS = 100
+
+
+class BackupException(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+@dataclass
+class Snapshot:
+    path: str
+    sha256: str
+    size: int
+    pages: int
+    duration: float
+
+
+def database_path() -> str:
+    url = db.engine.url
+    if not url.drivername.startswith("sqlite") or url.database in (None, ""):
+        raise BackupException(
+            "Only SQLite databases can be backed up, use pg_dump for PostgreSQL"
+        )
+    return os.path.abspath(url.database)
+
+
+def backup_dir() -> str:
+    return app.config.get("BACKUP_DIR") or os.path.join(app.instance_path, "backups")
+
+
+def snapshots(directory: Optional[str] = None) -> List[str]:
+    """The snapshots in the directory, the oldest first."""
+    directory = directory or backup_dir()
+    if not os.path.isdir(directory):
+        return []
+    names = [n for n in os.listdir(directory) if n.startswith(PREFIX)]
+    return [
+        os.path.join(directory, name) for name in sorted(names) if name.endswith(SUFFIX)
+    ]
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    timeout = app.config.get("SQLITE_BUSY_TIMEOUT", 5000) / 1000
+    # Transactions are started explicitly
+    return sqlite3.connect(path, timeout=timeout, isolation_level=None)
+
+
+def _copy(source_path: str, target_path: str, pages: int, pause: float) -> int:
+    """Copy the database page by page, returns the number of pages."""
+    source = _connect(source_path)
+    target = sqlite3.connect(target_path)
+    total_pages = 0
+    last_remaining = None
+    restarts = 0
+
+    def progress(status, remaining, total):
+        nonlocal total_pages, last_remaining, restarts
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > _MAX_RESTARTS:
+                raise BackupException(
+                    "The database changed too often during the backup"
+                )
+        total_pages, last_remaining = total, remaining
+        if remaining > 0:
+            sleep(pause)
+
+    try:
+        wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if wal:
+            # The snapshot stays the same till the commit, so writes of the
+            # workers don't restart the backup.
+            source.execute("BEGIN")
+            source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, progress=progress)
+        if wal:
+            source.execute("COMMIT")
+    finally:
+        source.close()
+        target.close()
+    return total_pages
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _checksum_path(path: str) -> str:
+    return path + ".sha256"
+
+
+def _check_integrity(path: str):
+    connection = sqlite3.connect(path)
+    try:
+        result = connection.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        connection.close()
+    if result != [("ok",)]:
+        problems = "; ".join(row[0] for row in result[:5])
+        raise BackupException(f"{os.path.basename(path)} is corrupt: {problems}")
+
+
+def create_backup(
+    directory: Optional[str] = None,
+    pages: Optional[int] = None,
+    pause: Optional[float] = None,
+    keep: Optional[int] = None,
+) -> Snapshot:
+    """Take a snapshot of the database, compress it and rotate the old ones.
+
+    :param pages: How many pages to copy per step (`BACKUP_PAGES`).
+    :param pause: How long (in seconds) to pause after every step
+        (`BACKUP_PAUSE_MS`).
+    :param keep: How many snapshots to keep (`BACKUP_KEEP`), 0 keeps all.
+    """
+    directory = directory or backup_dir()
+    pages = pages or app.config.get("BACKUP_PAGES", 256)
+    if pause is None:
+        pause = app.config.get("BACKUP_PAUSE_MS", 10) / 1000
+    if keep is None:
+        keep = app.config.get("BACKUP_KEEP", 14)
+
+    source_path = database_path()
+    os.makedirs(directory, exist_ok=True)
+    name = f"{PREFIX}{datetime.now():%Y%m%d-%H%M%S}{SUFFIX}"
+    path = os.path.join(directory, name)
+
+    start = perf_counter()
+    with tempfile.TemporaryDirectory(dir=directory) as temp:
+        copy_path = os.path.join(temp, "trace.db")
+        copied_pages = _copy(source_path, copy_path, pages, pause)
+        # Reads the copy, not the live database
+        _check_integrity(copy_path)
+
+        compressed = os.path.join(temp, name)
+        with open(copy_path, "rb") as file, gzip.open(compressed, "wb") as output:
+            shutil.copyfileobj(file, output, 1024 * 1024)
+        sha256 = _sha256(compressed)
+        os.replace(compressed, path)
+
+    with open(_checksum_path(path), "w") as file:
+        file.write(f"{sha256}  {name}\n")
+
+    rotate(directory, keep)
+    return Snapshot(
+        path, sha256, os.path.getsize(path), copied_pages, perf_counter() - start
+    )
+
+
+def rotate(directory: str, keep: int) -> List[str]:
+    """Delete all but the newest snapshots, returns the deleted ones."""
+    if keep <= 0:
+        return []
+    old = snapshots(directory)[:-keep]
+    for path in old:
+        os.remove(path)
+        if os.path.exists(_checksum_path(path)):
+            os.remove(_checksum_path(path))
+    return old
+
+
+def _decompress(path: str, target_path: str):
+    with gzip.open(path, "rb") as file, open(target_path, "wb") as output:
+        shutil.copyfileobj(file, output, 1024 * 1024)
+
+
+def verify_backup(path: str):
+    """Check the checksum of a snapshot and the integrity of the database in it.
+
+    :raises BackupException: If the snapshot is damaged.
+    """
+    try:
+        with open(_checksum_path(path)) as file:
+            expected = file.read().split()[0]
+    except (FileNotFoundError, IndexError):
+        raise BackupException(f"{os.path.basename(path)} has no checksum")
+    if _sha256(path) != expected:
+        raise BackupException(f"{os.path.basename(path)} doesn't match its checksum")
+
+    with tempfile.TemporaryDirectory() as temp:
+        copy_path = os.path.join(temp, "trace.db")
+        try:
+            _decompress(path, copy_path)
+        except (OSError, EOFError) as e:
+            raise BackupException(f"{os.path.basename(path)} can't be read: {e}")
+        _check_integrity(copy_path)
+
+
+def restore_backup(path: str, target: Optional[str] = None):
+    """Replace the database (or target) with a verified snapshot.
+
+    The service must be stopped, the target is locked while it is written.
+    """
+    verify_backup(path)
+    target = target or database_path()
+
+    with tempfile.TemporaryDirectory() as temp:
+        copy_path = os.path.join(temp, "trace.db")
+        _decompress(path, copy_path)
+
+        # Written through SQLite, so the WAL of the target is taken care of.
+        source = sqlite3.connect(copy_path)
+        destination = _connect(target)
+        try:
+            source.backup(destination)
+        finally:
+            source.close()
+            destination.close()
@@ -0,0 +1,178 @@
+r"""Bulk exports of all visits for offline analytics.
+
+The visits (joined with their users) are read in batches ordered by the visit
+id. Every batch is its own short read transaction, so an export never blocks
+check-ins, and only one batch is in memory at a time. Archived visits keep
+their id, so they can be exported together with the others.
+
+JSON Lines always works, Parquet and Arrow IPC need the optional `pyarrow`
+package.
+"""
+
+import gzip
+import json
+import os
+import zlib
+from typing import Any, Dict, Iterator, List
+
+from space_trace import db
+from space_trace.models import User
+from space_trace.retention import visit_source
+
+FORMATS = {
+    "jsonl": "jsonl.gz",
+    "parquet": "parquet",
+    "arrow": "arrow",
+}
+
+COLUMNS = ["visit_id", "timestamp", "user_id", "email", "team"]
+
+# The file in the output directory remembering the last exported visit id.
+STATE_FILE = ".last_export.json"
+
+Batch = Dict[str, List[Any]]
+
+
+def iter_visit_batches(
+    since_id: int = 0, batch_size: int = 10_000, include_archive: bool = False
+) -> Iterator[Batch]:
+    """Iterate over all visits after since_id in columnar batches.
+
+    :param include_archive: Also export the archived visits.
+    """
+    visit = visit_source(include_archive)
+    last_id = since_id
+    while True:
+        rows = (
+            db.session.query(visit.id, visit.timestamp, User.id, User.email, User.team)
+            .filter(visit.user == User.id)
+            .filter(visit.id > last_id)
+            .order_by(visit.id)
+            .limit(batch_size)
+            .all()
+        )
+        # End the read transaction before handing out the batch.
+        db.session.commit()
+
+        if len(rows) == 0:
+            break
+
+        yield dict(zip(COLUMNS, map(list, zip(*rows))))
+        last_id = rows[-1][0]
+
+
+def _jsonl_lines(batch: Batch) -> Iterator[str]:
+    for values in zip(*batch.values()):
+        row = dict(zip(batch.keys(), values))
+        row["timestamp"] = row["timestamp"].isoformat()
+        yield json.dumps(row) + "\n"
+
+
+def stream_jsonl_gz(batches: Iterator[Batch]) -> Iterator[bytes]:
+    """Generate a gzipped JSON Lines file chunk by chunk."""
+    compressor = zlib.compressobj(wbits=31)  # 31 means with gzip header
+    for batch in batches:
+        data = compressor.compress("".join(_jsonl_lines(batch)).encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("visit_id", pa.int64()),
+            ("timestamp", pa.timestamp("us")),
+            ("user_id", pa.int64()),
+            ("email", pa.string()),
+            ("team", pa.dictionary(pa.int8(), pa.string())),
+        ]
+    )
+
+
+def write_batches(batches: Iterator[Batch], path: str, format: str) -> Dict[str, int]:
+    """Write the batches into a file.
+
+    :param format: One of `FORMATS`.
+    :return: The number of exported rows and the last exported visit id.
+    """
+    stats = {"rows": 0, "last_id": 0}
+
+    def counted(batches: Iterator[Batch]) -> Iterator[Batch]:
+        for batch in batches:
+            stats["rows"] += len(batch["visit_id"])
+            stats["last_id"] = batch["visit_id"][-1]
+            yield batch
+
+    if format == "jsonl":
+        with gzip.open(path, "wt") as file:
+            for batch in counted(batches):
+                file.writelines(_jsonl_lines(batch))
+        return stats
+
+    import pyarrow as pa
+
+    schema = _arrow_schema()
+    if format == "parquet":
+        import pyarrow.parquet as pq
+
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
+    elif format == "arrow":
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        writer = pa.ipc.new_file(path, schema, options=options)
+    else:
+        raise ValueError(f"Unknown export format: {format}")
+
+    with writer:
+        for batch in counted(batches):
+            writer.write_table(pa.Table.from_pydict(batch, schema=schema))
+
+    return stats
+
+
+def read_last_export(output_dir: str) -> int:
+    """The last visit id exported into this directory (0 if none)."""
+    try:
+        with open(os.path.join(output_dir, STATE_FILE)) as file:
+            return json.load(file)["last_id"]
+    except FileNotFoundError:
+        return 0
+
+
+def export_visits(
+    output_dir: str,
+    format: str = "jsonl",
+    since_last: bool = False,
+    batch_size: int = 10_000,
+    include_archive: bool = False,
+) -> Dict[str, Any]:
+    """Export visits into a new file in output_dir.
+
+    :param since_last: Only export the visits added since the last export
+        into this directory.
+    :param include_archive: Also export the archived visits.
+    :return: The path of the new file and the stats of `write_batches`, the
+        path is None if there was nothing to export.
+    """
+    since_id = read_last_export(output_dir) if since_last else 0
+    os.makedirs(output_dir, exist_ok=True)
+
+    # The real name is only known once we know the last id.
+    tmp_path = os.path.join(output_dir, f".export.{FORMATS[format]}.tmp")
+    batches = iter_visit_batches(since_id, batch_size, include_archive)
+    stats = write_batches(batches, tmp_path, format)
+
+    if stats["rows"] == 0:
+        os.unlink(tmp_path)
+        return {"path": None, **stats}
+
+    path = os.path.join(
+        output_dir, f"visits-{since_id + 1}-{stats['last_id']}.{FORMATS[format]}"
+    )
+    os.replace(tmp_path, path)
+    with open(os.path.join(output_dir, STATE_FILE), "w") as file:
+        json.dump({"last_id": stats["last_id"]}, file)
+
+    return {"path": path, **stats}
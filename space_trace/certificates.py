@@ -30,6 +30,7 @@ class CertificateException(Exception):
 
     def __init__(self, message):
         super().__init__(message)
+        self.message = message
 
 
 def calc_vaccinated_till(data: Any) -> date:
@@ -0,0 +1,301 @@
+r"""The check-in write path.
+
+A check-in is a single `INSERT ... SELECT ... WHERE NOT EXISTS` statement, so
+checking for an active visit and inserting the new one can't race: SQLite
+runs the whole statement under its write lock (on PostgreSQL a per-user
+advisory lock does the same), and a double click simply inserts nothing the
+second time.
+
+Optionally check-ins can be group committed: all check-ins arriving within a
+few milliseconds are written by one thread in a single transaction, so the
+morning rush doesn't queue up on the write lock one commit at a time.
+
+Admins can check a whole group in at once (`bulk_check_in`), for example the
+attendees of a workshop, also after the fact.
+"""
+
+import os
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Iterable, List, Optional, Tuple, Union
+
+from flask import Flask
+
+from space_trace import app, db, invalidation
+from space_trace.activity import record_visit
+from space_trace.dialects import lock_user
+from space_trace.live import notify_change
+from space_trace.models import User, Visit
+from space_trace.tracing import PRESENCE_DURATION
+
+_visits = Visit.__table__
+
+# Insert a visit, unless the user already has one that overlaps it. Visits
+# later than the new one count as well, check-ins can be backdated.
+_insert_visit = _visits.insert().from_select(
+    ["user", "timestamp"],
+    db.select(
+        [
+            db.bindparam("user_id", type_=db.Integer),
+            db.bindparam("timestamp", type_=db.DateTime),
+        ]
+    ).where(
+        ~db.exists()
+        .where(_visits.c.user == db.bindparam("user_id"))
+        .where(_visits.c.timestamp > db.bindparam("cutoff", type_=db.DateTime))
+        .where(_visits.c.timestamp < db.bindparam("until", type_=db.DateTime))
+    ),
+)
+
+
+def insert_visit(connection, user_id: int, timestamp: datetime) -> bool:
+    """Insert a visit if the user has no visit that overlaps it.
+
+    The activity summary of the user is updated in the same transaction.
+
+    :param connection: A connection or session, the caller commits.
+    :return: True if a visit was inserted.
+    """
+    lock_user(connection, user_id)
+    result = connection.execute(
+        _insert_visit,
+        {
+            "user_id": user_id,
+            "timestamp": timestamp,
+            "cutoff": timestamp - PRESENCE_DURATION,
+            "until": timestamp + PRESENCE_DURATION,
+        },
+    )
+    if result.rowcount != 1:
+        return False
+
+    record_visit(connection, user_id, timestamp)
+    return True
+
+
+class CheckinBatcher:
+    """Collects check-ins and commits them in groups from one thread."""
+
+    def __init__(self, flask_app: Flask, window: float, max_size: int):
+        """
+        :param window: How long (in seconds) to wait for more check-ins after
+            the first one arrived.
+        :param max_size: The maximal number of check-ins in one transaction.
+        """
+        self.app = flask_app
+        self.window = window
+        self.max_size = max_size
+        self._queue: Queue = Queue()
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+        self._pid: Optional[int] = None
+
+    def submit(self, user_id: int, timestamp: datetime) -> "Future[bool]":
+        self._ensure_running()
+        future: "Future[bool]" = Future()
+        self._queue.put((user_id, timestamp, future))
+        return future
+
+    def _ensure_running(self):
+        # Threads don't survive a fork, so every gunicorn worker needs its own.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = Queue()
+                self._pid = os.getpid()
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _next_group(self) -> List[Tuple[int, datetime, Future]]:
+        group = [self._queue.get()]
+        deadline = monotonic() + self.window
+        while len(group) < self.max_size:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                group.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return group
+
+    def _run(self):
+        engine = db.get_engine(self.app)
+        while True:
+            group = self._next_group()
+            try:
+                with engine.begin() as connection:
+                    results = [
+                        insert_visit(connection, user_id, timestamp)
+                        for user_id, timestamp, _ in group
+                    ]
+            except Exception as e:
+                for _, _, future in group:
+                    future.set_exception(e)
+                continue
+
+            for (_, _, future), result in zip(group, results):
+                future.set_result(result)
+
+
+_batcher: Optional[CheckinBatcher] = None
+_batcher_lock = Lock()
+
+
+def checkin_batcher() -> CheckinBatcher:
+    global _batcher
+
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = CheckinBatcher(
+                app,
+                window=app.config.get("CHECKIN_GROUP_COMMIT_WINDOW_MS", 5) / 1000,
+                max_size=app.config.get("CHECKIN_GROUP_COMMIT_MAX", 64),
+            )
+        return _batcher
+
+
+def check_in(user_id: int, timestamp: Optional[datetime] = None) -> bool:
+    """Check a user in, unless they already are.
+
+    :return: True if a new visit was created.
+    """
+    if timestamp is None:
+        timestamp = datetime.now()
+
+    if app.config.get("CHECKIN_GROUP_COMMIT", False):
+        future = checkin_batcher().submit(user_id, timestamp)
+        created = future.result(timeout=app.config.get("CHECKIN_TIMEOUT", 30))
+    else:
+        created = insert_visit(db.session, user_id, timestamp)
+        db.session.commit()
+
+    if created:
+        notify_change()
+    return created
+
+
+# The results of a bulk check-in
+CHECKED_IN = "checked_in"
+ALREADY_CHECKED_IN = "already_checked_in"
+NO_2G = "no_2g"
+UNKNOWN = "unknown"
+
+# Keeps the IN lists below the parameter limit of older SQLite versions.
+_CHUNK_SIZE = 500
+
+
+@dataclass
+class BulkResult:
+    # The email or id as it was given
+    identifier: str
+    status: str
+    user_id: Optional[int] = None
+    email: Optional[str] = None
+
+
+def _chunks(values: list) -> Iterable[list]:
+    for i in range(0, len(values), _CHUNK_SIZE):
+        yield values[i : i + _CHUNK_SIZE]
+
+
+def _find_users(identifiers: List[str]) -> dict:
+    """The users by every identifier (email or id) that exists."""
+    ids = [int(i) for i in identifiers if i.isdigit()]
+    emails = [i for i in identifiers if not i.isdigit()]
+    columns = (User.id, User.email, User.vaccinated_till, User.tested_till)
+
+    users = {}
+    for chunk in _chunks(ids):
+        for row in db.session.query(*columns).filter(User.id.in_(chunk)):
+            users[str(row.id)] = row
+    for chunk in _chunks(emails):
+        for row in db.session.query(*columns).filter(User.email.in_(chunk)):
+            users[row.email] = row
+    return users
+
+
+def _active_users(user_ids: List[int], timestamp: datetime) -> set:
+    """The users that already have a visit that overlaps one at the timestamp."""
+    active = set()
+    for chunk in _chunks(user_ids):
+        active.update(
+            user_id
+            for (user_id,) in db.session.query(Visit.user)
+            .filter(Visit.user.in_(chunk))
+            .filter(Visit.timestamp > timestamp - PRESENCE_DURATION)
+            .filter(Visit.timestamp < timestamp + PRESENCE_DURATION)
+            .distinct()
+        )
+    return active
+
+
+def _has_2g_at(user, timestamp: datetime) -> bool:
+    return (
+        user.vaccinated_till is not None and user.vaccinated_till >= timestamp.date()
+    ) or (user.tested_till is not None and user.tested_till >= timestamp)
+
+
+def bulk_check_in(
+    identifiers: Iterable[Union[int, str]], timestamp: Optional[datetime] = None
+) -> List[BulkResult]:
+    """Check a group of users in at the same time.
+
+    The users (and their certificates) and their active visits are read with
+    one query each, and all visits are inserted in a single transaction.
+    Users that didn't have 2G at the time or already have a visit are skipped.
+
+    :param identifiers: Emails or ids of the users.
+    :param timestamp: When they arrived, by default now. Can be in the past.
+    :return: The result for every identifier, in the same order.
+    """
+    now = datetime.now()
+    if timestamp is None:
+        timestamp = now
+    if timestamp > now:
+        raise ValueError("Visits can't be in the future")
+
+    identifiers = [str(i).strip() for i in identifiers if str(i).strip() != ""]
+    users = _find_users(identifiers)
+    valid = {u.id for u in users.values() if _has_2g_at(u, timestamp)}
+    active = _active_users(sorted(valid), timestamp)
+
+    results = []
+    to_insert = []
+    for identifier in identifiers:
+        user = users.get(identifier)
+        if user is None:
+            results.append(BulkResult(identifier, UNKNOWN))
+            continue
+
+        result = BulkResult(identifier, CHECKED_IN, user.id, user.email)
+        if user.id not in valid:
+            result.status = NO_2G
+        elif user.id in active:
+            result.status = ALREADY_CHECKED_IN
+        else:
+            to_insert.append(result)
+        results.append(result)
+
+    for result in to_insert:
+        # Somebody checked in since the read (or is in the list twice).
+        if not insert_visit(db.session, result.user_id, timestamp):
+            result.status = ALREADY_CHECKED_IN
+    db.session.commit()
+
+    if any(r.status == CHECKED_IN for r in results):
+        notify_change()
+        # The caches of days that are over don't know about these visits.
+        last = min(
+            (timestamp + PRESENCE_DURATION).date(), now.date() - timedelta(days=1)
+        )
+        days = (last - timestamp.date()).days + 1
+        invalidation.invalidate_days(
+            timestamp.date() + timedelta(days=i) for i in range(days)
+        )
+    return results
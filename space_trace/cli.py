@@ -1,7 +1,47 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import click
-from space_trace import app, db
-from space_trace.models import User, Visit
+from space_trace import app, db, invalidation
+from space_trace.activity import (
+    delete_users,
+    inactive_users,
+    rebuild_activity,
+    rebuild_user_activity,
+)
+from space_trace.backup import (
+    BackupException,
+    create_backup,
+    database_path,
+    restore_backup,
+    snapshots,
+    verify_backup,
+)
+from space_trace.bulk_export import FORMATS, export_visits
+from space_trace.expiry import due_notifications, get_sender, notify_expiring
+from space_trace.checkin import CHECKED_IN, bulk_check_in
+from space_trace import door_pass
+from space_trace.migrate import copy_database
+from space_trace.models import ExpiryNotification, User, UserActivity, Visit
+from space_trace.retention import archive_visits, purge_visits
+from space_trace.slack import sync_slack_directory
+from space_trace.synthetic import generate_users, generate_visits
+
+
+@app.cli.command("init-db")
+def init_db():
+    """Create the tables and indexes that don't exist yet."""
+    had_activity = db.inspect(db.engine).has_table(UserActivity.__tablename__)
+    db.create_all()
+    # create_all only creates the indexes of new tables
+    for table in db.Model.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    print("✅ Created the database tables")
+
+    # The summaries of an existing database are only kept up to date from now
+    # on, the visits so far have to be counted once.
+    if not had_activity:
+        users = rebuild_activity()
+        print(f"✅ Filled the activity of {users} users")
 
 
 @app.cli.command("delete-debug-user")
@@ -13,9 +53,16 @@ def delete_debug_user():
         return
 
     # Delete all visits and the user
+    visits = db.session.query(Visit.timestamp).filter(Visit.user == user.id).all()
     db.session.query(Visit).filter(Visit.user == user.id).delete()
+    db.session.query(UserActivity).filter(UserActivity.user == user.id).delete()
+    db.session.query(ExpiryNotification).filter(
+        ExpiryNotification.user == user.id
+    ).delete()
     db.session.query(User).filter(User.id == user.id).delete()
     db.session.commit()
+    invalidation.invalidate_visits(timestamp for (timestamp,) in visits)
+    door_pass.revoke(user.id)
     print("✅ Deleted debug user")
 
 
@@ -28,8 +75,11 @@ def delete_debug_visits():
         return
 
     # Delete all visits
+    visits = db.session.query(Visit.timestamp).filter(Visit.user == user.id).all()
     db.session.query(Visit).filter(Visit.user == user.id).delete()
+    rebuild_user_activity(db.session, user.id)
     db.session.commit()
+    invalidation.invalidate_visits(timestamp for (timestamp,) in visits)
     print("✅ Deleted debug visits")
 
 
@@ -40,4 +90,261 @@ def insert_visits():
         db.session.add(visit)
 
     db.session.commit()
+    rebuild_activity()
     print("✅ Inserted 16 visits")
+
+
+@app.cli.command("generate-data")
+@click.option("--users", default=1000, show_default=True)
+@click.option("--visits", default=100_000, show_default=True)
+@click.option("--days", default=365, show_default=True, help="Spread the visits.")
+@click.option("--certificates", is_flag=True, help="Set vaccination and test dates.")
+@click.option("--seed", type=int, help="For the same data every time.")
+@click.option("--batch-size", default=10_000, show_default=True)
+@click.option("--yes", is_flag=True, help="Don't ask for confirmation.")
+def generate_data(users, visits, days, certificates, seed, batch_size, yes):
+    """Insert fake members and visits, for load and scale testing."""
+    if app.env != "development" and not yes:
+        click.confirm(
+            f"Insert fake data into {db.engine.url!r} (not a development setup)?",
+            abort=True,
+        )
+
+    user_ids = generate_users(users, certificates, seed, batch_size)
+    print(f"✅ Inserted {len(user_ids)} users")
+
+    def progress(inserted):
+        print(f"   {inserted} visits", end="\r")
+
+    inserted = generate_visits(visits, user_ids, days, seed, batch_size, progress)
+    rebuild_activity()
+    print(f"✅ Inserted {inserted} visits over {days} days")
+
+
+@app.cli.command("sync-slack")
+def sync_slack():
+    sync = sync_slack_directory()
+    print(f"✅ Synced {sync.members} Slack members ({sync.changed} changed)")
+
+
+@app.cli.command("export-visits")
+@click.argument("output_dir")
+@click.option("--format", type=click.Choice(list(FORMATS.keys())), default="jsonl")
+@click.option(
+    "--since-last", is_flag=True, help="Only visits added since the last export."
+)
+@click.option("--batch-size", default=10_000, show_default=True)
+@click.option("--include-archive", is_flag=True, help="Also the archived visits.")
+def export_visits_command(output_dir, format, since_last, batch_size, include_archive):
+    try:
+        result = export_visits(
+            output_dir, format, since_last, batch_size, include_archive
+        )
+    except ImportError:
+        raise click.ClickException(f"Exporting {format} requires pyarrow")
+
+    if result["path"] is None:
+        print("😴 No new visits... nothing to do here")
+        return
+    print(f"✅ Exported {result['rows']} visits to {result['path']}")
+
+
+@app.cli.command("copy-db")
+@click.argument("source_uri")
+@click.option("--batch-size", default=5000, show_default=True)
+def copy_db(source_uri, batch_size):
+    """Copy all data from SOURCE_URI into the configured database.
+
+    For example: flask copy-db sqlite:///instance/trace.db
+    """
+
+    def progress(table, rows):
+        print(f"   {table}: {rows} rows", end="\r")
+
+    try:
+        copied = copy_database(source_uri, batch_size, progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for table, rows in copied.items():
+        print(f"✅ Copied {rows} rows of {table}")
+
+
+@app.cli.command("archive-visits")
+@click.option("--days", type=int, help="Archive visits older than this.")
+@click.option("--batch-size", default=1000, show_default=True)
+def archive_visits_command(days, batch_size):
+    """Move old visits from the visits table into the archive."""
+    if days is None:
+        days = app.config.get("VISIT_ARCHIVE_AFTER_DAYS", 60)
+
+    def progress(visits):
+        print(f"   {visits} visits", end="\r")
+
+    archived = archive_visits(timedelta(days=days), batch_size, progress=progress)
+    print(f"✅ Archived {archived} visits older than {days} days")
+
+
+@app.cli.command("purge-visits")
+@click.option("--days", type=int, help="Delete visits older than this.")
+@click.option("--batch-size", default=1000, show_default=True)
+def purge_visits_command(days, batch_size):
+    """Delete visits older than the retention period, archived or not."""
+    if days is None:
+        days = app.config.get("VISIT_RETENTION_DAYS")
+    if days is None:
+        raise click.ClickException(
+            "No retention period, set VISIT_RETENTION_DAYS or pass --days"
+        )
+
+    deleted = purge_visits(timedelta(days=days), batch_size)
+    if deleted > 0:
+        rebuild_activity()
+    print(f"✅ Deleted {deleted} visits older than {days} days")
+
+
+@app.cli.command("rebuild-activity")
+def rebuild_activity_command():
+    """Recompute the activity summaries of all users from their visits."""
+    users = rebuild_activity()
+    print(f"✅ Rebuilt the activity of {users} users")
+
+
+@app.cli.command("delete-inactive-users")
+@click.option("--days", default=365, show_default=True)
+@click.option("--yes", is_flag=True, help="Don't ask for confirmation.")
+def delete_inactive_users(days, yes):
+    """Delete users (and their visits) that haven't checked in for a while."""
+    users = inactive_users(days)
+    if len(users) == 0:
+        print("😴 No inactive users... nothing to do here")
+        return
+
+    for user in users:
+        print(f"   {user.email}")
+    if not yes:
+        click.confirm(f"Delete these {len(users)} users?", abort=True)
+
+    delete_users([user.id for user in users])
+    door_pass.revoke(*[user.id for user in users])
+    print(f"✅ Deleted {len(users)} users inactive for {days} days")
+
+
+@app.cli.command("revoke-door-pass")
+@click.argument("email")
+def revoke_door_pass(email):
+    """Make the door passes a member got so far invalid."""
+    user = User.query.filter(User.email == email).first()
+    if user is None:
+        print(f"🔥 There is no user with the email {email}")
+        return
+
+    door_pass.revoke(user.id)
+    print(f"✅ Revoked the door passes {email} got so far")
+
+
+@app.cli.command("bulk-check-in")
+@click.argument("users", nargs=-1)
+@click.option(
+    "--file",
+    type=click.File(),
+    help="Read the emails or ids from a file, one per line ('-' for stdin).",
+)
+@click.option(
+    "--at",
+    type=click.DateTime(["%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S"]),
+    help="When they arrived, by default now.",
+)
+def bulk_check_in_command(users, file, at):
+    """Check a group of users (by email or id) in at once."""
+    identifiers = list(users)
+    if file is not None:
+        identifiers += [line.strip() for line in file]
+
+    try:
+        results = bulk_check_in(identifiers, at)
+    except ValueError as e:
+        print(f"🔥 {e}")
+        return
+
+    for result in results:
+        print(f"   {result.identifier:<40} {result.status}")
+    checked_in = sum(1 for r in results if r.status == CHECKED_IN)
+    print(f"✅ Checked in {checked_in} of {len(results)} users")
+
+
+@app.cli.command("notify-expiring")
+@click.option("--sender", help="file, slack or module:Class (EXPIRY_SENDER)")
+@click.option("--dry-run", is_flag=True, help="Only list the due reminders.")
+def notify_expiring_command(sender, dry_run):
+    """Remind members whose certificate or test expires soon."""
+    if dry_run:
+        for notification in due_notifications():
+            print(f"   {notification.email:<40} {notification.message}")
+        return
+
+    result = notify_expiring(get_sender(sender))
+    print(f"✅ Sent {result['sent']} of {result['due']} due reminders")
+
+
+@app.cli.command("backup")
+@click.option("--dir", "directory", help="Where to keep them (BACKUP_DIR).")
+@click.option("--keep", type=int, help="How many to keep, 0 keeps all.")
+@click.option("--pages", type=int, help="Pages copied per step.")
+@click.option("--pause-ms", type=int, help="Pause after every step.")
+def backup_command(directory, keep, pages, pause_ms):
+    """Take a compressed snapshot of the database while the service runs."""
+    pause = pause_ms / 1000 if pause_ms is not None else None
+    try:
+        snapshot = create_backup(directory, pages, pause, keep)
+    except BackupException as e:
+        raise click.ClickException(e.message)
+
+    print(
+        f"✅ Backed up {snapshot.pages} pages in {snapshot.duration:.1f}s into "
+        f"{snapshot.path} ({snapshot.size / 1024 / 1024:.1f} MB, "
+        f"sha256 {snapshot.sha256[:12]})"
+    )
+
+
+@app.cli.command("verify-backup")
+@click.argument("paths", nargs=-1)
+def verify_backup_command(paths):
+    """Check the checksums and the integrity of snapshots (by default all)."""
+    paths = paths or snapshots()
+    if len(paths) == 0:
+        print("😴 There are no backups... nothing to do here")
+        return
+
+    failed = 0
+    for path in paths:
+        try:
+            verify_backup(path)
+            print(f"✅ {path}")
+        except BackupException as e:
+            print(f"🔥 {e.message}")
+            failed += 1
+    if failed > 0:
+        raise click.ClickException(f"{failed} of {len(paths)} backups are damaged")
+
+
+@app.cli.command("restore-backup")
+@click.argument("path", required=False)
+@click.option("--yes", is_flag=True, help="Don't ask for confirmation.")
+def restore_backup_command(path, yes):
+    """Replace the database with a snapshot (by default the newest)."""
+    if path is None:
+        if len(snapshots()) == 0:
+            raise click.ClickException("There are no backups")
+        path = snapshots()[-1]
+
+    try:
+        target = database_path()
+        if not yes:
+            click.confirm(
+                f"Stop the service first! Replace {target} with {path}?", abort=True
+            )
+        restore_backup(path, target)
+    except BackupException as e:
+        raise click.ClickException(e.message)
+    print(f"✅ Restored {path}")
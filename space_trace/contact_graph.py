@@ -0,0 +1,241 @@
+r"""Multi-hop contact tracing.
+
+Starting from an infected member this finds who was exposed via whom, up to a
+given number of hops. A member only passes an exposure on after they were
+exposed themselves, and only within a window after that.
+
+The graph is built from per-day co-presence adjacency lists (who overlapped
+with whom on a day and when). Days that are over don't change anymore so their
+adjacency is cached, which makes repeated queries during an outbreak cheap.
+Days are cached with and without the archived visits separately.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from space_trace import db, invalidation
+from space_trace.models import User
+from space_trace.retention import visit_source
+from space_trace.routing import read_only
+from space_trace.tracing import (
+    PRESENCE_DURATION,
+    Interval,
+    merge_intervals,
+    presence_interval,
+    total_duration,
+)
+
+# Who overlapped with whom on a day: user id -> other user id -> intervals
+Adjacency = Dict[int, Dict[int, List[Interval]]]
+
+# Number of closed days kept in the cache (a bit more than a year).
+_CACHE_SIZE = 400
+_day_cache: "OrderedDict[Tuple[date, bool], Adjacency]" = OrderedDict()
+_day_cache_lock = Lock()
+
+
+@dataclass
+class Exposure:
+    """A member reached by the contact graph."""
+
+    user: User
+    hop: int
+    exposed_at: datetime
+    via: Optional[User] = None
+
+
+@dataclass
+class ContactEdge:
+    """The source was in the HQ together with the target after exposure."""
+
+    source: int
+    target: int
+    exposed_at: datetime
+    overlap: timedelta
+
+
+@dataclass
+class ContactGraph:
+    exposures: List[Exposure] = field(default_factory=list)
+    edges: List[ContactEdge] = field(default_factory=list)
+
+
+def compute_day_adjacency(day: date, include_archive: bool = False) -> Adjacency:
+    """Compute who was in the HQ together with whom on a given day.
+
+    :param include_archive: Also consider the archived visits.
+    """
+    day_start = datetime.combine(day, time())
+    day_end = day_start + timedelta(days=1)
+
+    visit = visit_source(include_archive)
+    rows = (
+        db.session.query(visit.user, visit.timestamp)
+        .filter(visit.timestamp > day_start - PRESENCE_DURATION)
+        .filter(visit.timestamp < day_end)
+        .order_by(visit.timestamp)
+    )
+
+    # Clip everything to the day so that a visit around midnight is split
+    # into the two days it touches.
+    intervals: Dict[int, List[Interval]] = {}
+    for user_id, timestamp in rows:
+        start, end = presence_interval(timestamp)
+        start, end = max(start, day_start), min(end, day_end)
+        if start < end:
+            intervals.setdefault(user_id, []).append((start, end))
+
+    presences = sorted(
+        (start, end, user_id)
+        for user_id, user_intervals in intervals.items()
+        for start, end in merge_intervals(user_intervals)
+    )
+
+    # Sweep over the presences sorted by start, everybody who is still there
+    # when someone arrives overlaps with them.
+    adjacency: Adjacency = {}
+    active: List[tuple] = []
+    for start, end, user_id in presences:
+        active = [p for p in active if p[1] > start]
+        for other_start, other_end, other_id in active:
+            if other_id == user_id:
+                continue
+            overlap = (start, min(end, other_end))
+            adjacency.setdefault(user_id, {}).setdefault(other_id, []).append(overlap)
+            adjacency.setdefault(other_id, {}).setdefault(user_id, []).append(overlap)
+        active.append((start, end, user_id))
+
+    return adjacency
+
+
+def day_adjacency(day: date, include_archive: bool = False) -> Adjacency:
+    """Like `compute_day_adjacency` but cached for days that are over."""
+    # Today (and the future) can still get new visits.
+    if day >= date.today():
+        return compute_day_adjacency(day, include_archive)
+
+    key = (day, include_archive)
+    invalidation.refresh()
+    with _day_cache_lock:
+        if key in _day_cache:
+            _day_cache.move_to_end(key)
+            return _day_cache[key]
+
+    adjacency = compute_day_adjacency(day, include_archive)
+
+    with _day_cache_lock:
+        _day_cache[key] = adjacency
+        while len(_day_cache) > _CACHE_SIZE:
+            _day_cache.popitem(last=False)
+
+    return adjacency
+
+
+@invalidation.on_invalidate
+def forget_days(days: List[date]):
+    with _day_cache_lock:
+        for day in days:
+            _day_cache.pop((day, False), None)
+            _day_cache.pop((day, True), None)
+
+
+def clear_adjacency_cache():
+    with _day_cache_lock:
+        _day_cache.clear()
+
+
+def contacts_after(
+    user_id: int,
+    exposed_at: datetime,
+    window: timedelta,
+    include_archive: bool = False,
+) -> Dict[int, List[Interval]]:
+    """All overlaps of a user within [exposed_at, exposed_at + window)."""
+    window_end = min(exposed_at + window, datetime.now())
+    contacts: Dict[int, List[Interval]] = {}
+
+    day = exposed_at.date()
+    while datetime.combine(day, time()) < window_end:
+        adjacency = day_adjacency(day, include_archive)
+        for other_id, overlaps in adjacency.get(user_id, {}).items():
+            for start, end in overlaps:
+                start, end = max(start, exposed_at), min(end, window_end)
+                if start < end:
+                    contacts.setdefault(other_id, []).append((start, end))
+        day += timedelta(days=1)
+
+    return {other_id: merge_intervals(o) for other_id, o in contacts.items()}
+
+
+@read_only()
+def build_contact_graph(
+    infected_id: int,
+    start: datetime,
+    depth: int = 2,
+    window: timedelta = timedelta(days=14),
+    include_archive: bool = False,
+) -> ContactGraph:
+    """Find who was exposed via whom, with a breadth first search.
+
+    :param infected_id: The id of the member the tracing starts with.
+    :param start: Since when the infected member is considered contagious.
+    :param depth: The maximal number of hops from the infected member.
+    :param window: How long after their own exposure a member can pass it on.
+    :param include_archive: Also consider the archived visits.
+    """
+    exposed_at: Dict[int, datetime] = {infected_id: start}
+    hops: Dict[int, int] = {infected_id: 0}
+    via: Dict[int, int] = {}
+    edges: List[ContactEdge] = []
+
+    frontier = [infected_id]
+    for hop in range(1, depth + 1):
+        next_frontier = []
+        for source in frontier:
+            contacts = contacts_after(
+                source, exposed_at[source], window, include_archive
+            )
+            for target, overlaps in contacts.items():
+                # Only edges to new members or other members of this hop, the
+                # others were already exposed earlier.
+                if hops.get(target, hop) < hop:
+                    continue
+
+                target_exposed_at = overlaps[0][0]
+                edges.append(
+                    ContactEdge(
+                        source=source,
+                        target=target,
+                        exposed_at=target_exposed_at,
+                        overlap=total_duration(overlaps),
+                    )
+                )
+
+                if target not in hops:
+                    hops[target] = hop
+                    next_frontier.append(target)
+                if target not in exposed_at or target_exposed_at < exposed_at[target]:
+                    exposed_at[target] = target_exposed_at
+                    via[target] = source
+
+        frontier = next_frontier
+        if len(frontier) == 0:
+            break
+
+    users = {u.id: u for u in User.query.filter(User.id.in_(hops.keys())).all()}
+    exposures = [
+        Exposure(
+            user=users[user_id],
+            hop=hops[user_id],
+            exposed_at=exposed_at[user_id],
+            via=users.get(via.get(user_id)),
+        )
+        for user_id in hops
+        if user_id in users
+    ]
+    exposures.sort(key=lambda e: (e.hop, e.exposed_at, e.user.email))
+
+    return ContactGraph(exposures=exposures, edges=edges)
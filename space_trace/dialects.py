@@ -0,0 +1,77 @@
+r"""SQL that differs between the supported databases (SQLite and PostgreSQL).
+
+The time buckets are SQL expressions that format a timestamp as text, like
+`strftime` in SQLite or `to_char` in PostgreSQL. They are compiled for the
+dialect of the engine that runs the query, so the same query works on both.
+"""
+
+from sqlalchemy import String, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+class _time_bucket(FunctionElement):
+    type = String()
+    inherit_cache = True
+
+    sqlite_format = ""
+    postgresql_format = ""
+
+
+class hour_bucket(_time_bucket):
+    """The hour of the day of a timestamp, like `08`."""
+
+    name = "hour_bucket"
+    inherit_cache = True
+    sqlite_format = "%H"
+    postgresql_format = "HH24"
+
+
+class day_bucket(_time_bucket):
+    """The day of a timestamp, like `2022-03-01`."""
+
+    name = "day_bucket"
+    inherit_cache = True
+    sqlite_format = "%Y-%m-%d"
+    postgresql_format = "YYYY-MM-DD"
+
+
+class month_bucket(_time_bucket):
+    """The month of a timestamp, like `2022-03`."""
+
+    name = "month_bucket"
+    inherit_cache = True
+    sqlite_format = "%Y-%m"
+    postgresql_format = "YYYY-MM"
+
+
+@compiles(_time_bucket, "sqlite")
+def _compile_sqlite(element, compiler, **kwargs):
+    column = compiler.process(element.clauses, **kwargs)
+    return f"strftime('{element.sqlite_format}', {column})"
+
+
+@compiles(_time_bucket, "postgresql")
+def _compile_postgresql(element, compiler, **kwargs):
+    column = compiler.process(element.clauses, **kwargs)
+    return f"to_char({column}, '{element.postgresql_format}')"
+
+
+def lock_user(connection, user_id: int):
+    """Serialise writes per user till the end of the transaction.
+
+    SQLite only has one writer at a time anyway, PostgreSQL needs an advisory
+    lock so that two concurrent transactions can't both see the user as not
+    checked in.
+
+    :param connection: A connection or session.
+    """
+    if hasattr(connection, "dialect"):
+        dialect = connection.dialect
+    else:
+        dialect = connection.get_bind().dialect
+
+    if dialect.name == "postgresql":
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:user_id)"), {"user_id": user_id}
+        )
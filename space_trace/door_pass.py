@@ -0,0 +1,193 @@
+r"""Signed door passes, scanned by kiosks at the entrance.
+
+The home page shows a QR code with a short-lived pass: the id and team of the
+member and until when their 2G is valid, signed with the `SECRET_KEY`. A kiosk
+posts the scanned pass to `/kiosk/scan`, which only checks the signature and
+the dates, without reading the database, and checks the member in.
+
+A pass can't be taken back once it is issued, so passes of members who
+deleted their certificate (or were deleted) are revoked: every revocation is
+appended to a small file in the instance folder, which every worker keeps in
+memory and only reads again when it changed. Revocations are forgotten once
+all passes issued before them have expired.
+"""
+
+import fcntl
+import hmac
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from space_trace import app
+from space_trace.models import User
+
+# Keeps door passes from being accepted as any other signed value.
+_SALT = "door-pass"
+
+
+class DoorPassError(Exception):
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+
+@dataclass(frozen=True)
+class DoorPass:
+    user_id: int
+    team: str
+    valid_till: datetime
+    issued_at: datetime
+
+
+def enabled() -> bool:
+    """Door passes are only shown if there is a kiosk to scan them."""
+    return len(app.config.get("KIOSK_KEYS", [])) > 0
+
+
+def max_age() -> int:
+    return app.config.get("DOOR_PASS_MAX_AGE", 3600)
+
+
+def _serializer() -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(app.secret_key, salt=_SALT)
+
+
+def issue(user: User) -> str:
+    """A signed pass for a user with 2G."""
+    deadline = user.valid_till()
+    if deadline is None:
+        raise DoorPassError("no_2g", "You need a valid certificate for a door pass")
+
+    # Short keys, the QR code gets smaller the shorter the pass is.
+    return _serializer().dumps(
+        {"u": user.id, "t": user.team, "v": int(deadline.timestamp())}
+    )
+
+
+def verify(token: str, now: Optional[datetime] = None) -> DoorPass:
+    """Check a scanned pass, without reading the database.
+
+    :raises DoorPassError: If the pass is forged, expired, the 2G of the
+        member ran out or the pass was revoked.
+    """
+    if now is None:
+        now = datetime.now()
+
+    try:
+        payload, issued_at = _serializer().loads(
+            token, max_age=max_age(), return_timestamp=True
+        )
+        door_pass = DoorPass(
+            user_id=int(payload["u"]),
+            team=str(payload["t"]),
+            valid_till=datetime.fromtimestamp(payload["v"]),
+            issued_at=datetime.fromtimestamp(issued_at.timestamp()),
+        )
+    except SignatureExpired:
+        raise DoorPassError("expired", "The door pass expired, reload the page")
+    except (BadSignature, KeyError, TypeError, ValueError):
+        raise DoorPassError("invalid", "This is not a door pass")
+
+    if door_pass.valid_till < now:
+        raise DoorPassError("no_2g", "The certificate expired")
+    if deny_list.is_revoked(door_pass.user_id, door_pass.issued_at.timestamp()):
+        raise DoorPassError("revoked", "The door pass was revoked, reload the page")
+    return door_pass
+
+
+def is_kiosk_key(key: str) -> bool:
+    return any(
+        hmac.compare_digest(key.encode(), known.encode())
+        for known in app.config.get("KIOSK_KEYS", [])
+    )
+
+
+class DenyList:
+    """Revoked users with the time of the revocation, shared through a file.
+
+    Every line of the file is `<user id> <unix time>`. A pass is revoked if it
+    was issued before (or in the same second as) the last revocation of its
+    user.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._revoked: Dict[int, float] = {}
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._path: Optional[str] = None
+
+    def path(self) -> str:
+        return app.config.get("DOOR_PASS_DENY_LIST") or os.path.join(
+            app.instance_path, "door_pass_revoked"
+        )
+
+    def _parse(self, lines: Iterable[str], cutoff: float) -> Dict[int, float]:
+        revoked: Dict[int, float] = {}
+        for line in lines:
+            try:
+                user_id, revoked_at = line.split()
+                user, at = int(user_id), float(revoked_at)
+            except ValueError:
+                continue
+            if at >= cutoff:
+                revoked[user] = max(at, revoked.get(user, at))
+        return revoked
+
+    def _refresh(self):
+        path = self.path()
+        try:
+            stat = os.stat(path)
+            stamp: Optional[Tuple[int, int]] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+
+        with self._lock:
+            if stamp == self._stamp and path == self._path:
+                return
+            revoked: Dict[int, float] = {}
+            if stamp is not None:
+                with open(path) as file:
+                    revoked = self._parse(file, time() - max_age() - 1)
+            self._revoked, self._stamp, self._path = revoked, stamp, path
+
+    def is_revoked(self, user_id: int, issued_at: float) -> bool:
+        self._refresh()
+        revoked_at = self._revoked.get(user_id)
+        # The timestamps of passes only have a precision of seconds.
+        return revoked_at is not None and int(issued_at) <= revoked_at
+
+    def revoke(self, user_ids: Iterable[int]):
+        """Revoke all passes issued to the users so far."""
+        path = self.path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        now = time()
+        with open(path, "a+") as file:
+            # Other workers (or the CLI) might revoke at the same time.
+            fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            revoked = self._parse(file, now - max_age() - 1)
+            for user_id in user_ids:
+                revoked[user_id] = now
+
+            # Rewrite it without the revocations that don't matter anymore,
+            # so the file stays as small as the number of recent ones.
+            file.seek(0)
+            file.truncate()
+            file.writelines(f"{u} {at:.3f}\n" for u, at in revoked.items())
+            file.flush()
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+        self._refresh()
+
+
+deny_list = DenyList()
+
+
+def revoke(*user_ids: int):
+    deny_list.revoke(user_ids)
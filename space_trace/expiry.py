@@ -0,0 +1,220 @@
+r"""Reminders for members whose 2G runs out soon.
+
+`flask notify-expiring` runs once a day (see `space-trace-notify.timer`). It
+finds everyone whose certificate or test expires within the reminder days
+(`EXPIRY_NOTIFY_DAYS`, by default 21 and 7) with one range query over the
+indexes on `vaccinated_till` and `tested_till`, and sends them a reminder in
+batches. Every reminder is recorded, so it is only sent once per certificate,
+and uploads are spread over the weeks before instead of the morning a
+certificate runs out.
+
+How the reminders are delivered is up to the sender (`EXPIRY_SENDER`):
+
+- `file`: appends them as JSON lines to `EXPIRY_NOTIFICATION_FILE`, for
+  development and tests
+- `slack`: a direct message to the member on Slack
+- `module:Class`: any class with a `send` method like the two above
+"""
+
+import importlib
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from space_trace import app, db
+from space_trace.models import ExpiryNotification, SlackUser, User
+
+
+@dataclass
+class Notification:
+    user_id: int
+    email: str
+    valid_till: datetime
+    # The reminder this is, like 7 days before
+    days: int
+    message: str
+
+
+class FileSender:
+    """Appends notifications as JSON lines to a file."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or app.config.get(
+            "EXPIRY_NOTIFICATION_FILE",
+            os.path.join(app.instance_path, "notifications.jsonl"),
+        )
+
+    def send(self, notifications: List[Notification]) -> List[Notification]:
+        """Deliver the notifications.
+
+        :return: The notifications that were delivered, only these are
+            recorded as sent.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as file:
+            for notification in notifications:
+                line = {
+                    **notification.__dict__,
+                    "valid_till": notification.valid_till.isoformat(),
+                }
+                file.write(json.dumps(line) + "\n")
+        return notifications
+
+
+class SlackSender:
+    """Sends every notification as a direct message on Slack.
+
+    Members are found by their email in the cached Slack directory, members
+    that aren't in it are tried again the next time.
+    """
+
+    def send(self, notifications: List[Notification]) -> List[Notification]:
+        from slack_sdk.errors import SlackApiError
+
+        from space_trace.slack import slack_client
+
+        emails = [n.email for n in notifications]
+        slack_ids = dict(
+            db.session.query(SlackUser.email, SlackUser.id).filter(
+                SlackUser.email.in_(emails)
+            )
+        )
+        db.session.commit()
+
+        client = slack_client()
+        sent = []
+        for notification in notifications:
+            slack_id = slack_ids.get(notification.email)
+            if slack_id is None:
+                app.logger.warning(f"{notification.email} is not on Slack")
+                continue
+            try:
+                client.chat_postMessage(channel=slack_id, text=notification.message)
+            except SlackApiError as e:
+                app.logger.warning(f"Couldn't remind {notification.email}: {e}")
+                continue
+            sent.append(notification)
+        return sent
+
+
+SENDERS = {"file": FileSender, "slack": SlackSender}
+
+
+def get_sender(name: Optional[str] = None):
+    if name is None:
+        name = app.config.get("EXPIRY_SENDER", "file")
+    if name in SENDERS:
+        return SENDERS[name]()
+
+    module, _, cls = name.partition(":")
+    return getattr(importlib.import_module(module), cls)()
+
+
+def reminder_days() -> List[int]:
+    return sorted(app.config.get("EXPIRY_NOTIFY_DAYS", [21, 7]))
+
+
+def _message(user: User, valid_till: datetime, days_left: int) -> str:
+    what = "test"
+    if user.is_vaccinated() and user.vaccinated_till == valid_till.date():
+        what = "vaccination certificate"
+    when = "today" if days_left == 0 else f"in {days_left} day(s)"
+    return (
+        f"Your {what} for the HQ expires {when} ({valid_till:%Y-%m-%d %H:%M}). "
+        "Upload a new one in time, so you can still check in."
+    )
+
+
+def expiring_users(now: datetime, horizon: timedelta):
+    """The users with a certificate or test expiring before now + horizon.
+
+    Only reads the users with one of the dates in range, via their indexes.
+    """
+    return User.query.filter(
+        db.or_(
+            User.vaccinated_till.between(now.date(), now.date() + horizon),
+            User.tested_till.between(now, now + horizon),
+        )
+    )
+
+
+def due_notifications(now: Optional[datetime] = None) -> List[Notification]:
+    """The reminders to send, that weren't sent yet."""
+    if now is None:
+        now = datetime.now()
+    today = now.date()
+    days = reminder_days()
+    horizon = timedelta(days=days[-1])
+
+    users = expiring_users(now, horizon).all()
+    # Only the reminders of certificates that are still valid matter.
+    sent = {
+        tuple(row)
+        for row in db.session.query(
+            ExpiryNotification.user,
+            ExpiryNotification.valid_till,
+            ExpiryNotification.days,
+        ).filter(ExpiryNotification.valid_till >= now)
+    }
+    db.session.commit()
+
+    notifications = []
+    for user in users:
+        # The other certificate might last longer
+        valid_till = user.valid_till()
+        if valid_till is None:
+            continue
+        days_left = (valid_till.date() - today).days
+        reminder = next((d for d in days if days_left <= d), None)
+        if reminder is None or (user.id, valid_till, reminder) in sent:
+            continue
+        notifications.append(
+            Notification(
+                user.id,
+                user.email,
+                valid_till,
+                reminder,
+                _message(user, valid_till, days_left),
+            )
+        )
+    return notifications
+
+
+def _batches(notifications: List[Notification], size: int) -> Iterable[list]:
+    for i in range(0, len(notifications), size):
+        yield notifications[i : i + size]
+
+
+def notify_expiring(sender=None, batch_size: Optional[int] = None) -> Dict[str, int]:
+    """Send the due reminders and record them.
+
+    Every batch is recorded right after it was sent, so a failing sender
+    only sends the failed batch again the next time.
+
+    :return: How many reminders were due and how many were sent.
+    """
+    if sender is None:
+        sender = get_sender()
+    if batch_size is None:
+        batch_size = app.config.get("EXPIRY_NOTIFY_BATCH_SIZE", 100)
+
+    due = due_notifications()
+    sent = 0
+    for batch in _batches(due, batch_size):
+        delivered = sender.send(batch)
+        now = datetime.now()
+        db.session.add_all(
+            ExpiryNotification(n.user_id, n.valid_till, n.days, now) for n in delivered
+        )
+        db.session.commit()
+        sent += len(delivered)
+
+    # Reminders of certificates that expired can't be sent again.
+    db.session.query(ExpiryNotification).filter(
+        ExpiryNotification.valid_till < datetime.now()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    return {"due": len(due), "sent": sent}
@@ -2,43 +2,36 @@ r"""
 """
 
 import csv
+import json
 from datetime import datetime, timedelta
 from io import StringIO
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, List
+
+from flask_sqlalchemy import BaseQuery as Query
 
 from space_trace import db
 from space_trace import slack
-from space_trace.models import User, Visit
+from space_trace.contact_graph import ContactGraph
+from space_trace.exposure import ExposureMatrix
+from space_trace.models import User, UserNames, UserRecord
+from space_trace.retention import visit_source
+from space_trace.routing import read_only
 from space_trace.slack import get_slack_handle_table
+from space_trace.tracing import Contact, find_contacts
 
 
-def get_contacts_of(start: datetime, infected_id: int):
-    # This may look weired but we need to do a bit of arithmetic with both
-    # timestamps. At the moment both timestamps point to the
-    # start of the day (0:00) but end should point to the last minute so if
-    # both point to the same day one whole day gets selected.
-    # Actually start should point to 12h before that because members that only
-    # logged in 12h before are still considered as in the HQ.
-    start = start - timedelta(hours=12)
+@read_only()
+def get_contacts_of(
+    start: datetime, infected_id: int, include_archive: bool = False
+) -> List[Contact]:
+    # Members that logged in 12h before start are still in the HQ, the
+    # tracing engine accounts for that by modelling visits as intervals.
+    return find_contacts(infected_id, start, include_archive=include_archive)
 
-    # Get all contacts of the infected
-    visit1: Visit = db.aliased(Visit)
-    visit2: Visit = db.aliased(Visit)
-    users = (
-        db.session.query(User)
-        .filter(visit1.user == infected_id)
-        .filter(visit1.timestamp > start)
-        .filter(visit2.timestamp > db.func.date(visit1.timestamp, "-12 hours"))
-        .filter(visit2.timestamp < db.func.date(visit1.timestamp, "+12 hours"))
-        .filter(User.id == visit2.user)
-        .filter(User.id != infected_id)
-        .all()
-    )
 
-    return users
-
-
-def get_users_between(start: datetime, end: datetime):
+def get_users_between(
+    start: datetime, end: datetime, include_archive: bool = False
+) -> Query:
     # This may look weired but we need to do a bit of arithmetic with both
     # timestamps. At the moment both timestamps point to the
     # start of the day (0:00) but end should point to the last minute so if
@@ -48,37 +41,172 @@ def get_users_between(start: datetime, end: datetime):
     start = start - timedelta(hours=12)
     end = end + timedelta(hours=24)
 
-    # Get all users in that time period
-    users = (
-        db.session.query(User)
-        .filter(User.id == Visit.user)
-        .filter(db.and_(Visit.timestamp > start, Visit.timestamp < end))
-        .all()
+    # Get all users in that time period, every user only once. The visits are
+    # found through the timestamp index (a correlated EXISTS would scan the
+    # visits of every user instead). The query is returned unevaluated so the
+    # caller can stream it.
+    visit = visit_source(include_archive)
+    visitors = db.select([visit.user]).where(
+        db.and_(visit.timestamp > start, visit.timestamp < end)
     )
-    return users
+    return User.query.filter(User.id.in_(visitors)).order_by(User.email)
+
+
+# Number of rows fetched at once when streaming an export
+STREAM_BATCH_SIZE = 500
+
+CSV_HEADER = ["first name", "last name", "team", "email", "slack handle"]
+
+
+def _user_row(user: UserNames, slack_handle_table: Dict[str, str]) -> List[str]:
+    try:
+        slack_handle = slack_handle_table[user.email]
+    except KeyError:
+        slack_handle = "@" + user.full_name()
 
+    return [
+        user.first_name(),
+        user.last_name(),
+        user.team,
+        user.email,
+        slack_handle,
+    ]
 
-def users_to_csv(users: List[User]) -> str:
+
+def _user_records(ids: Iterable[int]) -> List[UserRecord]:
+    query = db.session.query(*UserRecord.columns).filter(User.id.in_(ids))
+    return [UserRecord(*row) for row in query]
+
+
+def _csv_line(row: List[Any]) -> str:
+    si = StringIO()
+    csv.writer(si).writerow(row)
+    return si.getvalue()
+
+
+def stream_users_csv(users: Iterable[UserNames]) -> Iterator[str]:
+    """Generate the CSV export line by line.
+
+    If users is a query of users it is fetched in batches (only the columns
+    the export needs), so the export can be sent to the client while the rows
+    are still being read.
+    """
+    yield _csv_line(CSV_HEADER)
+
+    slack_handle_table = get_slack_handle_table()
+
+    with read_only():
+        if isinstance(users, Query):
+            rows = users.with_entities(*UserRecord.columns)
+            users = (UserRecord(*row) for row in rows.yield_per(STREAM_BATCH_SIZE))
+
+        for user in users:
+            yield _csv_line(_user_row(user, slack_handle_table))
+
+
+def stream_contacts_csv(contacts: Iterable[Contact]) -> Iterator[str]:
+    yield _csv_line(CSV_HEADER + ["overlap (hours)", "overlapping days"])
+
+    slack_handle_table = get_slack_handle_table()
+
+    for contact in contacts:
+        yield _csv_line(
+            _user_row(contact.user, slack_handle_table)
+            + [
+                f"{contact.overlap.total_seconds() / 3600:.1f}",
+                " ".join(day.isoformat() for day in contact.days),
+            ]
+        )
+
+
+def contact_graph_to_csv(graph: ContactGraph) -> str:
     si = StringIO()
     cw = csv.writer(si)
-    cw.writerow(["first name", "last name", "team", "email", "slack handle"])
+    cw.writerow(["hop"] + CSV_HEADER + ["exposed at", "exposed via"])
 
     slack_handle_table = get_slack_handle_table()
 
-    for user in users:
-        try:
-            slack_handle = slack_handle_table[user.email]
-        except KeyError:
-            slack_handle = "@" + user.full_name()
+    for exposure in graph.exposures:
+        cw.writerow(
+            [exposure.hop]
+            + _user_row(exposure.user, slack_handle_table)
+            + [
+                exposure.exposed_at.isoformat(timespec="minutes"),
+                "" if exposure.via is None else exposure.via.email,
+            ]
+        )
+
+    return si.getvalue()
+
+
+def contact_graph_to_json(graph: ContactGraph) -> str:
+    """Serialize the graph as a list of nodes and an edge list."""
+    nodes = [
+        {
+            "id": exposure.user.id,
+            "name": exposure.user.full_name(),
+            "email": exposure.user.email,
+            "team": exposure.user.team,
+            "hop": exposure.hop,
+            "exposed_at": exposure.exposed_at.isoformat(timespec="minutes"),
+        }
+        for exposure in graph.exposures
+    ]
+    edges = [
+        {
+            "source": edge.source,
+            "target": edge.target,
+            "exposed_at": edge.exposed_at.isoformat(timespec="minutes"),
+            "overlap_hours": round(edge.overlap.total_seconds() / 3600, 1),
+        }
+        for edge in graph.edges
+    ]
+    return json.dumps({"nodes": nodes, "edges": edges}, indent=2)
+
+
+def exposure_pairs_to_csv(matrix: ExposureMatrix, limit: int) -> str:
+    pairs = matrix.top_pairs(limit)
+    ids = {user_id for pair in pairs for user_id in pair[:2]}
+    users = {u.id: u for u in _user_records(ids)}
 
+    si = StringIO()
+    cw = csv.writer(si)
+    cw.writerow(["name", "team", "email", "name", "team", "email", "hours"])
+    for a, b, hours in pairs:
+        row = []
+        for user in (users[a], users[b]):
+            row += [user.full_name(), user.team, user.email]
+        cw.writerow(row + [f"{hours:.1f}"])
+
+    return si.getvalue()
+
+
+def exposure_totals_to_csv(matrix: ExposureMatrix) -> str:
+    totals = matrix.totals()
+    ids = [user_id for user_id, _ in totals]
+    users = {u.id: u for u in _user_records(ids)}
+
+    si = StringIO()
+    cw = csv.writer(si)
+    cw.writerow(["first name", "last name", "team", "email", "hours"])
+    for user_id, hours in totals:
+        user = users[user_id]
         cw.writerow(
             [
                 user.first_name(),
                 user.last_name(),
                 user.team,
                 user.email,
-                slack_handle,
+                f"{hours:.1f}",
             ]
         )
 
     return si.getvalue()
+
+
+def occupancy_to_csv(occupancy: Dict[str, list]) -> str:
+    si = StringIO()
+    cw = csv.writer(si)
+    cw.writerow(["time", "peak occupancy"])
+    cw.writerows(zip(occupancy["labels"], occupancy["data"]))
+    return si.getvalue()
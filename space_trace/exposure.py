@@ -0,0 +1,227 @@
+r"""Whole-team exposure reports.
+
+For every pair of members this calculates how long they were in the HQ
+together in a date range. Instead of tracing every member on their own, all
+visits of the range are loaded into arrays and the overlaps are calculated with
+vectorised interval arithmetic.
+
+The result is a sparse matrix, only pairs that actually met are stored.
+"""
+
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+import numpy as np
+
+from space_trace import db
+from space_trace.retention import visit_source
+from space_trace.routing import read_only
+from space_trace.tracing import PRESENCE_DURATION
+
+# Upper bound of candidate pairs processed at once, to bound the memory.
+_CHUNK_SIZE = 2_000_000
+
+# Up to this many cells (about 1000 members, 8MB) the sums are accumulated in a
+# dense array, which is faster. With more members they are accumulated sparse.
+_DENSE_LIMIT = 1_000_000
+
+
+class ExposureMatrix:
+    """A sparse, symmetric users×users matrix of shared seconds in the HQ.
+
+    Every pair is stored once with `rows[i] < cols[i]`, both are indexes into
+    `user_ids`.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        seconds: np.ndarray,
+    ):
+        self.user_ids = user_ids
+        self.rows = rows
+        self.cols = cols
+        self.seconds = seconds
+
+    def dense(self) -> np.ndarray:
+        """The full matrix in hours, only use this for small teams."""
+        n = len(self.user_ids)
+        matrix = np.zeros((n, n))
+        matrix[self.rows, self.cols] = self.seconds / 3600
+        matrix[self.cols, self.rows] = self.seconds / 3600
+        return matrix
+
+    def top_pairs(self, limit: int = 100) -> List[Tuple[int, int, float]]:
+        """The pairs that spent the most time together.
+
+        :return: List of (user id, user id, hours), the longest first.
+        """
+        if limit <= 0 or len(self.seconds) == 0:
+            return []
+
+        limit = min(limit, len(self.seconds))
+        top = np.argpartition(-self.seconds, limit - 1)[:limit]
+        top = top[np.argsort(-self.seconds[top], kind="stable")]
+        return [
+            (
+                int(self.user_ids[self.rows[i]]),
+                int(self.user_ids[self.cols[i]]),
+                float(self.seconds[i] / 3600),
+            )
+            for i in top
+        ]
+
+    def totals(self) -> List[Tuple[int, float]]:
+        """Per member the sum of hours spent together with others.
+
+        :return: List of (user id, hours), the most exposed first.
+        """
+        n = len(self.user_ids)
+        seconds = np.bincount(self.rows, weights=self.seconds, minlength=n)
+        seconds += np.bincount(self.cols, weights=self.seconds, minlength=n)
+        order = np.argsort(-seconds, kind="stable")
+        return [
+            (int(self.user_ids[i]), float(seconds[i] / 3600))
+            for i in order
+            if seconds[i] > 0
+        ]
+
+
+def load_intervals(
+    start: datetime, end: datetime, include_archive: bool = False
+) -> Tuple[np.ndarray, ...]:
+    """Load all presence intervals overlapping [start, end) as arrays.
+
+    :param include_archive: Also load the archived visits.
+    :return: (user ids, starts, ends) with the times in seconds since start.
+    """
+    visit = visit_source(include_archive)
+    rows = (
+        db.session.query(visit.user, visit.timestamp)
+        .filter(visit.timestamp > start - PRESENCE_DURATION)
+        .filter(visit.timestamp < end)
+        .all()
+    )
+
+    users = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    timestamps = np.array([r[1] for r in rows], dtype="datetime64[s]")
+    starts = (timestamps - np.datetime64(start, "s")).astype(np.int64)
+    ends = starts + int(PRESENCE_DURATION.total_seconds())
+
+    # Clip to the range
+    span = int((end - start).total_seconds())
+    return users, np.clip(starts, 0, span), np.clip(ends, 0, span)
+
+
+def merge_user_intervals(
+    users: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> Tuple[np.ndarray, ...]:
+    """Merge the overlapping intervals of each user.
+
+    A member checking in twice within 12h would otherwise be counted twice.
+    """
+    if len(users) == 0:
+        return users, starts, ends
+
+    order = np.lexsort((starts, users))
+    users, starts, ends = users[order], starts[order], ends[order]
+
+    # The running maximum of the ends within a user. Shifting every user by
+    # more than the whole span lets one accumulate work across all users.
+    group = np.unique(users, return_inverse=True)[1].astype(np.int64)
+    offset = group * (int(ends.max()) + 1)
+    running_end = np.maximum.accumulate(ends + offset) - offset
+
+    new_group = np.ones(len(users), dtype=bool)
+    new_group[1:] = (users[1:] != users[:-1]) | (starts[1:] > running_end[:-1])
+    group_starts = np.flatnonzero(new_group)
+
+    return (
+        users[group_starts],
+        starts[group_starts],
+        np.maximum.reduceat(ends, group_starts),
+    )
+
+
+@read_only()
+def exposure_matrix(
+    start: datetime, end: datetime, include_archive: bool = False
+) -> ExposureMatrix:
+    """Calculate how long every pair of members was in the HQ together.
+
+    :param start: The start of the range.
+    :param end: The (exclusive) end of the range.
+    :param include_archive: Also consider the archived visits.
+    """
+    intervals = load_intervals(start, end, include_archive)
+    users, starts, ends = merge_user_intervals(*intervals)
+    keep = starts < ends
+    users, starts, ends = users[keep], starts[keep], ends[keep]
+
+    user_ids, user_index = np.unique(users, return_inverse=True)
+    n_users = len(user_ids)
+
+    order = np.argsort(starts, kind="stable")
+    user_index, starts, ends = user_index[order], starts[order], ends[order]
+
+    # As the intervals are sorted by start, all intervals overlapping
+    # interval i from the right are the ones from i + 1 up to the first one
+    # starting after i ends.
+    stop = np.searchsorted(starts, ends, side="left")
+    counts = np.maximum(stop - np.arange(len(starts)) - 1, 0)
+
+    dense = n_users * n_users <= _DENSE_LIMIT
+    totals = np.zeros(n_users * n_users if dense else 0)
+    keys = np.array([], dtype=np.int64)
+    seconds = np.array([], dtype=np.float64)
+    first = 0
+    while first < len(starts):
+        # Take as many intervals as fit into one chunk (but at least one).
+        cumulative = np.cumsum(counts[first:])
+        last = first + max(int(np.searchsorted(cumulative, _CHUNK_SIZE)), 1)
+        chunk_counts = counts[first:last]
+        total = int(chunk_counts.sum())
+
+        i = np.repeat(np.arange(first, last), chunk_counts)
+        chunk_offsets = np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+        j = i + 1 + (np.arange(total) - chunk_offsets)
+
+        overlap = np.minimum(ends[i], ends[j]) - starts[j]
+        a, b = user_index[i], user_index[j]
+        valid = (overlap > 0) & (a != b)
+        a, b, overlap = a[valid], b[valid], overlap[valid]
+
+        # Sum up the chunk right away, there are far fewer pairs of members
+        # than pairs of visits.
+        chunk_keys = np.minimum(a, b) * n_users + np.maximum(a, b)
+        if dense:
+            totals += np.bincount(chunk_keys, weights=overlap, minlength=len(totals))
+        else:
+            keys, seconds = _sum_by_key(
+                np.concatenate([keys, chunk_keys]),
+                np.concatenate([seconds, overlap]),
+            )
+        first = last
+
+    if dense:
+        keys = np.flatnonzero(totals)
+        seconds = totals[keys]
+
+    return ExposureMatrix(user_ids, keys // n_users, keys % n_users, seconds)
+
+
+def _sum_by_key(keys: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, ...]:
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=values, minlength=len(unique))
+
+
+def exposure_matrix_between(
+    start: datetime, end: datetime, include_archive: bool = False
+) -> ExposureMatrix:
+    """Like `exposure_matrix` but for whole days, like the contact export.
+
+    Both dates are inclusive so the range ends at the end of the end day.
+    """
+    return exposure_matrix(start, end + timedelta(days=1), include_archive)
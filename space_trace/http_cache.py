@@ -0,0 +1,199 @@
+r"""HTTP caching for public pages and static files.
+
+Pages that look the same for every guest (like `/statistic` or `/help`) are
+kept for a few seconds in files in the instance folder, which all gunicorn
+workers share. Logged in users (and guests with flash messages) always get a
+freshly rendered page. Every page gets an `ETag`, so browsers that already
+have it only get an empty 304 back. The pages are cached by their path, query
+strings don't change them, so made up URLs can't fill up the disk.
+
+Static files are linked with a fingerprint of their content (`?v=...`), so
+they can be cached forever: a new version has a different URL.
+"""
+
+import hashlib
+import os
+from functools import lru_cache, wraps
+from tempfile import NamedTemporaryFile
+from time import time
+from typing import Optional, Tuple
+
+from flask import Response, request, session
+
+from space_trace import app
+
+# Static files with a fingerprint never change, so browsers may keep them.
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# The most pages kept in the cache, the oldest are deleted first.
+MAX_CACHED_PAGES = 64
+
+
+def _cache_dir() -> str:
+    return app.config.get("PAGE_CACHE_DIR") or os.path.join(
+        app.instance_path, "page_cache"
+    )
+
+
+_PAGE_PREFIX = "page-"
+
+
+def _cache_path(key: str) -> str:
+    name = _PAGE_PREFIX + hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(_cache_dir(), name)
+
+
+def _read_cached(key: str, ttl: int) -> Optional[bytes]:
+    try:
+        path = _cache_path(key)
+        if os.path.getmtime(path) < time() - ttl:
+            return None
+        with open(path, "rb") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def _prune(ttl: int):
+    """Delete the expired pages, and the oldest ones if there are too many."""
+    now = time()
+    pages = []
+    for entry in os.scandir(_cache_dir()):
+        try:
+            mtime = entry.stat().st_mtime
+            if mtime < now - ttl:
+                os.unlink(entry.path)
+            elif entry.name.startswith(_PAGE_PREFIX):
+                pages.append((mtime, entry.path))
+        except FileNotFoundError:
+            # Another worker was faster
+            pass
+
+    pages.sort()
+    for _, path in pages[: max(len(pages) - MAX_CACHED_PAGES, 0)]:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _write_cached(key: str, body: bytes, ttl: int):
+    os.makedirs(_cache_dir(), exist_ok=True)
+    # Write to a temporary file first, so that other workers never read a
+    # half written page.
+    with NamedTemporaryFile(dir=_cache_dir(), prefix=".tmp", delete=False) as file:
+        file.write(body)
+    os.replace(file.name, _cache_path(key))
+    _prune(ttl)
+
+
+def _is_guest() -> bool:
+    # Flash messages are stored in the session, they must only be shown once.
+    return "username" not in session and "_flashes" not in session
+
+
+def _conditional(response: Response, max_age: int, public: bool) -> Response:
+    if public:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    # Logged in users see a different page, so a shared cache must not give
+    # them the one of a guest.
+    response.vary.add("Cookie")
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def cached_page(f):
+    """Cache the page for guests for `PAGE_CACHE_TTL` seconds.
+
+    The page must not depend on the query string, it is cached by its path.
+
+    Must be applied before the decorators loading the user, so that a cache
+    hit doesn't even query the user.
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        ttl = app.config.get("PAGE_CACHE_TTL", 10)
+        guest = _is_guest()
+        key = request.path
+
+        if guest and ttl > 0:
+            body = _read_cached(key, ttl)
+            if body is not None:
+                response = Response(body, mimetype="text/html")
+                return _conditional(response, ttl, public=True)
+
+        response = app.make_response(f(*args, **kwargs))
+        if response.status_code != 200 or response.is_streamed:
+            return response
+
+        # The view might have flashed something, only cache what every guest
+        # would see.
+        if guest and ttl > 0 and _is_guest():
+            _write_cached(key, response.get_data(), ttl)
+            return _conditional(response, ttl, public=True)
+
+        return _conditional(response, ttl, public=False)
+
+    return wrapper
+
+
+def clear_page_cache():
+    try:
+        for name in os.listdir(_cache_dir()):
+            os.unlink(os.path.join(_cache_dir(), name))
+    except FileNotFoundError:
+        pass
+
+
+@lru_cache(maxsize=256)
+def _fingerprint(path: str, mtime: float) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()[:12]
+
+
+def static_fingerprint(filename: str) -> Optional[str]:
+    """A hash of the content of a static file, None if it doesn't exist."""
+    path = os.path.join(app.static_folder, filename)
+    try:
+        return _fingerprint(path, os.path.getmtime(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == "static" and "v" not in values:
+        fingerprint = static_fingerprint(values["filename"])
+        if fingerprint is not None:
+            values["v"] = fingerprint
+
+
+@app.after_request
+def cache_fingerprinted_static_files(response: Response) -> Response:
+    if request.endpoint == "static" and "v" in request.args:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+@lru_cache(maxsize=16)
+def static_file(filename: str) -> Tuple[bytes, str]:
+    """The content of a static file, read only once per process."""
+    with open(os.path.join(app.static_folder, filename), "rb") as file:
+        return file.read(), static_fingerprint(filename)
+
+
+def static_file_response(filename: str, mimetype: str) -> Response:
+    """Send a static file from memory, for routes outside of `/static`."""
+    body, fingerprint = static_file(filename)
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(fingerprint)
+    response.cache_control.public = True
+    response.cache_control.max_age = 24 * 60 * 60
+    return response.make_conditional(request)
@@ -0,0 +1,93 @@
+r"""Telling every worker that the visits of days that are over changed.
+
+The occupancy and the contact graph cache the days that are over, as these
+usually don't change anymore. When they do (an admin checks members in after
+the fact, or old visits are archived or deleted), the days are appended to a file in the instance folder. Before a
+worker uses its caches it reads the lines that were added since it last
+looked (usually it only checks the size of the file) and forgets these days.
+"""
+
+import fcntl
+import os
+from datetime import date, datetime, timedelta
+from threading import Lock
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from space_trace import app
+
+_listeners: List[Callable[[List[date]], None]] = []
+_lock = Lock()
+# The file and how far it was read by this process.
+_read: Tuple[Optional[str], int] = (None, 0)
+
+
+def _path() -> str:
+    return app.config.get("INVALIDATED_DAYS_FILE") or os.path.join(
+        app.instance_path, "invalidated_days"
+    )
+
+
+def on_invalidate(listener: Callable[[List[date]], None]):
+    """Register a function that forgets the cached data of days."""
+    _listeners.append(listener)
+    return listener
+
+
+def invalidate_days(days: Iterable[date]):
+    """Make every worker forget what it cached about the days."""
+    days = sorted(set(days))
+    if len(days) == 0:
+        return
+
+    path = _path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        file.write("".join(f"{day.isoformat()}\n" for day in days))
+
+    refresh()
+
+
+def invalidate_visits(timestamps: Iterable[datetime]):
+    """Make every worker forget the days of visits that were moved or deleted.
+
+    A visit lasts less than a day, but it may last into the next one.
+    """
+    invalidate_days(
+        day
+        for timestamp in timestamps
+        for day in (timestamp.date(), timestamp.date() + timedelta(days=1))
+    )
+
+
+def refresh():
+    """Forget the cached days that were invalidated since the last call."""
+    global _read
+
+    path = _path()
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        size = 0
+
+    with _lock:
+        read_path, offset = _read
+        if read_path != path or size < offset:
+            offset = 0
+        if read_path == path and size == offset:
+            return
+
+        days = []
+        if size > offset:
+            with open(path, "rb") as file:
+                file.seek(offset)
+                data = file.read(size - offset)
+            # Leave a line that is still being written for the next time.
+            data = data[: data.rfind(b"\n") + 1]
+            offset += len(data)
+            days = [date.fromisoformat(line) for line in data.decode().split()]
+        _read = (path, offset)
+
+        if len(days) > 0:
+            for listener in _listeners:
+                listener(days)
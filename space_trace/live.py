@@ -0,0 +1,232 @@
+r"""Live updates of the statistic page as server-sent events.
+
+Every worker process has one broadcaster thread. While anybody is listening it
+polls a cheap signature of the visits (the newest visit id and the number of
+active visits), which changes with every check-in and every visit that
+expires. Only then are the counts and the roster queried, once for all
+listeners of the process, and pushed to them.
+
+Check-ins in the same process wake the broadcaster right away, check-ins in
+other processes are seen with the next poll.
+
+Every open stream takes a thread of its worker, so only `LIVE_MAX_STREAMS`
+may be open per worker. Everybody else keeps the page as it was rendered.
+"""
+
+import json
+import os
+from datetime import datetime
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from flask import Flask
+
+from space_trace import app, db
+from space_trace.models import Visit
+from space_trace.routing import read_only
+from space_trace.statistics import (
+    active_users,
+    active_visits,
+    total_users,
+    total_visits,
+)
+from space_trace.tracing import PRESENCE_DURATION
+
+Snapshot = Dict[str, Any]
+
+
+class TooManyListeners(Exception):
+    pass
+
+
+@read_only()
+def visits_signature() -> Tuple[Optional[int], int]:
+    """Changes whenever somebody checks in or a visit expires."""
+    cutoff = datetime.now() - PRESENCE_DURATION
+    newest = db.session.query(db.func.max(Visit.id)).scalar()
+    active = Visit.query.filter(Visit.timestamp > cutoff).count()
+    return newest, active
+
+
+def _names(team: str):
+    return [
+        {"first_name": user.first_name(), "last_name": user.last_name()}
+        for user in active_users(team=team)
+    ]
+
+
+def snapshot() -> Snapshot:
+    """The counts and the roster, as shown on the statistic page."""
+    return {
+        "counts": {
+            "total_users": total_users(),
+            "total_visits": total_visits(include_archive=True),
+            "active_visits": active_visits(),
+        },
+        "roster": {"space": _names("space"), "racing": _names("racing")},
+    }
+
+
+class Broadcaster:
+    """Pushes a new snapshot to all subscribers whenever it changes."""
+
+    def __init__(self, flask_app: Flask, interval: float):
+        """
+        :param interval: How often (in seconds) to poll for changes.
+        """
+        self.app = flask_app
+        self.interval = interval
+        self._subscribers: Set[Queue] = set()
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._thread: Optional[Thread] = None
+        self._pid: Optional[int] = None
+        self._signature = None
+        self._snapshot: Optional[Snapshot] = None
+
+    def subscribe(self, limit: Optional[int] = None) -> Queue:
+        """A queue receiving the current snapshot and every change after it.
+
+        :param limit: The most subscribers at the same time.
+        :raises TooManyListeners: If there already are limit subscribers.
+        """
+        self._ensure_running()
+        queue: Queue = Queue(maxsize=8)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                raise TooManyListeners()
+            self._subscribers.add(queue)
+            if self._snapshot is not None:
+                queue.put(self._snapshot)
+        # A new listener might miss the snapshot of a long idle broadcaster.
+        self.notify()
+        return queue
+
+    def unsubscribe(self, queue: Queue):
+        with self._lock:
+            self._subscribers.discard(queue)
+            if len(self._subscribers) == 0:
+                # Nobody is listening anymore, so nothing keeps the snapshot
+                # up to date.
+                self._signature = None
+                self._snapshot = None
+
+    def notify(self):
+        """Check for changes now instead of at the next poll."""
+        self._wakeup.set()
+
+    def _ensure_running(self):
+        # Threads don't survive a fork, so every gunicorn worker needs its own.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._subscribers = set()
+                self._pid = os.getpid()
+                self._thread = None
+                self._signature = None
+                self._snapshot = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _publish(self, snapshot: Snapshot):
+        with self._lock:
+            self._snapshot = snapshot
+            subscribers = list(self._subscribers)
+
+        for queue in subscribers:
+            try:
+                queue.put_nowait(snapshot)
+            except Full:
+                # The client is too slow, it only needs the newest snapshot.
+                try:
+                    queue.get_nowait()
+                except Empty:
+                    pass
+                queue.put_nowait(snapshot)
+
+    def _poll(self):
+        with self.app.app_context():
+            try:
+                signature = visits_signature()
+                if signature != self._signature or self._snapshot is None:
+                    self._publish(snapshot())
+                    self._signature = signature
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            with self._lock:
+                idle = len(self._subscribers) == 0
+            if idle:
+                continue
+
+            try:
+                self._poll()
+            except Exception:
+                self.app.logger.exception("Live update failed")
+
+
+_broadcaster: Optional[Broadcaster] = None
+_broadcaster_lock = Lock()
+
+
+def broadcaster() -> Broadcaster:
+    global _broadcaster
+
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            _broadcaster = Broadcaster(
+                app, interval=app.config.get("LIVE_POLL_INTERVAL", 2)
+            )
+        return _broadcaster
+
+
+def notify_change():
+    """Tell the listeners of this process that something changed."""
+    if _broadcaster is not None:
+        _broadcaster.notify()
+
+
+def _event(name: str, data: Any) -> str:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream(queue: Queue, with_roster: bool, max_age: float) -> Iterator[str]:
+    """The server-sent events for one listener.
+
+    Ends after max_age seconds, the browser reconnects on its own. That
+    way no connection stays open forever and a new deploy is picked up.
+
+    :param queue: The subscription of the listener, it is ended with the
+        stream.
+    :param with_roster: Whether to send the names of the members in the HQ,
+        only for logged in users.
+    """
+    try:
+        # Reconnect after 1s
+        yield "retry: 1000\n\n"
+
+        deadline = monotonic() + max_age
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                # Proxies close silent connections, so send a comment at
+                # least every 15s.
+                update = queue.get(timeout=min(15, remaining))
+            except Empty:
+                yield ": keep-alive\n\n"
+                continue
+
+            yield _event("counts", update["counts"])
+            if with_roster:
+                yield _event("roster", update["roster"])
+    finally:
+        broadcaster().unsubscribe(queue)
@@ -0,0 +1,290 @@
+r"""Request and database metrics in the Prometheus text format.
+
+Every request is timed per endpoint, and every SQL statement it runs is
+counted and timed with SQLAlchemy cursor events. Each gunicorn worker keeps
+its metrics in memory and regularly writes them into its own file in
+`METRICS_DIR`. `/admin/metrics` merges the files of all workers.
+
+Latencies are histograms, the p50/p95/p99 are estimated from the buckets
+(like `histogram_quantile` in Prometheus does).
+"""
+
+import json
+import os
+import uuid
+from threading import Lock
+from time import monotonic, perf_counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import flask
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from space_trace import app
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# How often (in seconds) a worker writes its metrics into its file.
+_FLUSH_INTERVAL = 5
+
+HELP = {
+    "space_trace_http_requests_total": "Finished requests",
+    "space_trace_http_request_duration_seconds": "Time till the response "
+    "was returned (without streaming the body)",
+    "space_trace_db_queries_total": "SQL statements executed",
+    "space_trace_db_queries_per_request": "SQL statements per request",
+    "space_trace_db_query_duration_seconds": "Time per SQL statement",
+}
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(
+        f'{key}="{str(value).replace(chr(34), chr(39))}"'
+        for key, value in sorted(labels.items())
+    )
+
+
+class Registry:
+    """Counters and histograms, keyed by name and rendered labels."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.counters: Dict[str, Dict[str, float]] = {}
+        self.histograms: Dict[str, Dict[str, dict]] = {}
+
+    def inc(self, name: str, labels: str, value: float = 1):
+        with self._lock:
+            counter = self.counters.setdefault(name, {})
+            counter[labels] = counter.get(labels, 0) + value
+
+    def observe(self, name: str, labels: str, value: float, buckets: Sequence[float]):
+        with self._lock:
+            histogram = self.histograms.setdefault(name, {}).get(labels)
+            if histogram is None:
+                histogram = {
+                    "buckets": list(buckets),
+                    "counts": [0] * (len(buckets) + 1),  # The last is +Inf
+                    "sum": 0.0,
+                }
+                self.histograms[name][labels] = histogram
+
+            i = 0
+            while i < len(buckets) and value > buckets[i]:
+                i += 1
+            histogram["counts"][i] += 1
+            histogram["sum"] += value
+
+    def dump(self) -> dict:
+        with self._lock:
+            return json.loads(
+                json.dumps({"counters": self.counters, "histograms": self.histograms})
+            )
+
+
+def merge(dumps: Iterable[dict]) -> dict:
+    """Add up the metrics of several registries."""
+    merged: dict = {"counters": {}, "histograms": {}}
+    for dump in dumps:
+        for name, values in dump["counters"].items():
+            counter = merged["counters"].setdefault(name, {})
+            for labels, value in values.items():
+                counter[labels] = counter.get(labels, 0) + value
+
+        for name, values in dump["histograms"].items():
+            histograms = merged["histograms"].setdefault(name, {})
+            for labels, histogram in values.items():
+                if labels not in histograms:
+                    histograms[labels] = json.loads(json.dumps(histogram))
+                    continue
+                target = histograms[labels]
+                target["counts"] = [
+                    a + b for a, b in zip(target["counts"], histogram["counts"])
+                ]
+                target["sum"] += histogram["sum"]
+    return merged
+
+
+def quantile(q: float, buckets: List[float], counts: List[int]) -> Optional[float]:
+    """Estimate a quantile from histogram buckets by linear interpolation."""
+    total = sum(counts)
+    if total == 0:
+        return None
+
+    rank = q * total
+    cumulative = 0
+    for i, count in enumerate(counts):
+        if cumulative + count >= rank and count > 0:
+            if i == len(buckets):
+                # In +Inf, the best guess is the largest finite bound.
+                return buckets[-1]
+            lower = buckets[i - 1] if i > 0 else 0
+            return lower + (buckets[i] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return buckets[-1]
+
+
+def render(metrics: dict) -> str:
+    """The metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, values in sorted(metrics["counters"].items()):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(values.items()):
+            lines.append(f"{name}{{{labels}}} {_number(value)}")
+
+    for name, values in sorted(metrics["histograms"].items()):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in sorted(values.items()):
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(
+                histogram["buckets"] + ["+Inf"], histogram["counts"]
+            ):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {_number(histogram['sum'])}")
+            lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+        quantiles = f"{name}_quantile"
+        lines.append(f"# HELP {quantiles} Estimated from {name}")
+        lines.append(f"# TYPE {quantiles} gauge")
+        for labels, histogram in sorted(values.items()):
+            prefix = f"{labels}," if labels else ""
+            for q in QUANTILES:
+                value = quantile(q, histogram["buckets"], histogram["counts"])
+                if value is not None:
+                    lines.append(
+                        f'{quantiles}{{{prefix}quantile="{q}"}} {_number(value)}'
+                    )
+
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# The file of this worker, it's a new one after a fork.
+_process: Tuple[Optional[int], str] = (None, "")
+_last_flush = 0.0
+_flush_lock = Lock()
+
+
+def _metrics_dir() -> str:
+    return app.config.get("METRICS_DIR") or os.path.join(app.instance_path, "metrics")
+
+
+def _process_file() -> str:
+    global _process, registry
+
+    pid, name = _process
+    if pid != os.getpid():
+        if pid is not None:
+            # Forked, the metrics so far belong to the parent.
+            registry = Registry()
+        name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        _process = (os.getpid(), name)
+    return os.path.join(_metrics_dir(), name)
+
+
+def flush():
+    """Write the metrics of this worker into its file."""
+    global _last_flush
+
+    path = _process_file()
+    with _flush_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as file:
+            json.dump(registry.dump(), file)
+        os.replace(path + ".tmp", path)
+        _last_flush = monotonic()
+
+
+def collect() -> dict:
+    """The merged metrics of all workers."""
+    flush()
+    dumps = []
+    for name in os.listdir(_metrics_dir()):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(_metrics_dir(), name)) as file:
+                dumps.append(json.load(file))
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+    return merge(dumps)
+
+
+def _enabled() -> bool:
+    return app.config.get("METRICS_ENABLED", True)
+
+
+@app.before_request
+def start_request_timer():
+    if _enabled():
+        flask.g.metrics_start = perf_counter()
+        flask.g.metrics_queries = 0
+
+
+@app.after_request
+def record_request(response):
+    start = flask.g.get("metrics_start")
+    if start is None:
+        return response
+
+    _process_file()
+    endpoint = request.endpoint or "none"
+    registry.inc(
+        "space_trace_http_requests_total",
+        _labels(endpoint=endpoint, method=request.method, status=response.status_code),
+    )
+    registry.observe(
+        "space_trace_http_request_duration_seconds",
+        _labels(endpoint=endpoint),
+        perf_counter() - start,
+        LATENCY_BUCKETS,
+    )
+    registry.observe(
+        "space_trace_db_queries_per_request",
+        _labels(endpoint=endpoint),
+        flask.g.metrics_queries,
+        QUERY_COUNT_BUCKETS,
+    )
+
+    if monotonic() - _last_flush > _FLUSH_INTERVAL:
+        flush()
+    return response
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if not _enabled():
+        return
+    conn.info.setdefault("metrics_start", []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_start")
+    if not starts:
+        return
+    duration = perf_counter() - starts.pop()
+
+    if flask.has_request_context() and "metrics_start" in flask.g:
+        endpoint = request.endpoint or "none"
+        flask.g.metrics_queries += 1
+    else:
+        # Background threads and CLI commands
+        endpoint = "none"
+
+    labels = _labels(endpoint=endpoint)
+    registry.inc("space_trace_db_queries_total", labels)
+    registry.observe(
+        "space_trace_db_query_duration_seconds", labels, duration, LATENCY_BUCKETS
+    )
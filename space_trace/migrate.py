@@ -0,0 +1,86 @@
+r"""Copy all data from one database into the configured one.
+
+This is meant to move an existing `trace.db` to PostgreSQL, but works between
+any two databases SQLAlchemy supports.
+"""
+
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import create_engine, func, select, text
+
+from space_trace import db
+
+
+def copy_database(
+    source_uri: str,
+    batch_size: int = 5000,
+    progress: Optional[Callable[[str, int], None]] = None,
+) -> Dict[str, int]:
+    """Copy every table from the source into the configured database.
+
+    The tables are created if needed and must be empty. Rows are read in
+    batches ordered by their primary key and each batch is inserted in its
+    own transaction.
+
+    :param progress: Called with the table name and the number of rows copied
+        so far after every batch.
+    :return: The number of copied rows per table.
+    """
+    source = create_engine(source_uri)
+    target = db.engine
+    db.metadata.create_all(target)
+
+    copied = {}
+    for table in db.metadata.sorted_tables:
+        with source.connect() as connection:
+            if not source.dialect.has_table(connection, table.name):
+                continue
+
+        with target.connect() as connection:
+            count = connection.execute(select(func.count()).select_from(table))
+            if count.scalar() != 0:
+                raise ValueError(f"The table {table.name} is not empty")
+
+        # Every table has a single column primary key
+        (key,) = table.primary_key.columns
+        last = None
+        copied[table.name] = 0
+        while True:
+            query = select(table).order_by(key).limit(batch_size)
+            if last is not None:
+                query = query.where(key > last)
+
+            with source.connect() as connection:
+                rows = [dict(row._mapping) for row in connection.execute(query)]
+            if len(rows) == 0:
+                break
+
+            with target.begin() as connection:
+                connection.execute(table.insert(), rows)
+
+            last = rows[-1][key.name]
+            copied[table.name] += len(rows)
+            if progress is not None:
+                progress(table.name, copied[table.name])
+
+    if target.dialect.name == "postgresql":
+        reset_sequences(target)
+
+    return copied
+
+
+def reset_sequences(engine):
+    """Move the id sequences past the copied ids (PostgreSQL only)."""
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            (key,) = table.primary_key.columns
+            if not key.autoincrement or not isinstance(key.type, db.Integer):
+                continue
+
+            connection.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', "
+                    f"'{key.name}'), coalesce(max({key.name}), 0) + 1, false) "
+                    f"FROM {table.name}"
+                )
+            )
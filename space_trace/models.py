@@ -1,8 +1,54 @@
-from datetime import date, datetime
+from datetime import date, datetime, time
+from functools import lru_cache
+from typing import Optional, Tuple
+
 from space_trace import app, db
 
 
-class User(db.Model):
+def _capitalize_name(name: str) -> str:
+    name = name.capitalize()
+    return "-".join(map(lambda n: n[0].upper() + n[1:], name.split("-")))
+
+
+@lru_cache(maxsize=16384)
+def split_name(email: str) -> Tuple[str, str]:
+    """The first and last name in an email like `first.last@domain`.
+
+    Cached, as listings show the names of the same members over and over.
+    """
+    first, last = email.split("@")[0].split(".")
+    return _capitalize_name(first), _capitalize_name(last)
+
+
+class UserNames:
+    """The names and team labels of anything with an email and a team."""
+
+    __slots__ = ()
+
+    def first_name(self) -> str:
+        return split_name(self.email)[0]
+
+    def last_name(self) -> str:
+        return split_name(self.email)[1]
+
+    def full_name(self) -> str:
+        first, last = split_name(self.email)
+        return f"{first} {last}"
+
+    def team_short(self) -> str:
+        if self.team == "space":
+            return "st"
+        elif self.team == "racing":
+            return "rt"
+
+    def team_emoji(self) -> str:
+        if self.team == "space":
+            return "🚀"
+        elif self.team == "racing":
+            return "🏎"
+
+
+class User(UserNames, db.Model):
     __tablename__ = "users"
 
     id: int = db.Column(db.Integer, primary_key=True)
@@ -13,7 +59,12 @@ class User(db.Model):
     tested_till: datetime = db.Column(db.DateTime, nullable=True, default=None)
     medical_exception: bool = db.Column(db.Boolean, nullable=False, default=False)
 
-    __table_args__ = (db.Index("idx_users_email", email),)
+    __table_args__ = (
+        db.Index("idx_users_email", email),
+        # To find the certificates that expire soon
+        db.Index("idx_users_vaccinated_till", vaccinated_till),
+        db.Index("idx_users_tested_till", tested_till),
+    )
 
     def __init__(self, email: str, team: str):
         self.email = email
@@ -22,24 +73,6 @@ class User(db.Model):
     def is_admin(self) -> bool:
         return self.email in app.config["ADMINS"]
 
-    def first_name(self) -> str:
-        first, _ = self.email.split("@")[0].split(".")
-        first = first.capitalize()
-        first = "-".join(map(lambda n: n[0].upper() + n[1:], first.split("-")))
-        return first
-
-    def last_name(self) -> str:
-        _, last = self.email.split("@")[0].split(".")
-        last = last.capitalize()
-        last = "-".join(map(lambda n: n[0].upper() + n[1:], last.split("-")))
-        return last
-
-    def full_name(self) -> str:
-        first, last = self.email.split("@")[0].split(".")
-        name = first.capitalize() + " " + last.capitalize()
-        name = "-".join(map(lambda n: n[0].upper() + n[1:], name.split("-")))
-        return name
-
     def is_tested(self) -> bool:
         return self.tested_till is not None and self.tested_till >= datetime.now()
 
@@ -49,29 +82,52 @@ class User(db.Model):
     def has_2g(self) -> bool:
         return self.is_vaccinated() or self.is_tested()
 
-    def team_short(self) -> str:
-        if self.team == "space":
-            return "st"
-        elif self.team == "racing":
-            return "rt"
-
-    def team_emoji(self) -> str:
-        if self.team == "space":
-            return "🚀"
-        elif self.team == "racing":
-            return "🏎"
+    def valid_till(self) -> Optional[datetime]:
+        """Until when the user has 2G, None if they don't."""
+        deadlines = []
+        if self.is_vaccinated():
+            # The certificate is valid for the whole last day
+            deadlines.append(datetime.combine(self.vaccinated_till, time.max))
+        if self.is_tested():
+            deadlines.append(self.tested_till)
+        return max(deadlines, default=None)
 
     def __repr__(self):
         return f"<User id={self.id}, email={self.email}, team={self.team}>"
 
 
+class UserRecord(UserNames):
+    """A user as shown in listings and exports, read-only.
+
+    Selecting only these columns into a plain object skips the identity map
+    and change tracking of full `User` instances, which adds up for long
+    lists of members.
+    """
+
+    __slots__ = ("id", "email", "team")
+
+    # Select these with db.session.query(*UserRecord.columns)
+    columns = (User.id, User.email, User.team)
+
+    def __init__(self, id: int, email: str, team: str):
+        self.id = id
+        self.email = email
+        self.team = team
+
+    def __repr__(self):
+        return f"<UserRecord id={self.id}, email={self.email}, team={self.team}>"
+
+
 class Visit(db.Model):
     __tablename__ = "visits"
     id: int = db.Column(db.Integer, primary_key=True)
     user: int = db.Column(db.ForeignKey("users.id"), nullable=False)
     timestamp: datetime = db.Column(db.DateTime, nullable=False, default=db.func.now())
 
-    __table_args__ = (db.Index("idx_visits_user", user),)
+    __table_args__ = (
+        db.Index("idx_visits_user", user),
+        db.Index("idx_visits_timestamp", timestamp),
+    )
 
     def __init__(self, timestamp: datetime, user_id: int):
         self.timestamp = timestamp
@@ -81,3 +137,121 @@ class Visit(db.Model):
         return (
             f"<Visit id={self.id}, userId={self.user}, " "timestamp={self.timestamp}>"
         )
+
+
+class ArchivedVisit(db.Model):
+    """A visit that is too old to be needed for contact tracing."""
+
+    __tablename__ = "visits_archive"
+    id: int = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user: int = db.Column(db.ForeignKey("users.id"), nullable=False)
+    timestamp: datetime = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index("idx_visits_archive_user", user),
+        db.Index("idx_visits_archive_timestamp", timestamp),
+    )
+
+    def __repr__(self):
+        return (
+            f"<ArchivedVisit id={self.id}, userId={self.user}, "
+            f"timestamp={self.timestamp}>"
+        )
+
+
+class UserActivity(db.Model):
+    """Summary of the visits of a user, kept up to date on every check-in.
+
+    The window counts (visits in the last 7, 30 and 365 days, including the
+    day itself) are relative to `window_day`.
+    """
+
+    __tablename__ = "user_activity"
+    user: int = db.Column(db.ForeignKey("users.id"), primary_key=True)
+    total_visits: int = db.Column(db.Integer, nullable=False)
+    visits_7d: int = db.Column(db.Integer, nullable=False)
+    visits_30d: int = db.Column(db.Integer, nullable=False)
+    visits_365d: int = db.Column(db.Integer, nullable=False)
+    first_visit: datetime = db.Column(db.DateTime, nullable=False)
+    last_visit: datetime = db.Column(db.DateTime, nullable=False)
+    window_day: date = db.Column(db.Date, nullable=False)
+
+    __table_args__ = (db.Index("idx_user_activity_last_visit", last_visit),)
+
+    def __repr__(self):
+        return (
+            f"<UserActivity userId={self.user}, total_visits={self.total_visits}, "
+            f"last_visit={self.last_visit}>"
+        )
+
+
+class ExpiryNotification(db.Model):
+    """A reminder sent to a user that their 2G runs out soon."""
+
+    __tablename__ = "expiry_notifications"
+    id: int = db.Column(db.Integer, primary_key=True)
+    user: int = db.Column(db.ForeignKey("users.id"), nullable=False)
+    valid_till: datetime = db.Column(db.DateTime, nullable=False)
+    days: int = db.Column(db.Integer, nullable=False)  # The reminder, like 7 days
+    sent_at: datetime = db.Column(db.DateTime, nullable=False)
+
+    # Every reminder is only sent once for the same certificate
+    __table_args__ = (
+        db.UniqueConstraint(user, valid_till, days, name="uq_expiry_notifications"),
+    )
+
+    def __init__(
+        self, user_id: int, valid_till: datetime, days: int, sent_at: datetime
+    ):
+        self.user = user_id
+        self.valid_till = valid_till
+        self.days = days
+        self.sent_at = sent_at
+
+    def __repr__(self):
+        return (
+            f"<ExpiryNotification userId={self.user}, valid_till={self.valid_till}, "
+            f"days={self.days}>"
+        )
+
+
+class SlackUser(db.Model):
+    """A cached entry of the Slack member directory."""
+
+    __tablename__ = "slack_users"
+    id: str = db.Column(db.Text, primary_key=True)  # The Slack member id
+    email: str = db.Column(db.Text, nullable=False)
+    handle: str = db.Column(db.Text, nullable=False)
+    updated: int = db.Column(db.Integer, nullable=False)  # As reported by Slack
+
+    __table_args__ = (db.Index("idx_slack_users_email", email),)
+
+    def __init__(self, id: str, email: str, handle: str, updated: int):
+        self.id = id
+        self.email = email
+        self.handle = handle
+        self.updated = updated
+
+    def __repr__(self):
+        return f"<SlackUser id={self.id}, email={self.email}, handle={self.handle}>"
+
+
+class SlackSync(db.Model):
+    """A finished synchronisation of the Slack directory."""
+
+    __tablename__ = "slack_syncs"
+    id: int = db.Column(db.Integer, primary_key=True)
+    finished_at: datetime = db.Column(db.DateTime, nullable=False)
+    members: int = db.Column(db.Integer, nullable=False)
+    changed: int = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, finished_at: datetime, members: int, changed: int):
+        self.finished_at = finished_at
+        self.members = members
+        self.changed = changed
+
+    def __repr__(self):
+        return (
+            f"<SlackSync id={self.id}, finished_at={self.finished_at}, "
+            f"members={self.members}, changed={self.changed}>"
+        )
@@ -0,0 +1,245 @@
+r"""How many members were in the HQ over time.
+
+Every visit counts as +1 when the member checks in and −1 when their presence
+ends 12h later. Sweeping over these events sorted by time gives the exact
+occupancy at every moment, which is reduced to the peak occupancy per minute
+of a day.
+
+Days that are over don't change anymore, so their minutes are cached and a
+range of years only loads the visits of the days that weren't asked for yet.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from threading import Lock
+from typing import Dict, List
+
+import numpy as np
+
+from space_trace import db, invalidation
+from space_trace.models import ArchivedVisit, Visit
+from space_trace.routing import read_only
+from space_trace.tracing import PRESENCE_DURATION
+
+MINUTES_PER_DAY = 24 * 60
+
+RESOLUTIONS = {"minute": 1, "hour": 60}
+
+# Closed days kept in the cache, at 6 KB per day this is about ten years.
+_CACHE_SIZE = 4000
+_day_cache: "OrderedDict[date, np.ndarray]" = OrderedDict()
+_day_cache_lock = Lock()
+
+
+@dataclass
+class DailyPeak:
+    day: date
+    peak: int
+    at: datetime
+
+
+@dataclass
+class CapacityExceeded:
+    """A time range in which more members than allowed were in the HQ."""
+
+    start: datetime
+    end: datetime
+    peak: int
+
+
+def _load_timestamps(start: datetime, end: datetime) -> np.ndarray:
+    """All check-ins present in [start, end) in seconds since start, sorted."""
+    timestamps = []
+    # Queried one table after the other, so both can use their index.
+    for model in (Visit, ArchivedVisit):
+        timestamps += [
+            timestamp
+            for (timestamp,) in db.session.query(model.timestamp)
+            .filter(model.timestamp > start - PRESENCE_DURATION)
+            .filter(model.timestamp < end)
+        ]
+
+    seconds = np.array(timestamps, dtype="datetime64[s]") - np.datetime64(start, "s")
+    return np.sort(seconds.astype(np.int64))
+
+
+def _minute_peaks(arrivals: np.ndarray) -> np.ndarray:
+    """The peak occupancy per minute of one day.
+
+    :param arrivals: Sorted check-in times in seconds since the start of the
+        day, including the ones of the previous day that are still present.
+    """
+    presence = int(PRESENCE_DURATION.total_seconds())
+    day = MINUTES_PER_DAY * 60
+
+    # Members checked in before the day are already there at midnight.
+    baseline = int(np.count_nonzero(arrivals < 0))
+    departures = arrivals + presence
+    departures = departures[departures < day]
+    arrivals = arrivals[arrivals >= 0]
+
+    # The presence ends before the next one starts, so at the same second
+    # departures are applied first.
+    times = np.concatenate([departures, arrivals])
+    deltas = np.concatenate(
+        [-np.ones(len(departures), np.int32), np.ones(len(arrivals), np.int32)]
+    )
+    order = np.lexsort((deltas, times))
+    times, levels = times[order], baseline + np.cumsum(deltas[order])
+
+    # The occupancy at the start of every minute, raised by the events within.
+    minute_starts = np.arange(MINUTES_PER_DAY) * 60
+    before = np.searchsorted(times, minute_starts, side="right")
+    peaks = np.concatenate([[baseline], levels])[before].astype(np.int32)
+    np.maximum.at(peaks, times // 60, levels)
+    return peaks
+
+
+def _compute_days(days: List[date]) -> Dict[date, np.ndarray]:
+    # One query for all days, they are usually a contiguous range.
+    first = datetime.combine(min(days), time())
+    end = datetime.combine(max(days) + timedelta(days=1), time())
+    arrivals = _load_timestamps(first, end)
+
+    presence = int(PRESENCE_DURATION.total_seconds())
+    peaks = {}
+    for day in days:
+        offset = int((datetime.combine(day, time()) - first).total_seconds())
+        low = np.searchsorted(arrivals, offset - presence, side="right")
+        high = np.searchsorted(arrivals, offset + MINUTES_PER_DAY * 60, side="left")
+        peaks[day] = _minute_peaks(arrivals[low:high] - offset)
+    return peaks
+
+
+@read_only()
+def day_minute_peaks(first: date, last: date) -> Dict[date, np.ndarray]:
+    """The peak occupancy of every minute of the days from first to last.
+
+    Days before today are cached.
+    """
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    today = date.today()
+    invalidation.refresh()
+
+    peaks = {}
+    with _day_cache_lock:
+        for day in days:
+            if day in _day_cache:
+                _day_cache.move_to_end(day)
+                peaks[day] = _day_cache[day]
+
+    missing = [day for day in days if day not in peaks]
+    if len(missing) == 0:
+        return peaks
+
+    computed = _compute_days(missing)
+    peaks.update(computed)
+    with _day_cache_lock:
+        for day, minutes in computed.items():
+            # Today (and the future) can still get new visits.
+            if day < today:
+                _day_cache[day] = minutes
+        while len(_day_cache) > _CACHE_SIZE:
+            _day_cache.popitem(last=False)
+
+    return peaks
+
+
+@invalidation.on_invalidate
+def forget_days(days: List[date]):
+    with _day_cache_lock:
+        for day in days:
+            _day_cache.pop(day, None)
+
+
+def clear_occupancy_cache():
+    with _day_cache_lock:
+        _day_cache.clear()
+
+
+def _minutes(start: datetime, end: datetime) -> np.ndarray:
+    """The peak per minute from start to end (both rounded down to minutes)."""
+    # What comes after now isn't known yet.
+    end = min(end, datetime.now())
+    if end <= start:
+        return np.array([], dtype=np.int32)
+
+    last = (end - timedelta(microseconds=1)).date()
+    peaks = day_minute_peaks(start.date(), last)
+    minutes = np.concatenate([peaks[day] for day in sorted(peaks)])
+    offset = start.hour * 60 + start.minute
+    count = int((end - start.replace(second=0, microsecond=0)).total_seconds() // 60)
+    return minutes[offset : offset + count]
+
+
+def occupancy(
+    start: datetime, end: datetime, resolution: str = "hour"
+) -> Dict[str, list]:
+    """The peak occupancy per minute or hour in a time range.
+
+    This data is meant for a graph, the returned dict has the keys 'labels'
+    for the x axis and 'data' with the number of members in the HQ.
+
+    :param start: The start of the range, rounded down to the resolution.
+    :param end: The (exclusive) end of the range.
+    :param resolution: One of `RESOLUTIONS`.
+    """
+    step = RESOLUTIONS[resolution]
+    start = start.replace(second=0, microsecond=0)
+    start -= timedelta(minutes=(start.hour * 60 + start.minute) % step)
+
+    minutes = _minutes(start, end)
+    # Pad the last (incomplete) step, so every step has the same length.
+    padding = -len(minutes) % step
+    minutes = np.concatenate([minutes, np.zeros(padding, dtype=np.int32)])
+    data = minutes.reshape(-1, step).max(axis=1) if len(minutes) else minutes
+
+    return {
+        "labels": [
+            (start + timedelta(minutes=i * step)).isoformat(timespec="minutes")
+            for i in range(len(data))
+        ],
+        "data": data.tolist(),
+    }
+
+
+def daily_peaks(first: date, last: date) -> List[DailyPeak]:
+    """The highest occupancy (and when it was first reached) of every day."""
+    start = datetime.combine(first, time())
+    minutes = _minutes(start, datetime.combine(last + timedelta(days=1), time()))
+
+    peaks = []
+    for i in range(0, len(minutes), MINUTES_PER_DAY):
+        day = minutes[i : i + MINUTES_PER_DAY]
+        minute = int(np.argmax(day))
+        peaks.append(
+            DailyPeak(
+                day=first + timedelta(days=i // MINUTES_PER_DAY),
+                peak=int(day[minute]),
+                at=start + timedelta(minutes=i + minute),
+            )
+        )
+    return peaks
+
+
+def over_capacity(
+    start: datetime, end: datetime, capacity: int
+) -> List[CapacityExceeded]:
+    """The time ranges in which more than capacity members were in the HQ.
+
+    Accurate to the minute.
+    """
+    start = start.replace(second=0, microsecond=0)
+    minutes = _minutes(start, end)
+
+    over = np.concatenate([[False], minutes > capacity, [False]])
+    edges = np.flatnonzero(over[1:] != over[:-1])
+    return [
+        CapacityExceeded(
+            start=start + timedelta(minutes=int(first)),
+            end=start + timedelta(minutes=int(last)),
+            peak=int(minutes[first:last].max()),
+        )
+        for first, last in zip(edges[::2], edges[1::2])
+    ]
@@ -0,0 +1,222 @@
+r"""Query profiling for development and tests.
+
+With `QUERY_PROFILING` enabled (the default in debug mode) every SQL statement
+of a request is recorded with its duration and the line in space_trace that
+caused it. After the request a summary is logged, and warnings for:
+
+- slow statements (over `QUERY_PROFILING_SLOW_MS`), with their query plan and
+  whether they scan a whole table,
+- the same statement running many times (`QUERY_PROFILING_REPEAT`), which
+  usually means a query in a loop (N+1).
+
+With `QUERY_PROFILING_FOOTER` the queries are also shown at the bottom of
+every HTML page.
+"""
+
+import os
+import re
+import traceback
+from collections import Counter
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import List, Optional
+
+import flask
+from flask import request
+from markupsafe import escape
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from space_trace import app
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@dataclass
+class QueryRecord:
+    statement: str
+    duration: float
+    caller: str
+    plan: List[str] = field(default_factory=list)
+    full_scan: bool = False
+
+
+@dataclass
+class RequestProfile:
+    queries: List[QueryRecord] = field(default_factory=list)
+
+    @property
+    def total_duration(self) -> float:
+        return sum(q.duration for q in self.queries)
+
+    def slow(self, threshold: float) -> List[QueryRecord]:
+        return [q for q in self.queries if q.duration >= threshold]
+
+    def repeated(self, limit: int) -> List[tuple]:
+        """The statements that ran at least limit times, with their count."""
+        counts = Counter(normalize(q.statement) for q in self.queries)
+        return [(s, n) for s, n in counts.most_common() if n >= limit]
+
+
+def enabled() -> bool:
+    return app.config.get("QUERY_PROFILING", app.debug)
+
+
+def normalize(statement: str) -> str:
+    """Make statements that only differ in their values look the same."""
+    statement = re.sub(r"\s+", " ", statement).strip()
+    statement = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    statement = re.sub(r"\b\d+(\.\d+)?\b", "?", statement)
+    # IN lists of different lengths
+    statement = re.sub(r"\((?:\s*(?:\?|%\(\w+\)s|:\w+)\s*,?)+\)", "(?)", statement)
+    return statement
+
+
+def _caller() -> str:
+    """The innermost line of space_trace (outside of this module) on the stack."""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_PACKAGE_DIR) and filename not in (
+            __file__,
+            os.path.join(_PACKAGE_DIR, "metrics.py"),
+        ):
+            return f"{os.path.relpath(filename, _PACKAGE_DIR)}:{frame.lineno}"
+    return "?"
+
+
+def explain(cursor, statement: str, parameters) -> List[str]:
+    """The query plan of a statement, on a separate cursor of the connection.
+
+    Uses the raw DBAPI connection, so that it doesn't show up in the profile
+    (or the metrics) itself.
+    """
+    explain_cursor = cursor.connection.cursor()
+    try:
+        if cursor.connection.__class__.__module__.startswith("sqlite3"):
+            explain_cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            return [row[-1] for row in explain_cursor.fetchall()]
+        explain_cursor.execute(f"EXPLAIN {statement}", parameters)
+        return [row[0] for row in explain_cursor.fetchall()]
+    finally:
+        explain_cursor.close()
+
+
+def is_full_scan(plan: List[str]) -> bool:
+    """Whether a plan reads a whole table instead of using an index."""
+    for line in plan:
+        line = line.strip()
+        # SQLite: "SCAN visits", but not "SCAN visits USING INDEX ..."
+        if line.startswith("SCAN ") and "USING" not in line:
+            return True
+        # PostgreSQL
+        if "Seq Scan" in line:
+            return True
+    return False
+
+
+def current_profile() -> Optional[RequestProfile]:
+    if not flask.has_request_context():
+        return None
+    return flask.g.get("query_profile")
+
+
+@app.before_request
+def start_profile():
+    if enabled():
+        flask.g.query_profile = RequestProfile()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    if current_profile() is not None:
+        conn.info.setdefault("profile_start", []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    starts = conn.info.get("profile_start")
+    if profile is None or not starts:
+        return
+
+    record = QueryRecord(statement, perf_counter() - starts.pop(), _caller())
+    threshold = app.config.get("QUERY_PROFILING_SLOW_MS", 50) / 1000
+    is_select = statement.lstrip().upper().startswith(("SELECT", "WITH"))
+    if record.duration >= threshold and is_select and not executemany:
+        try:
+            record.plan = explain(cursor, statement, parameters)
+            record.full_scan = is_full_scan(record.plan)
+        except Exception as e:
+            record.plan = [f"EXPLAIN failed: {e}"]
+    profile.queries.append(record)
+
+
+def _log_profile(profile: RequestProfile):
+    threshold = app.config.get("QUERY_PROFILING_SLOW_MS", 50) / 1000
+    repeat = app.config.get("QUERY_PROFILING_REPEAT", 5)
+    slow = profile.slow(threshold)
+    repeated = profile.repeated(repeat)
+
+    app.logger.info(
+        f"{request.method} {request.full_path.rstrip('?')}: "
+        f"{len(profile.queries)} queries in {profile.total_duration * 1000:.1f} ms, "
+        f"{len(slow)} slow, {len(repeated)} repeated"
+    )
+    for query in slow:
+        scan = " (full table scan)" if query.full_scan else ""
+        app.logger.warning(
+            f"Slow query{scan} at {query.caller} took "
+            f"{query.duration * 1000:.1f} ms: {normalize(query.statement)}\n"
+            + "\n".join(f"    {line}" for line in query.plan)
+        )
+    for statement, count in repeated:
+        callers = sorted(
+            {q.caller for q in profile.queries if normalize(q.statement) == statement}
+        )
+        app.logger.warning(
+            f"Possible N+1: {count} times from {', '.join(callers)}: {statement}"
+        )
+
+
+def _footer(profile: RequestProfile) -> str:
+    rows = []
+    for query in profile.queries:
+        row_class = ' class="table-warning"' if query.full_scan else ""
+        rows.append(
+            f"<tr{row_class}><td>{query.duration * 1000:.1f}</td>"
+            f"<td>{escape(query.caller)}</td>"
+            f"<td><code>{escape(normalize(query.statement))}</code></td></tr>"
+        )
+
+    return (
+        '<div class="container-sm mb-3"><details><summary>'
+        f"{len(profile.queries)} queries in "
+        f"{profile.total_duration * 1000:.1f} ms</summary>"
+        '<table class="table table-sm"><thead><tr><th>ms</th><th>Caller</th>'
+        f"<th>Statement</th></tr></thead><tbody>{''.join(rows)}</tbody></table>"
+        "</details></div>"
+    )
+
+
+@app.after_request
+def report_profile(response):
+    profile = current_profile()
+    if profile is None:
+        return response
+
+    _log_profile(profile)
+
+    if (
+        app.config.get("QUERY_PROFILING_FOOTER", False)
+        and response.mimetype == "text/html"
+        and not response.is_streamed
+        and response.status_code == 200
+    ):
+        body = response.get_data(as_text=True)
+        if "</body>" in body:
+            body = body.replace("</body>", _footer(profile) + "</body>", 1)
+            response.set_data(body)
+            if response.get_etag()[0] is not None:
+                response.add_etag(overwrite=True)
+
+    return response
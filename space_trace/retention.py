@@ -0,0 +1,123 @@
+r"""Archival and retention of visits.
+
+Contact tracing only needs the last few weeks of visits, so older visits are
+moved from `visits` into `visits_archive`. That keeps the hot table small and
+every time range query on it fast. Code that needs the whole history (like
+the all-time statistics) has to ask for it explicitly with `visit_source`.
+
+Visits older than the legal retention period are deleted from both tables.
+
+All of this runs in small batches with a pause in between, so check-ins never
+wait long for the write lock.
+"""
+
+from datetime import datetime, timedelta
+from time import sleep
+from typing import Callable, Optional
+
+from space_trace import db, invalidation
+from space_trace.models import ArchivedVisit, Visit
+
+_visits = Visit.__table__
+_archive = ArchivedVisit.__table__
+
+
+def visit_source(include_archive: bool = False):
+    """The visits to query, either only the hot table or with the archive.
+
+    The result can be used like the `Visit` model in queries, for example
+    `visits = visit_source(True); db.session.query(visits.timestamp)`.
+    """
+    if not include_archive:
+        return Visit
+
+    union = db.union_all(
+        db.select([_visits.c.id, _visits.c.user, _visits.c.timestamp]),
+        db.select([_archive.c.id, _archive.c.user, _archive.c.timestamp]),
+    ).subquery("all_visits")
+    return db.aliased(Visit, union)
+
+
+def _old_visits(table, cutoff: datetime, batch_size: int, keep_newest: bool = False):
+    """The ids and timestamps of the oldest visits before the cutoff."""
+    query = db.select([table.c.id, table.c.timestamp]).where(table.c.timestamp < cutoff)
+    if keep_newest:
+        # SQLite hands out max(id) + 1 as the next id, so the newest visit
+        # must never be moved, otherwise the id of an archived visit could be
+        # used again.
+        newest = db.select([db.func.max(_visits.c.id)]).scalar_subquery()
+        query = query.where(table.c.id < newest)
+
+    query = query.order_by(table.c.id).limit(batch_size)
+    return db.session.execute(query).all()
+
+
+def archive_visits(
+    older_than: timedelta,
+    batch_size: int = 1000,
+    pause: float = 0.05,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Move the visits older than older_than into the archive.
+
+    The caches of the days of the moved visits are invalidated after every
+    batch, as they only count the visits that aren't archived.
+
+    :param pause: Seconds to sleep between the batches.
+    :return: The number of archived visits.
+    """
+    cutoff = datetime.now() - older_than
+    archived = 0
+    while True:
+        rows = _old_visits(_visits, cutoff, batch_size, keep_newest=True)
+        if len(rows) == 0:
+            break
+
+        ids = [row.id for row in rows]
+        columns = [_visits.c.id, _visits.c.user, _visits.c.timestamp]
+        db.session.execute(
+            _archive.insert().from_select(
+                ["id", "user", "timestamp"],
+                db.select(columns).where(_visits.c.id.in_(ids)),
+            )
+        )
+        db.session.execute(_visits.delete().where(_visits.c.id.in_(ids)))
+        db.session.commit()
+        invalidation.invalidate_visits(row.timestamp for row in rows)
+
+        archived += len(ids)
+        if progress is not None:
+            progress(archived)
+        sleep(pause)
+
+    return archived
+
+
+def purge_visits(
+    older_than: timedelta,
+    batch_size: int = 1000,
+    pause: float = 0.05,
+) -> int:
+    """Delete the visits (archived or not) older than older_than.
+
+    The caches of the days of the deleted visits are invalidated after every
+    batch, so deleted visits don't live on in them.
+
+    :return: The number of deleted visits.
+    """
+    cutoff = datetime.now() - older_than
+    deleted = 0
+    for table in (_archive, _visits):
+        while True:
+            rows = _old_visits(table, cutoff, batch_size)
+            if len(rows) == 0:
+                break
+
+            ids = [row.id for row in rows]
+            db.session.execute(table.delete().where(table.c.id.in_(ids)))
+            db.session.commit()
+            invalidation.invalidate_visits(row.timestamp for row in rows)
+            deleted += len(ids)
+            sleep(pause)
+
+    return deleted
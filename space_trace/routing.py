@@ -0,0 +1,93 @@
+r"""Routing of read-only queries to their own engine.
+
+Statistics and exports can run long queries, which shouldn't hold up the
+latency-critical writes of check-ins. Code wrapped in `read_only` runs its
+queries on a separate engine: a replica if `SQLALCHEMY_READ_DATABASE_URI` is
+set, otherwise a separate pool of read-only connections to the same
+database (with SQLite in WAL mode these never block the writer).
+
+Flushes always go to the primary engine.
+"""
+
+import sqlite3
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict
+
+from flask import Flask
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+_reading: ContextVar[bool] = ContextVar("reading", default=False)
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = Lock()
+
+
+class read_only(ContextDecorator):
+    """Run the queries of a block (or function) on the read-only engine.
+
+    Usable as context manager (`with read_only():`) or decorator
+    (`@read_only()`).
+    """
+
+    def _recreate_cm(self):
+        # As decorator the same instance would be entered by every call, and
+        # concurrent calls would overwrite each other's token.
+        return type(self)()
+
+    def __enter__(self):
+        self._token = _reading.set(True)
+        return self
+
+    def __exit__(self, *exc):
+        _reading.reset(self._token)
+        return False
+
+
+def is_read_only() -> bool:
+    return _reading.get()
+
+
+def _set_query_only(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute("PRAGMA query_only=ON")
+
+
+def read_engine(app: Flask) -> Engine:
+    """The engine for read-only queries, created once per database."""
+    uri = app.config.get("SQLALCHEMY_READ_DATABASE_URI")
+    if uri is None:
+        uri = app.config["SQLALCHEMY_DATABASE_URI"]
+
+    with _engines_lock:
+        if uri in _engines:
+            return _engines[uri]
+
+        db = get_state(app).db
+        sa_url, options = db.apply_driver_hacks(app, make_url(uri), {})
+        options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+
+        if sa_url.drivername.startswith("sqlite"):
+            # Unlike the writer, keep a pool of connections around. Every
+            # connection is only ever used by one thread at a time.
+            options["poolclass"] = QueuePool
+            options["pool_size"] = app.config.get("SQLALCHEMY_READ_POOL_SIZE", 5)
+            options.setdefault("connect_args", {})["check_same_thread"] = False
+
+        engine = db.create_engine(sa_url, options)
+        event.listen(engine, "connect", _set_query_only)
+        _engines[uri] = engine
+        return engine
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends the queries inside `read_only` to `read_engine`."""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if _reading.get() and not self._flushing:
+            return read_engine(self.app)
+        return super().get_bind(mapper, clause)
@@ -1,31 +1,149 @@
-from typing import Dict
+r"""A local cache of the Slack member directory.
 
-from slack_bolt import App
+Exports need the Slack handle of every member, asking Slack for the whole
+directory on every export is slow, so the directory is synchronised into the
+database in the background and exports only read that copy.
+"""
 
-from space_trace import app
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional
 
+from space_trace import app, db
+from space_trace.models import SlackSync, SlackUser
 
-def get_slack_handle_table() -> Dict[str, str]:
-    """Returns a dictionary that maps email adresses to Slack handles.
+if TYPE_CHECKING:
+    from slack_sdk import WebClient
 
-    TODO: Currently this will not fetch users from the racing team.
+_sync_lock = Lock()
+_sync_thread: Optional[Thread] = None
+
+
+def slack_client() -> "WebClient":
+    # Only needed for the sync, and slack_sdk takes a while to import.
+    from slack_sdk import WebClient
+
+    return WebClient(
+        token=app.config["SLACK_USER_TOKEN"],
+        base_url=app.config.get("SLACK_API_URL", "https://slack.com/api/"),
+        timeout=app.config.get("SLACK_API_TIMEOUT", 30),
+    )
+
+
+def fetch_slack_members(client: "WebClient") -> Iterator[Dict[str, Any]]:
+    """Iterate over all members of the workspace, page by page."""
+    cursor = None
+    while True:
+        response = client.users_list(limit=200, cursor=cursor)
+        yield from response["members"]
+
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
 
-    Note: This table will be incomplete.
+
+def slack_handle(member: Dict[str, Any]) -> str:
+    handle = member["profile"].get("display_name", "")
+    if handle == "":
+        handle = member["profile"].get("real_name", "")
+    return "@" + handle
+
+
+def sync_slack_directory() -> SlackSync:
+    """Synchronise the Slack directory into the database.
+
+    Only members that changed since the last synchronisation (according to
+    Slack) are written, and they are committed in small batches so the sync
+    never holds the write lock for long. Only the newest `SlackSync` is kept.
+
+    TODO: Currently this will not fetch users from the racing team.
     """
+    cached = dict(db.session.query(SlackUser.id, SlackUser.updated).all())
+    seen = set()
+    changed = 0
 
-    slack_app = App(token=app.config["SLACK_USER_TOKEN"])
-    users = slack_app.client.users_list().data["members"]
+    for member in fetch_slack_members(slack_client()):
+        email = member.get("profile", {}).get("email")
+        if email is None or member.get("deleted", False):
+            continue
 
-    table = {}
-    for user in users:
-        try:
-            email = user["profile"]["email"]
-        except KeyError:
+        seen.add(member["id"])
+        if cached.get(member["id"]) == member.get("updated", 0):
             continue
 
-        handle = user["profile"]["display_name"]
-        if handle == "":
-            handle = user["profile"]["real_name"]
-        table[email] = "@" + handle
+        user = SlackUser(
+            member["id"], email, slack_handle(member), member.get("updated", 0)
+        )
+        if member["id"] in cached:
+            db.session.query(SlackUser).filter(SlackUser.id == user.id).update(
+                {
+                    "email": user.email,
+                    "handle": user.handle,
+                    "updated": user.updated,
+                }
+            )
+        else:
+            db.session.add(user)
+        changed += 1
+        if changed % 200 == 0:
+            db.session.commit()
+
+    # Members that left the workspace (or lost their email)
+    gone = set(cached.keys()) - seen
+    if len(gone) != 0:
+        db.session.query(SlackUser).filter(SlackUser.id.in_(gone)).delete(
+            synchronize_session=False
+        )
+
+    sync = SlackSync(datetime.now(), len(seen), changed + len(gone))
+    db.session.add(sync)
+    db.session.flush()
+    # Only the last sync is ever read
+    db.session.query(SlackSync).filter(SlackSync.id < sync.id).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    return sync
+
+
+def last_slack_sync() -> Optional[SlackSync]:
+    return SlackSync.query.order_by(SlackSync.finished_at.desc()).first()
+
+
+def _sync_in_background():
+    with app.app_context():
+        try:
+            sync_slack_directory()
+        except Exception as e:
+            app.logger.warning(f"Slack directory sync failed: {e}")
+            db.session.rollback()
+
+
+def start_slack_sync() -> Thread:
+    """Start a sync in the background, unless one is already running."""
+    global _sync_thread
+
+    with _sync_lock:
+        if _sync_thread is None or not _sync_thread.is_alive():
+            _sync_thread = Thread(target=_sync_in_background, daemon=True)
+            _sync_thread.start()
+        return _sync_thread
+
+
+def get_slack_handle_table() -> Dict[str, str]:
+    """Returns a dictionary that maps email adresses to Slack handles.
+
+    This reads the local copy of the directory and starts a sync in the
+    background if that copy is outdated. Only if there never was a sync this
+    waits for it, but at most `SLACK_SYNC_TIMEOUT` seconds.
+
+    Note: This table will be incomplete, callers need a fallback.
+    """
+    sync = last_slack_sync()
+    interval = timedelta(seconds=app.config.get("SLACK_SYNC_INTERVAL", 3600))
+    if sync is None or sync.finished_at < datetime.now() - interval:
+        thread = start_slack_sync()
+        if sync is None:
+            thread.join(timeout=app.config.get("SLACK_SYNC_TIMEOUT", 5))
 
-    return table
+    return dict(db.session.query(SlackUser.email, SlackUser.handle).all())
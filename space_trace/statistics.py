@@ -3,37 +3,46 @@ functions might not only be used to strictly create statistics or graphs.
 """
 
 
-from typing import Any, Dict, List, Tuple
-from space_trace.models import User, Visit
+from typing import Any, Dict, List, Optional, Tuple
+from space_trace.models import User, UserActivity, UserRecord, Visit
 from space_trace import db
-from datetime import datetime, timedelta
+from space_trace.activity import WINDOWS, refresh_activity, window_start
+from space_trace.dialects import day_bucket, hour_bucket, month_bucket
+from space_trace.retention import visit_source
+from space_trace.routing import read_only
+from datetime import date, datetime, timedelta
 
 
+@read_only()
 def total_users() -> int:
     """Count of the total number users registered in the system"""
     return User.query.count()
 
 
-def total_visits() -> int:
+@read_only()
+def total_visits(include_archive: bool = False) -> int:
     """Count of the total number of visits"""
-    return Visit.query.count()
+    visit = visit_source(include_archive)
+    return db.session.query(visit).count()
 
 
+@read_only()
 def active_visits() -> int:
     """Count of currently active visits (users that are counted as in the HQ)"""
     cutoff_timestamp = datetime.now() - timedelta(hours=12)
     return Visit.query.filter(Visit.timestamp > cutoff_timestamp).count()
 
 
-def active_users(team: str = None) -> List[User]:
+@read_only()
+def active_users(team: str = None) -> List[UserRecord]:
     """List the currently active users in the HQ.
 
     :param team: Filter the users by team, if None all teams are considered.
-    :return: List of users
+    :return: List of users, ordered by their email
     """
     cutoff_timestamp = datetime.now() - timedelta(hours=12)
     query = (
-        db.session.query(User)
+        db.session.query(*UserRecord.columns)
         .filter(User.id == Visit.user)
         .filter(Visit.timestamp > cutoff_timestamp)
     )
@@ -41,19 +50,20 @@ def active_users(team: str = None) -> List[User]:
     if team is not None:
         query = query.filter(User.team == team)
 
-    users = query.order_by(User.email).all()
-    return sorted(users, key=lambda u: u.email)
+    return [UserRecord(*row) for row in query.order_by(User.email)]
 
 
-def checkins_per_hour() -> Dict[str, Any]:
+@read_only()
+def checkins_per_hour(include_archive: bool = False) -> Dict[str, Any]:
     """Show at which times users log in.
 
     This data is meant for a graph, the returned dict has the keys 'labels' for
     the x axis and 'data' with a numeric value.
     """
+    visit = visit_source(include_archive)
     rows = db.session.query(
-        db.func.strftime("%H", Visit.timestamp), db.func.count(Visit.id)
-    ).group_by(db.func.strftime("%H", Visit.timestamp))
+        hour_bucket(visit.timestamp), db.func.count(visit.id)
+    ).group_by(hour_bucket(visit.timestamp))
 
     checkins = dict()
     checkins["labels"] = [f"{i}h" for i in range(24)]
@@ -65,48 +75,93 @@ def checkins_per_hour() -> Dict[str, Any]:
     return checkins
 
 
-def most_frequent_users(limit: int = 16) -> List[Tuple[int, User]]:
+def most_frequent_users(
+    limit: int = 16, days: Optional[int] = None, include_archive: bool = False
+) -> List[Tuple[int, UserRecord]]:
     """Show the users with the most visits.
 
+    All time and the windows in `activity.WINDOWS` are read from the activity
+    summary, other windows count the visits in them.
+
     :param limit: Limits the number of returned users.
+    :param days: Only count the visits of the last days (including today), if
+        None all visits are counted.
+    :param include_archive: Also count the archived visits, only needed for
+        windows that are not in the summary.
     """
+    if days is None:
+        count = UserActivity.total_visits
+    elif days in WINDOWS:
+        # Only the first call of a day finds outdated windows, the refresh
+        # writes, so it can't run on the read-only engine.
+        with read_only():
+            stale = db.session.query(
+                db.exists().where(UserActivity.window_day < date.today())
+            ).scalar()
+        if stale:
+            refresh_activity()
+        count = getattr(UserActivity, f"visits_{days}d")
+    else:
+        return _most_frequent_users_between(limit, days, include_archive)
+
+    with read_only():
+        rows = (
+            db.session.query(count, *UserRecord.columns)
+            .filter(UserActivity.user == User.id)
+            .filter(count > 0)
+            .order_by(count.desc(), User.email)
+            .limit(limit)
+            .all()
+        )
+    return [(count, UserRecord(*user)) for count, *user in rows]
+
+
+@read_only()
+def _most_frequent_users_between(
+    limit: int, days: int, include_archive: bool
+) -> List[Tuple[int, UserRecord]]:
+    visit = visit_source(include_archive)
+    count = db.func.count(visit.id)
+    visits = (
+        db.session.query(visit.user, count.label("visits"))
+        .filter(visit.timestamp >= window_start(datetime.now().date(), days))
+        .group_by(visit.user)
+        .subquery()
+    )
     rows = (
-        db.session.query(db.func.count(User.id), User)
-        .filter(Visit.user == User.id)
-        .group_by(User)
-        .order_by(db.func.count(User.id).desc())
+        db.session.query(visits.c.visits, *UserRecord.columns)
+        .filter(visits.c.user == User.id)
+        .order_by(visits.c.visits.desc(), User.email)
         .limit(limit)
         .all()
     )
-    return [(count, user) for count, user in rows]
+    return [(count, UserRecord(*user)) for count, *user in rows]
 
 
-def daily_usage() -> Dict[str, Any]:
+@read_only()
+def daily_usage(include_archive: bool = False) -> Dict[str, Any]:
     """Show the usage per day (last 30)."""
+    visit = visit_source(include_archive)
     cutoff_timestamp = datetime.now() - timedelta(days=30)
     cutoff_timestamp = cutoff_timestamp.replace(
         hour=0, minute=0, second=0, microsecond=0
     )
 
     visits = (
-        db.session.query(
-            db.func.strftime("%Y-%m-%d", Visit.timestamp), db.func.count(Visit.id)
-        )
-        .filter(Visit.timestamp >= cutoff_timestamp)
-        .group_by(db.func.strftime("%Y-%m-%d", Visit.timestamp))
-        .order_by(db.func.strftime("%Y-%m-%d", Visit.timestamp))
+        db.session.query(day_bucket(visit.timestamp), db.func.count(visit.id))
+        .filter(visit.timestamp >= cutoff_timestamp)
+        .group_by(day_bucket(visit.timestamp))
+        .order_by(day_bucket(visit.timestamp))
         .all()
     )
 
     visits_st = (
-        db.session.query(
-            db.func.strftime("%Y-%m-%d", Visit.timestamp), db.func.count(Visit.id)
-        )
-        .filter(Visit.timestamp >= cutoff_timestamp)
-        .filter(User.id == Visit.user)
+        db.session.query(day_bucket(visit.timestamp), db.func.count(visit.id))
+        .filter(visit.timestamp >= cutoff_timestamp)
+        .filter(User.id == visit.user)
         .filter(User.team == "space")
-        .group_by(db.func.strftime("%Y-%m-%d", Visit.timestamp))
-        .order_by(db.func.strftime("%Y-%m-%d", Visit.timestamp))
+        .group_by(day_bucket(visit.timestamp))
+        .order_by(day_bucket(visit.timestamp))
         .all()
     )
 
@@ -137,29 +192,29 @@ def daily_usage() -> Dict[str, Any]:
     }
 
 
-def monthly_usage() -> Dict[str, Any]:
+@read_only()
+def monthly_usage(include_archive: bool = False) -> Dict[str, Any]:
     """Show the usage per month.
 
     This data is meant for a graph, the returned dict has the keys 'labels' for
     the x axis and 'data' with a numeric value.
     """
+    visit = visit_source(include_archive)
     visits = (
-        db.session.query(
-            db.func.strftime("%Y-%m", Visit.timestamp), db.func.count(Visit.id)
-        )
-        .group_by(db.func.strftime("%Y-%m", Visit.timestamp))
-        .order_by(db.func.strftime("%Y-%m", Visit.timestamp))
+        db.session.query(month_bucket(visit.timestamp), db.func.count(visit.id))
+        .group_by(month_bucket(visit.timestamp))
+        .order_by(month_bucket(visit.timestamp))
         .all()
     )
 
     active_users = (
         db.session.query(
-            db.func.strftime("%m-%Y", Visit.timestamp),
+            month_bucket(visit.timestamp),
             db.func.count(db.func.distinct(User.id)),
         )
-        .filter(User.id == Visit.user)
-        .group_by(db.func.strftime("%m-%Y", Visit.timestamp))
-        .order_by(db.func.strftime("%Y-%m", Visit.timestamp))
+        .filter(User.id == visit.user)
+        .group_by(month_bucket(visit.timestamp))
+        .order_by(month_bucket(visit.timestamp))
         .all()
     )
 
@@ -0,0 +1,194 @@
+r"""Fake members and visits, to try out the service at production scale.
+
+The visits follow the rhythm of the HQ: more on weekdays than on weekends,
+mostly in the afternoon and evening, and a few members come far more often
+than most. Everything is generated with numpy and inserted with batched
+executemany statements, so a million visits only take seconds.
+
+Never run this against the production database.
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from space_trace import db
+from space_trace.models import User, Visit
+
+FIRST_NAMES = (
+    "anna", "lukas", "sarah", "david", "julia", "felix", "lisa", "jakob",
+    "laura", "maximilian", "hannah", "tobias", "katharina", "simon", "sophie",
+    "paul", "magdalena", "elias", "lena", "florian", "theresa", "michael",
+    "valentina", "johannes", "marie", "sebastian", "clara", "matthias", "eva",
+    "daniel", "nora", "stefan", "emma", "philipp", "miriam", "alexander",
+    "leonie", "moritz", "selina", "ana-maria", "jan-niklas", "lea-sophie",
+)  # fmt: skip
+LAST_NAMES = (
+    "gruber", "huber", "wagner", "mueller", "pichler", "steiner", "moser",
+    "mayer", "hofer", "leitner", "berger", "fuchs", "eder", "fischer",
+    "schmid", "winkler", "weber", "schwarz", "maier", "schneider", "reiter",
+    "mayr", "schmidt", "wimmer", "egger", "brunner", "lang", "baumgartner",
+    "auer", "binder", "lechner", "wolf", "wallner", "aigner", "ebner",
+    "koller", "lehner", "haas", "schuster", "holzer", "novak", "horvath",
+)  # fmt: skip
+
+DOMAIN = "example.com"
+
+# Monday to Sunday
+WEEKDAY_WEIGHTS = (1.0, 1.0, 1.1, 1.0, 0.8, 0.4, 0.3)
+HOUR_WEIGHTS = (
+    0.2, 0.1, 0.05, 0.02, 0.02, 0.02, 0.05, 0.2, 0.6, 1.0, 1.4, 1.6,
+    1.8, 2.2, 2.8, 3.4, 4.0, 4.4, 4.6, 4.2, 3.2, 2.0, 1.0, 0.5,
+)  # fmt: skip
+
+
+def _insert(statement, rows: list, batch_size: int, progress=None):
+    for i in range(0, len(rows), batch_size):
+        # Every batch in its own transaction, so the database doesn't need to
+        # keep millions of rows in one.
+        with db.engine.begin() as connection:
+            if isinstance(statement, str):
+                connection.exec_driver_sql(statement, rows[i : i + batch_size])
+            else:
+                connection.execute(statement, rows[i : i + batch_size])
+        if progress is not None:
+            progress(min(i + batch_size, len(rows)))
+
+
+def _emails(count: int, existing: set, rng: np.random.Generator) -> List[str]:
+    emails: List[str] = []
+    round = 1
+    while len(emails) < count:
+        # Every combination once, then again with a number after the last name
+        suffix = str(round) if round > 1 else ""
+        candidates = [
+            f"{first}.{last}{suffix}@{DOMAIN}"
+            for first in FIRST_NAMES
+            for last in LAST_NAMES
+        ]
+        rng.shuffle(candidates)
+        emails += [e for e in candidates if e not in existing]
+        round += 1
+    return emails[:count]
+
+
+def generate_users(
+    count: int,
+    certificates: bool = False,
+    seed: Optional[int] = None,
+    batch_size: int = 10_000,
+) -> List[int]:
+    """Insert fake members into both teams.
+
+    :param certificates: Also give them the validity dates of a vaccination or
+        a test, some of them already expired.
+    :return: The ids of the new users.
+    """
+    rng = np.random.default_rng(seed)
+    existing = {email for (email,) in db.session.query(User.email)}
+    last_id = db.session.query(db.func.max(User.id)).scalar() or 0
+    db.session.commit()
+
+    now = datetime.now().replace(microsecond=0)
+    emails = _emails(count, existing, rng)
+    teams = rng.choice(["space", "racing"], size=count, p=[0.6, 0.4])
+    created_days = rng.integers(0, 2 * 365, size=count)
+
+    rows = []
+    for email, team, created in zip(emails, teams, created_days):
+        rows.append(
+            {
+                "email": email,
+                "team": str(team),
+                "created_at": now - timedelta(days=int(created)),
+                "vaccinated_till": None,
+                "tested_till": None,
+                "medical_exception": False,
+            }
+        )
+
+    if certificates:
+        today = date.today()
+        for row in rows:
+            kind = rng.random()
+            if kind < 0.8:
+                row["vaccinated_till"] = today + timedelta(
+                    days=int(rng.integers(-60, 270))
+                )
+            elif kind < 0.95:
+                row["tested_till"] = now + timedelta(hours=int(rng.integers(-72, 48)))
+
+    _insert(User.__table__.insert(), rows, batch_size)
+    ids = [id for (id,) in db.session.query(User.id).filter(User.id > last_id)]
+    db.session.commit()
+    return ids
+
+
+def generate_visits(
+    count: int,
+    user_ids: List[int],
+    days: int = 365,
+    seed: Optional[int] = None,
+    batch_size: int = 10_000,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Insert fake visits of the users over the last days.
+
+    The visits are inserted in the order of their time, like real check-ins,
+    so that the ids grow with the timestamps.
+
+    :param progress: Called with the number of visits inserted so far after
+        every batch.
+    :return: The number of inserted visits.
+    """
+    if count == 0 or len(user_ids) == 0:
+        return 0
+
+    rng = np.random.default_rng(seed)
+
+    # Pick the days by their weekday weight
+    first_day = np.datetime64(date.today() - timedelta(days=days - 1), "D")
+    day_offsets = np.arange(days)
+    weekdays = (first_day + day_offsets).astype("datetime64[D]").view("int64")
+    # 1970-01-01 was a Thursday
+    weights = np.array(WEEKDAY_WEIGHTS)[(weekdays + 3) % 7]
+    visit_days = rng.choice(day_offsets, size=count, p=weights / weights.sum())
+
+    hour_weights = np.array(HOUR_WEIGHTS)
+    hours = rng.choice(24, size=count, p=hour_weights / hour_weights.sum())
+    seconds = hours * 3600 + rng.integers(0, 3600, size=count)
+    timestamps = (
+        first_day.astype("datetime64[s]")
+        + visit_days.astype("timedelta64[D]")
+        + seconds.astype("timedelta64[s]")
+    )
+
+    # Some members come far more often than others
+    activity = rng.pareto(1.5, size=len(user_ids)) + 0.1
+    users = rng.choice(user_ids, size=count, p=activity / activity.sum())
+
+    # Today's visits that would be in the future happened a week ago instead
+    now = np.datetime64(datetime.now(), "s")
+    timestamps = np.where(
+        timestamps > now, timestamps - np.timedelta64(7, "D"), timestamps
+    )
+
+    order = np.argsort(timestamps, kind="stable")
+    users, timestamps = users[order], timestamps[order]
+
+    if db.engine.dialect.name == "sqlite":
+        # SQLAlchemy formats every datetime on its own, which takes longer
+        # than the insert. These strings are formatted just like it would.
+        values = np.char.replace(np.datetime_as_string(timestamps, unit="us"), "T", " ")
+        statement = 'INSERT INTO visits ("user", timestamp) VALUES (?, ?)'
+        rows = list(zip(users.tolist(), values.tolist()))
+    else:
+        statement = Visit.__table__.insert()
+        rows = [
+            {"user": user, "timestamp": timestamp}
+            for user, timestamp in zip(users.tolist(), timestamps.tolist())
+        ]
+
+    _insert(statement, rows, batch_size, progress)
+    return len(rows)
@@ -0,0 +1,183 @@
+r"""Contact tracing on top of the visits.
+
+Every visit is modelled as a presence interval: a member that checks in at `t`
+is counted as in the HQ from `t` until `t + 12h`. Two members had contact if
+their intervals overlap, and the length of that overlap is how long they were
+in the HQ together.
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from space_trace import db
+from space_trace.models import User, UserRecord
+from space_trace.retention import visit_source
+
+# How long a member is considered to be in the HQ after checking in.
+PRESENCE_DURATION = timedelta(hours=12)
+
+Interval = Tuple[datetime, datetime]
+
+
+@dataclass
+class Contact:
+    """A member that was in the HQ at the same time as someone else."""
+
+    user: UserRecord
+    overlap: timedelta
+    days: List[date]
+
+
+def presence_interval(timestamp: datetime) -> Interval:
+    """The time range a visit starting at timestamp counts as in the HQ."""
+    return (timestamp, timestamp + PRESENCE_DURATION)
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Merge overlapping (or touching) intervals into a sorted disjoint list."""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def total_duration(intervals: Iterable[Interval]) -> timedelta:
+    """Sum of the lengths of disjoint intervals."""
+    return sum((end - start for start, end in intervals), timedelta())
+
+
+def covered_days(intervals: Iterable[Interval]) -> List[date]:
+    """All calendar days that are touched by at least one interval."""
+    days = set()
+    for start, end in intervals:
+        day = start.date()
+        # The end is exclusive, so an interval ending at midnight doesn't
+        # touch the next day.
+        last = (end - timedelta(microseconds=1)).date()
+        while day <= last:
+            days.add(day)
+            day += timedelta(days=1)
+    return sorted(days)
+
+
+def visit_intervals(
+    user_id: int,
+    start: datetime,
+    end: Optional[datetime] = None,
+    include_archive: bool = False,
+) -> List[Interval]:
+    """The merged presence intervals of a user clipped to [start, end)."""
+    visit = visit_source(include_archive)
+    query = (
+        db.session.query(visit.timestamp)
+        .filter(visit.user == user_id)
+        .filter(visit.timestamp > start - PRESENCE_DURATION)
+    )
+    if end is not None:
+        query = query.filter(visit.timestamp < end)
+
+    intervals = []
+    for (timestamp,) in query.order_by(visit.timestamp):
+        visit_start, visit_end = presence_interval(timestamp)
+        visit_start = max(visit_start, start)
+        if end is not None:
+            visit_end = min(visit_end, end)
+        if visit_start < visit_end:
+            intervals.append((visit_start, visit_end))
+
+    return merge_intervals(intervals)
+
+
+def overlaps_with(
+    intervals: List[Interval],
+    exclude_user: Optional[int] = None,
+    include_archive: bool = False,
+) -> Dict[int, List[Interval]]:
+    """Find everybody that was in the HQ during the given intervals.
+
+    This is a single sweep over all visits in the covered time range, sorted
+    by timestamp (so it can use `idx_visits_timestamp`). As both the visits
+    and the intervals are sorted, every visit is only compared with the
+    intervals it can actually overlap.
+
+    :param intervals: Sorted, disjoint intervals (see `merge_intervals`).
+    :param exclude_user: A user id to ignore, usually the one the intervals
+        belong to.
+    :param include_archive: Also consider the archived visits.
+    :return: The merged overlapping intervals per user id.
+    """
+    if len(intervals) == 0:
+        return {}
+
+    visit = visit_source(include_archive)
+    query = (
+        db.session.query(visit.user, visit.timestamp)
+        .filter(visit.timestamp > intervals[0][0] - PRESENCE_DURATION)
+        .filter(visit.timestamp < intervals[-1][1])
+    )
+    if exclude_user is not None:
+        query = query.filter(visit.user != exclude_user)
+
+    overlaps: Dict[int, List[Interval]] = {}
+    first = 0
+    for user_id, timestamp in query.order_by(visit.timestamp):
+        visit_start, visit_end = presence_interval(timestamp)
+
+        # Visits come in ascending order, so intervals that ended before this
+        # visit started are also over for all following visits.
+        while first < len(intervals) and intervals[first][1] <= visit_start:
+            first += 1
+
+        i = first
+        while i < len(intervals) and intervals[i][0] < visit_end:
+            overlap_start = max(visit_start, intervals[i][0])
+            overlap_end = min(visit_end, intervals[i][1])
+            if overlap_start < overlap_end:
+                overlaps.setdefault(user_id, []).append((overlap_start, overlap_end))
+            i += 1
+
+    # A member might have checked in twice within 12h, so their own
+    # intervals can overlap and must not be counted twice.
+    return {user_id: merge_intervals(o) for user_id, o in overlaps.items()}
+
+
+def find_contacts(
+    infected_id: int,
+    start: datetime,
+    end: Optional[datetime] = None,
+    include_archive: bool = False,
+) -> List[Contact]:
+    """Find all contacts of a member in a time range.
+
+    :param infected_id: The id of the member whose contacts we want.
+    :param start: Only contacts after this point in time are considered.
+    :param end: Only contacts before this point in time are considered, if None
+        all contacts till now are considered.
+    :param include_archive: Also consider the archived visits.
+    :return: Every contact once, the longest contact first.
+    """
+    intervals = visit_intervals(infected_id, start, end, include_archive)
+    overlaps = overlaps_with(intervals, infected_id, include_archive)
+    if len(overlaps) == 0:
+        return []
+
+    users = [
+        UserRecord(*row)
+        for row in db.session.query(*UserRecord.columns).filter(
+            User.id.in_(overlaps.keys())
+        )
+    ]
+    contacts = [
+        Contact(
+            user=user,
+            overlap=total_duration(overlaps[user.id]),
+            days=covered_days(overlaps[user.id]),
+        )
+        for user in users
+    ]
+    return sorted(contacts, key=lambda c: (-c.overlap, c.user.email))
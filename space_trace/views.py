@@ -1,12 +1,23 @@
 from datetime import date, datetime, timedelta
 import json
+import tempfile
+from typing import Iterator
 from traceback import format_exception
 
 import flask
-from flask import redirect, send_file, url_for, request, flash
+from flask import (
+    Response,
+    abort,
+    flash,
+    redirect,
+    request,
+    send_file,
+    stream_with_context,
+    url_for,
+)
 from flask.helpers import make_response
 from flask.templating import render_template
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError
 
 from werkzeug.exceptions import InternalServerError
 
@@ -17,13 +28,39 @@ from space_trace.auth import (
     require_login,
     require_2g,
 )
-from space_trace.certificates import (
-    CertificateException,
-    detect_and_attach_cert,
+from space_trace.bulk_export import (
+    FORMATS,
+    iter_visit_batches,
+    stream_jsonl_gz,
+    write_batches,
+)
+from space_trace.activity import WINDOWS
+from space_trace.checkin import bulk_check_in, check_in
+from space_trace import door_pass
+from space_trace.contact_graph import build_contact_graph
+from space_trace.export import (
+    contact_graph_to_csv,
+    contact_graph_to_json,
+    exposure_pairs_to_csv,
+    exposure_totals_to_csv,
+    get_contacts_of,
+    get_users_between,
+    occupancy_to_csv,
+    stream_contacts_csv,
+    stream_users_csv,
 )
-from space_trace.export import get_contacts_of, get_users_between, users_to_csv
+from space_trace.exposure import exposure_matrix_between
+from space_trace.http_cache import cached_page, static_file_response
 from space_trace.jokes import get_daily_joke
-from space_trace.models import User, Visit
+from space_trace.live import TooManyListeners, broadcaster, event_stream
+from space_trace.metrics import collect as collect_metrics, render as render_metrics
+from space_trace.models import User, UserActivity, UserRecord, Visit
+from space_trace.occupancy import (
+    RESOLUTIONS,
+    daily_peaks,
+    occupancy,
+    over_capacity,
+)
 from space_trace.statistics import (
     active_users,
     active_visits,
@@ -81,6 +118,8 @@ def home():
         visit=visit,
         visit_deadline=visit_deadline,
         joke=joke,
+        door_pass=door_pass.issue(user) if door_pass.enabled() else None,
+        door_pass_refresh=door_pass.max_age() // 2,
     )
 
 
@@ -90,19 +129,50 @@ def home():
 def add_visit():
     user: User = flask.g.user
 
-    # Don't enter a visit if there is already one for today
-    visit = get_active_visit(user)
-    if visit is not None:
+    # Doesn't enter a visit if there is already one for today
+    if not check_in(user.id):
         flash("You are already registered for today", "warning")
-        return redirect(url_for("home"))
 
-    # Create a new visit
-    visit = Visit(datetime.now(), user.id)
-    db.session.add(visit)
-    db.session.commit()
     return redirect(url_for("home"))
 
 
+@app.get("/door-pass")
+@require_login
+@require_2g
+def get_door_pass():
+    # The home page fetches a new pass before the shown one expires.
+    if not door_pass.enabled():
+        abort(404)
+    return {"pass": door_pass.issue(flask.g.user)}
+
+
+@app.post("/kiosk/scan")
+def kiosk_scan():
+    if not door_pass.enabled():
+        abort(404)
+
+    scheme, _, key = request.headers.get("Authorization", "").partition(" ")
+    if scheme != "Bearer" or not door_pass.is_kiosk_key(key):
+        return {"ok": False, "reason": "kiosk", "message": "Unknown kiosk"}, 401
+
+    token = request.form.get("pass") or (request.get_json(silent=True) or {}).get(
+        "pass", ""
+    )
+    try:
+        scanned = door_pass.verify(token)
+    except door_pass.DoorPassError as e:
+        return {"ok": False, "reason": e.reason, "message": e.message}, 403
+
+    created = check_in(scanned.user_id)
+    return {
+        "ok": True,
+        "user": scanned.user_id,
+        "team": scanned.team,
+        "checked_in": created,
+        "valid_till": scanned.valid_till.isoformat(timespec="minutes"),
+    }
+
+
 @app.get("/cert")
 @require_login
 def cert():
@@ -113,6 +183,11 @@ def cert():
 @app.post("/cert")
 @require_login
 def upload_cert():
+    # Reading certificates needs PIL, zbar, poppler and cose, which take a
+    # while to import. Only the workers that get an upload import them (or
+    # the master with gunicorn --preload, see wsgi.py).
+    from space_trace.certificates import CertificateException, detect_and_attach_cert
+
     user: User = flask.g.user
 
     file = request.files["file"]
@@ -123,15 +198,8 @@ def upload_cert():
         return redirect(request.url)
 
     try:
+        # Sets the dates on the user, which are written with the commit.
         detect_and_attach_cert(file, user)
-
-        db.session.query(User).filter(User.id == user.id).update(
-            {
-                "vaccinated_till": user.vaccinated_till,
-                "tested_till": user.tested_till,
-            }
-        )
-        user = User.query.filter(User.id == user.id).first()
         db.session.commit()
 
     except IntegrityError:
@@ -173,6 +241,7 @@ def delete_cert():
         }
     )
     db.session.commit()
+    door_pass.revoke(user.id)
 
     flash("Successfully deleted your certificate", "success")
     return redirect(url_for("cert"))
@@ -193,6 +262,7 @@ def delete_test():
         }
     )
     db.session.commit()
+    door_pass.revoke(user.id)
 
     flash("Successfully deleted your test", "success")
     return redirect(url_for("cert"))
@@ -201,20 +271,50 @@ def delete_test():
 @app.get("/admin")
 @require_admin
 def admin():
-    users = User.query.order_by(User.email).all()
+    # The most recently active users first, those that never checked in last.
+    users = [
+        UserRecord(*row)
+        for row in db.session.query(*UserRecord.columns)
+        .outerjoin(UserActivity, UserActivity.user == User.id)
+        .order_by(UserActivity.last_visit.is_(None), UserActivity.last_visit.desc())
+        .order_by(User.email)
+    ]
+    leaderboard_days = request.args.get("leaderboardDays", type=int)
+
+    now = datetime.now()
+    capacity = app.config.get("HQ_CAPACITY")
 
     return render_template(
         "admin.html",
         user=flask.g.user,
         users=users,
-        checkins_per_hour=checkins_per_hour(),
-        most_frequent_users=most_frequent_users(),
+        checkins_per_hour=checkins_per_hour(include_archive=True),
+        leaderboard_days=leaderboard_days,
+        leaderboard_windows=WINDOWS,
+        most_frequent_users=most_frequent_users(
+            days=leaderboard_days, include_archive=True
+        ),
         daily_usage=daily_usage(),
-        monthly_usage=monthly_usage(),
-        now=datetime.now(),
+        occupancy=occupancy(now - timedelta(days=7), now),
+        daily_peaks=daily_peaks(now.date() - timedelta(days=13), now.date()),
+        capacity=capacity,
+        over_capacity=(
+            []
+            if capacity is None
+            else over_capacity(now - timedelta(days=30), now, capacity)
+        ),
+        monthly_usage=monthly_usage(include_archive=True),
+        now=now,
     )
 
 
+def csv_response(rows: Iterator[str], filename: str) -> Response:
+    """Stream a CSV to the client while it is still being generated."""
+    output = Response(stream_with_context(rows), mimetype="text/csv")
+    output.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return output
+
+
 @app.get("/admin/contacts.csv")
 @require_admin
 def contacts_csv():
@@ -225,16 +325,14 @@ def contacts_csv():
         flash("End date cannot be before start date.", "warning")
         return redirect(url_for("admin"))
 
-    users = get_users_between(start, end)
+    include_archive = request.args.get("includeArchive") == "on"
+    users = get_users_between(start, end, include_archive)
 
-    if len(users) == 0:
+    if not db.session.query(users.exists()).scalar():
         flash("No members were in the HQ at that time 👍", "success")
         return redirect("admin")
 
-    output = make_response(users_to_csv(users))
-    output.headers["Content-Disposition"] = "attachment; filename=export.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+    return csv_response(stream_users_csv(users), "export.csv")
 
 
 @app.get("/admin/smart-contacts.csv")
@@ -243,25 +341,188 @@ def smart_contacts_csv():
     format = "%Y-%m-%d"
     start = datetime.strptime(request.args.get("startDate"), format)
     infected_id = int(request.args.get("infectedId"))
-    users = get_contacts_of(start, infected_id)
+    include_archive = request.args.get("includeArchive") == "on"
+    contacts = get_contacts_of(start, infected_id, include_archive)
 
-    if len(users) == 0:
+    if len(contacts) == 0:
         flash("No members were in the HQ at that time 👍", "success")
         return redirect(url_for("admin"))
 
-    output = make_response(users_to_csv(users))
-    output.headers["Content-Disposition"] = "attachment; filename=export.csv"
+    return csv_response(stream_contacts_csv(contacts), "export.csv")
+
+
+def contact_graph_from_args():
+    format = "%Y-%m-%d"
+    start = datetime.strptime(request.args.get("startDate"), format)
+    infected_id = int(request.args.get("infectedId"))
+    depth = int(request.args.get("depth", 2))
+    window = timedelta(days=int(request.args.get("windowDays", 14)))
+    include_archive = request.args.get("includeArchive") == "on"
+    return build_contact_graph(
+        infected_id,
+        start,
+        depth=depth,
+        window=window,
+        include_archive=include_archive,
+    )
+
+
+@app.get("/admin/contact-graph.csv")
+@require_admin
+def contact_graph_csv():
+    graph = contact_graph_from_args()
+
+    if len(graph.edges) == 0:
+        flash("No members were in the HQ at that time 👍", "success")
+        return redirect(url_for("admin"))
+
+    output = make_response(contact_graph_to_csv(graph))
+    output.headers["Content-Disposition"] = "attachment; filename=contact-graph.csv"
+    output.headers["Content-type"] = "text/csv"
+    return output
+
+
+@app.get("/admin/contact-graph.json")
+@require_admin
+def contact_graph_json():
+    graph = contact_graph_from_args()
+
+    output = make_response(contact_graph_to_json(graph))
+    output.headers["Content-Disposition"] = "attachment; filename=contact-graph.json"
+    output.headers["Content-type"] = "application/json"
+    return output
+
+
+@app.get("/admin/exposure.csv")
+@require_admin
+def exposure_csv():
+    format = "%Y-%m-%d"
+    start = datetime.strptime(request.args.get("startDate"), format)
+    end = datetime.strptime(request.args.get("endDate"), format)
+    if start > end:
+        flash("End date cannot be before start date.", "warning")
+        return redirect(url_for("admin"))
+
+    include_archive = request.args.get("includeArchive") == "on"
+    matrix = exposure_matrix_between(start, end, include_archive)
+    if request.args.get("report") == "totals":
+        csv = exposure_totals_to_csv(matrix)
+    else:
+        csv = exposure_pairs_to_csv(matrix, int(request.args.get("limit", 100)))
+
+    output = make_response(csv)
+    output.headers["Content-Disposition"] = "attachment; filename=exposure.csv"
     output.headers["Content-type"] = "text/csv"
     return output
 
 
+@app.get("/admin/occupancy.csv")
+@require_admin
+def occupancy_csv():
+    format = "%Y-%m-%d"
+    start = datetime.strptime(request.args.get("startDate"), format)
+    end = datetime.strptime(request.args.get("endDate"), format)
+    if start > end:
+        flash("End date cannot be before start date.", "warning")
+        return redirect(url_for("admin"))
+
+    resolution = request.args.get("resolution", "hour")
+    if resolution not in RESOLUTIONS:
+        resolution = "hour"
+
+    # The end date is inclusive
+    series = occupancy(start, end + timedelta(days=1), resolution)
+
+    output = make_response(occupancy_to_csv(series))
+    output.headers["Content-Disposition"] = "attachment; filename=occupancy.csv"
+    output.headers["Content-type"] = "text/csv"
+    return output
+
+
+@app.get("/admin/metrics")
+@require_admin
+def admin_metrics():
+    output = make_response(render_metrics(collect_metrics()))
+    output.headers["Content-type"] = "text/plain; version=0.0.4"
+    return output
+
+
+@app.post("/admin/check-in")
+@require_admin
+def admin_bulk_check_in():
+    # Only JSON, which browsers don't send to other sites without asking.
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("users"), list):
+        return {"error": 'Send JSON with a list of emails or ids as "users"'}, 400
+
+    try:
+        timestamp = datetime.now()
+        if body.get("timestamp"):
+            timestamp = datetime.fromisoformat(body["timestamp"])
+            if timestamp.tzinfo is not None:
+                # Visits are stored in local time
+                timestamp = timestamp.astimezone().replace(tzinfo=None)
+        results = bulk_check_in(body["users"], timestamp)
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}, 400
+
+    summary: dict = {}
+    for result in results:
+        summary[result.status] = summary.get(result.status, 0) + 1
+    return {
+        "timestamp": timestamp.isoformat(timespec="seconds"),
+        "summary": summary,
+        "results": [result.__dict__ for result in results],
+    }
+
+
+@app.get("/admin/visits-export")
+@require_admin
+def visits_export():
+    format = request.args.get("format", "jsonl")
+    if format not in FORMATS:
+        flash(f"Unknown export format: {format}", "warning")
+        return redirect(url_for("admin"))
+
+    since_id = int(request.args.get("sinceId", 0) or 0)
+    filename = f"visits-{since_id + 1}.{FORMATS[format]}"
+    include_archive = request.args.get("includeArchive") == "on"
+    batches = iter_visit_batches(since_id, include_archive=include_archive)
+
+    if format == "jsonl":
+        output = Response(
+            stream_with_context(stream_jsonl_gz(batches)),
+            mimetype="application/gzip",
+        )
+        output.headers["Content-Disposition"] = f"attachment; filename={filename}"
+        return output
+
+    # The columnar formats need a seekable file. The file is deleted once the
+    # with block exits but the handle we send stays valid till it is closed.
+    with tempfile.NamedTemporaryFile(suffix=filename) as file:
+        try:
+            write_batches(batches, file.name, format)
+        except ImportError:
+            flash(f"Exporting {format} is not installed on this server.", "warning")
+            return redirect(url_for("admin"))
+
+        return send_file(
+            open(file.name, "rb"),
+            mimetype="application/octet-stream",
+            as_attachment=True,
+            download_name=filename,
+        )
+
+
 @app.get("/help")
+@cached_page
 @maybe_load_user
 def help():
     return render_template("help.html", user=flask.g.user)
 
 
 @app.get("/statistic")
+@cached_page
 @maybe_load_user
 def statistic():
     user = flask.g.user
@@ -269,18 +530,62 @@ def statistic():
         "statistic.html",
         user=user,
         total_users=total_users(),
-        total_visits=total_visits(),
+        total_visits=total_visits(include_archive=True),
         active_visits=active_visits(),
         active_users_st=None if user is None else active_users(team="space"),
         active_users_rt=None if user is None else active_users(team="racing"),
     )
 
 
+@app.get("/statistic/stream")
+@maybe_load_user
+def statistic_stream():
+    with_roster = flask.g.user is not None
+    # The stream stays open for a long time, it must not keep a database
+    # connection checked out.
+    db.session.remove()
+
+    live = broadcaster()
+    try:
+        queue = live.subscribe(limit=app.config.get("LIVE_MAX_STREAMS", 4))
+    except TooManyListeners:
+        # Browsers don't reconnect after this, the page just stays as it is.
+        output = Response("Too many live listeners", status=503)
+        output.headers["Retry-After"] = "60"
+        return output
+
+    max_age = app.config.get("LIVE_STREAM_MAX_AGE", 1800)
+    output = Response(
+        event_stream(queue, with_roster, max_age), mimetype="text/event-stream"
+    )
+    # Also if the stream is closed before it started
+    output.call_on_close(lambda: live.unsubscribe(queue))
+    output.headers["Cache-Control"] = "no-cache"
+    # Tell nginx not to buffer the events
+    output.headers["X-Accel-Buffering"] = "no"
+    return output
+
+
 @app.errorhandler(404)
 def not_found(e):
     return render_template("404.html"), 404
 
 
+@app.errorhandler(OperationalError)
+def database_busy(e):
+    # SQLite gave up waiting for the write lock (SQLITE_BUSY_TIMEOUT), this
+    # happens when too many check in at the same time.
+    if "database is locked" not in str(e.orig):
+        raise e
+
+    db.session.rollback()
+    return (
+        render_template("busy.html"),
+        503,
+        {"Retry-After": "1"},
+    )
+
+
 @app.errorhandler(InternalServerError)
 def handle_bad_request(e):
     return (
@@ -318,7 +623,7 @@ def me():
 
 @app.get("/goots")
 def goots():
-    return send_file("static/goots.png")
+    return static_file_response("goots.png", "image/png")
 
 
 @app.get("/crash-now")
@@ -0,0 +1,28 @@
+r"""The entry point for gunicorn with `--preload`.
+
+Importing `space_trace` leaves the heavy parts (reading certificates, the SAML
+login, the Slack client) for their first use, so that the CLI and the tests
+start quickly. With `--preload` gunicorn imports this module once in the
+master process before forking the workers, so everything is loaded and the
+templates are compiled there. The workers share that memory (copy-on-write)
+instead of each loading it again on their first upload or login.
+
+    gunicorn --preload -w 8 space_trace.wsgi:app
+"""
+
+from space_trace import app
+
+
+def warm_up():
+    """Import everything a request might need and compile the templates."""
+    import onelogin.saml2.auth  # noqa: F401
+    import onelogin.saml2.utils  # noqa: F401
+    import slack_sdk  # noqa: F401
+
+    import space_trace.certificates  # noqa: F401
+
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+
+
+warm_up()
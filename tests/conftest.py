@@ -1,10 +1,12 @@
 import os
+import shutil
 import tempfile
 from flask_sqlalchemy import SQLAlchemy
 
 import pytest
 
 from space_trace import app, db
+from space_trace.models import User
 
 
 @pytest.fixture
@@ -14,6 +16,15 @@ def client():
     db_fd, db_path = tempfile.mkstemp()
     app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
     app.config["TESTING"] = True
+    instance_dir = tempfile.mkdtemp()
+    app.config["PAGE_CACHE_DIR"] = os.path.join(instance_dir, "page_cache")
+    app.config["METRICS_DIR"] = os.path.join(instance_dir, "metrics")
+    app.config["INVALIDATED_DAYS_FILE"] = os.path.join(instance_dir, "invalidated_days")
+    app.config["EXPIRY_NOTIFICATION_FILE"] = os.path.join(
+        instance_dir, "notifications.jsonl"
+    )
+    app.config["BACKUP_DIR"] = os.path.join(instance_dir, "backups")
+    app.config["DOOR_PASS_DENY_LIST"] = os.path.join(instance_dir, "door_pass_revoked")
 
     # db = SQLAlchemy(app)
     with app.test_client() as client:
@@ -24,3 +35,17 @@ def client():
 
     os.close(db_fd)
     os.unlink(db_path)
+    shutil.rmtree(instance_dir)
+
+
+@pytest.fixture
+def admin_client(client):
+    """The client, logged in as the first admin."""
+    email = client.application.config["ADMINS"][0]
+    with client.application.app_context():
+        db.session.add(User(email, "space"))
+        db.session.commit()
+
+    with client.session_transaction() as session:
+        session["username"] = email
+    return client
@@ -0,0 +1,161 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from space_trace import db, statistics
+from space_trace.activity import (
+    delete_users,
+    inactive_users,
+    rebuild_activity,
+    refresh_activity,
+)
+from space_trace.checkin import check_in
+from space_trace.models import User, UserActivity, Visit
+from space_trace.occupancy import clear_occupancy_cache, day_minute_peaks
+from space_trace.statistics import most_frequent_users
+
+
+@pytest.fixture
+def users(client):
+    with client.application.app_context():
+        ada = User("ada.lovelace@spaceteam.at", "space")
+        alan = User("alan.turing@spaceteam.at", "space")
+        db.session.add_all([ada, alan])
+        db.session.commit()
+        return ada.id, alan.id
+
+
+def activity(user_id: int) -> UserActivity:
+    db.session.expire_all()
+    return UserActivity.query.get(user_id)
+
+
+def test_check_in_updates_activity(client, users):
+    ada, _ = users
+    with client.application.app_context():
+        now = datetime.now()
+        for days in (100, 20, 3, 0):
+            assert check_in(ada, now - timedelta(days=days))
+
+        summary = activity(ada)
+        assert summary.total_visits == 4
+        assert (summary.visits_7d, summary.visits_30d, summary.visits_365d) == (
+            2,
+            3,
+            4,
+        )
+        assert summary.first_visit == now - timedelta(days=100)
+        assert summary.last_visit == now
+        assert summary.window_day == date.today()
+
+
+def test_refresh_moves_windows(client, users):
+    ada, alan = users
+    with client.application.app_context():
+        now = datetime.now()
+        for days in (100, 20, 3, 0):
+            check_in(ada, now - timedelta(days=days))
+        check_in(alan, now - timedelta(days=1))
+
+        future = date.today() + timedelta(days=10)
+        assert refresh_activity(future) == 2
+        assert refresh_activity(future) == 0
+
+        summary = activity(ada)
+        assert (summary.visits_7d, summary.visits_30d, summary.visits_365d) == (
+            0,
+            2,
+            4,
+        )
+
+        # The refreshed windows match a rebuild from scratch.
+        rebuild_activity(future)
+        summary = activity(ada)
+        assert (summary.visits_7d, summary.visits_30d) == (0, 2)
+        assert activity(alan).visits_30d == 1
+
+        refresh_activity(date.today() + timedelta(days=1000))
+        assert activity(ada).visits_365d == 0
+        assert activity(ada).total_visits == 4
+
+
+def test_leaderboard(client, users):
+    ada, alan = users
+    with client.application.app_context():
+        now = datetime.now()
+        for days in (100, 50, 1):
+            check_in(ada, now - timedelta(days=days))
+        check_in(alan, now - timedelta(days=2))
+        check_in(alan, now)
+
+        def ranking(**kwargs):
+            return [(count, user.id) for count, user in most_frequent_users(**kwargs)]
+
+        assert ranking() == [(3, ada), (2, alan)]
+        assert ranking(days=7) == [(2, alan), (1, ada)]
+        assert ranking(days=60) == [(2, ada), (2, alan)]
+        assert ranking(days=60, limit=1) == [(2, ada)]
+
+
+def test_leaderboard_only_refreshes_outdated_windows(client, users, monkeypatch):
+    ada, _ = users
+    refreshes = []
+    monkeypatch.setattr(
+        statistics, "refresh_activity", lambda: refreshes.append(refresh_activity())
+    )
+    with client.application.app_context():
+        check_in(ada, datetime.now() - timedelta(days=3))
+        most_frequent_users(days=7)
+        assert refreshes == []
+
+        UserActivity.query.update({"window_day": date.today() - timedelta(days=5)})
+        db.session.commit()
+        assert most_frequent_users(days=7)[0][0] == 1
+        assert refreshes == [1]
+
+
+def test_inactive_users(client, users):
+    ada, alan = users
+    with client.application.app_context():
+        check_in(ada, datetime.now() - timedelta(days=400))
+        check_in(alan, datetime.now())
+
+        assert [user.id for user in inactive_users(365)] == [ada]
+
+        last_year = (datetime.now() - timedelta(days=400)).date()
+        clear_occupancy_cache()
+        assert day_minute_peaks(last_year, last_year)[last_year].max() == 1
+
+        delete_users([ada])
+        assert day_minute_peaks(last_year, last_year)[last_year].max() == 0
+        clear_occupancy_cache()
+        assert User.query.get(ada) is None
+        assert Visit.query.count() == 1
+        assert activity(ada) is None
+
+
+def test_inactive_users_without_summary(client, users):
+    ada, alan = users
+    with client.application.app_context():
+        long_ago = datetime.now() - timedelta(days=400)
+        User.query.update({"created_at": long_ago})
+        # Visits from before the summary existed
+        db.session.add(Visit(long_ago, ada))
+        db.session.add(Visit(datetime.now() - timedelta(days=1), alan))
+        db.session.commit()
+
+        assert [user.id for user in inactive_users(365)] == [ada]
+
+
+def test_init_db_fills_activity(client, users):
+    ada, _ = users
+    with client.application.app_context():
+        db.session.add(Visit(datetime.now(), ada))
+        db.session.execute("DROP TABLE user_activity")
+        db.session.commit()
+
+    result = client.application.test_cli_runner().invoke(args=["init-db"])
+    assert result.exit_code == 0, result.output
+
+    with client.application.app_context():
+        assert activity(ada).total_visits == 1
@@ -0,0 +1,145 @@
+import gzip
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from threading import Event, Thread
+
+import pytest
+
+from space_trace import app, db
+from space_trace.backup import (
+    BackupException,
+    create_backup,
+    database_path,
+    restore_backup,
+    rotate,
+    snapshots,
+    verify_backup,
+)
+from space_trace.models import User, Visit
+
+
+@pytest.fixture
+def users(client):
+    with app.app_context():
+        for i in range(200):
+            db.session.add(User(f"member.number{i}@spaceteam.at", "space"))
+        db.session.commit()
+
+
+def count(path: str, table: str) -> int:
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_backup(users, tmp_path):
+    with app.app_context():
+        snapshot = create_backup(pages=1, pause=0)
+
+        assert snapshots() == [snapshot.path]
+        assert snapshot.pages > 1
+        with open(snapshot.path + ".sha256") as file:
+            assert file.read() == (
+                f"{snapshot.sha256}  {os.path.basename(snapshot.path)}\n"
+            )
+        verify_backup(snapshot.path)
+
+    with gzip.open(snapshot.path) as file, open(tmp_path / "copy.db", "wb") as copy:
+        copy.write(file.read())
+    assert count(tmp_path / "copy.db", "users") == 200
+
+
+def test_backup_while_writing(users):
+    done = Event()
+
+    def check_in():
+        with app.app_context():
+            i = 0
+            while not done.is_set():
+                db.session.add(Visit(datetime.now() - timedelta(minutes=i), 1))
+                db.session.commit()
+                i += 1
+
+    writer = Thread(target=check_in)
+    writer.start()
+    try:
+        with app.app_context():
+            # Without the read transaction the writes would restart the backup
+            # over and over.
+            snapshot = create_backup(pages=1, pause=0.001)
+    finally:
+        done.set()
+        writer.join()
+
+    with app.app_context():
+        verify_backup(snapshot.path)
+
+
+def test_verify_detects_damage(users):
+    with app.app_context():
+        path = create_backup(pause=0).path
+
+    with open(path, "r+b") as file:
+        file.seek(100)
+        byte = file.read(1)
+        file.seek(100)
+        file.write(bytes([byte[0] ^ 0xFF]))
+
+    with pytest.raises(BackupException, match="checksum"):
+        verify_backup(path)
+
+    os.remove(path + ".sha256")
+    with pytest.raises(BackupException, match="no checksum"):
+        verify_backup(path)
+
+
+def test_restore(users):
+    with app.app_context():
+        path = create_backup(pause=0).path
+        db.session.query(User).delete()
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+
+        restore_backup(path)
+        assert count(database_path(), "users") == 200
+        assert User.query.count() == 200
+
+
+def test_rotate(tmp_path):
+    for day in range(1, 6):
+        name = f"trace-202203{day:02}-120000.db.gz"
+        (tmp_path / name).write_bytes(b"")
+        (tmp_path / (name + ".sha256")).write_text("")
+    (tmp_path / "notes.txt").write_text("")
+
+    deleted = rotate(str(tmp_path), keep=2)
+
+    assert [os.path.basename(p) for p in deleted] == [
+        "trace-20220301-120000.db.gz",
+        "trace-20220302-120000.db.gz",
+        "trace-20220303-120000.db.gz",
+    ]
+    assert sorted(os.listdir(tmp_path)) == [
+        "notes.txt",
+        "trace-20220304-120000.db.gz",
+        "trace-20220304-120000.db.gz.sha256",
+        "trace-20220305-120000.db.gz",
+        "trace-20220305-120000.db.gz.sha256",
+    ]
+
+
+def test_backup_commands(users):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["backup", "--pause-ms", "0"])
+    assert result.exit_code == 0, result.output
+    assert "Backed up" in result.output
+
+    result = runner.invoke(args=["verify-backup"])
+    assert result.exit_code == 0, result.output
+
+    result = runner.invoke(args=["restore-backup", "--yes"])
+    assert result.exit_code == 0, result.output
@@ -0,0 +1,156 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from space_trace import db
+from space_trace.checkin import CheckinBatcher, bulk_check_in, check_in
+from space_trace.models import User, Visit
+from space_trace.occupancy import clear_occupancy_cache, day_minute_peaks
+
+
+@pytest.fixture
+def user(client):
+    with client.application.app_context():
+        user = User("ada.lovelace@spaceteam.at", "space")
+        user.vaccinated_till = datetime.now().date() + timedelta(days=100)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def test_check_in_is_idempotent(client, user):
+    with client.application.app_context():
+        now = datetime.now()
+        assert check_in(user, now)
+        assert not check_in(user, now + timedelta(seconds=1))
+        assert check_in(user, now + timedelta(hours=13))
+        assert Visit.query.count() == 2
+
+
+def test_group_commit(client, user):
+    batcher = CheckinBatcher(client.application, window=0.05, max_size=64)
+    now = datetime.now()
+
+    futures = [batcher.submit(user, now) for _ in range(8)]
+    results = [f.result(timeout=5) for f in futures]
+
+    assert results.count(True) == 1
+    with client.application.app_context():
+        assert Visit.query.count() == 1
+
+
+def test_double_click(client, user):
+    with client.session_transaction() as session:
+        session["username"] = "ada.lovelace@spaceteam.at"
+
+    assert client.post("/").status_code == 302
+    assert client.post("/").status_code == 302
+
+    with client.application.app_context():
+        assert Visit.query.count() == 1
+
+
+@pytest.fixture
+def group(client, user):
+    with client.application.app_context():
+        grace = User("grace.hopper@spaceteam.at", "racing")
+        grace.tested_till = datetime.now() + timedelta(hours=12)
+        expired = User("alan.turing@spaceteam.at", "space")
+        expired.vaccinated_till = date.today() - timedelta(days=1)
+        db.session.add_all([grace, expired])
+        db.session.commit()
+        return [user, grace.id, expired.id]
+
+
+def test_bulk_check_in(client, group):
+    ada, grace, alan = group
+    with client.application.app_context():
+        check_in(grace)
+        results = bulk_check_in(
+            [
+                "ada.lovelace@spaceteam.at",
+                str(grace),
+                alan,
+                "nobody@spaceteam.at",
+                ada,
+            ]
+        )
+
+        assert [(r.user_id, r.status) for r in results] == [
+            (ada, "checked_in"),
+            (grace, "already_checked_in"),
+            (alan, "no_2g"),
+            (None, "unknown"),
+            (ada, "already_checked_in"),
+        ]
+        assert Visit.query.count() == 2
+
+        with pytest.raises(ValueError):
+            bulk_check_in([ada], datetime.now() + timedelta(hours=1))
+
+
+def test_bulk_check_in_checks_2g_at_the_time(client, group):
+    ada, grace, alan = group
+    with client.application.app_context():
+        # The certificate of alan was still valid two days ago
+        results = bulk_check_in([alan, grace], datetime.now() - timedelta(days=2))
+        assert [r.status for r in results] == ["checked_in", "checked_in"]
+
+
+def test_bulk_check_in_before_a_later_visit(client, user):
+    with client.application.app_context():
+        now = datetime.now()
+        check_in(user, now)
+
+        # The visit today doesn't overlap one two days ago
+        results = bulk_check_in([user], now - timedelta(days=2))
+        assert [r.status for r in results] == ["checked_in"]
+        results = bulk_check_in([user], now - timedelta(hours=1))
+        assert [r.status for r in results] == ["already_checked_in"]
+        assert not check_in(user, now - timedelta(hours=2))
+        assert Visit.query.count() == 2
+
+
+def test_bulk_check_in_updates_cached_days(client, user):
+    clear_occupancy_cache()
+    yesterday = date.today() - timedelta(days=1)
+    with client.application.app_context():
+        assert day_minute_peaks(yesterday, yesterday)[yesterday].max() == 0
+
+        bulk_check_in([user], datetime.combine(yesterday, time(9)))
+        assert day_minute_peaks(yesterday, yesterday)[yesterday].max() == 1
+    clear_occupancy_cache()
+
+
+def test_bulk_check_in_view(client, group, monkeypatch):
+    monkeypatch.setitem(
+        client.application.config, "ADMINS", ["ada.lovelace@spaceteam.at"]
+    )
+    with client.session_transaction() as session:
+        session["username"] = "ada.lovelace@spaceteam.at"
+
+    response = client.post("/admin/check-in", data={"users": "1"})
+    assert response.status_code == 400
+
+    timestamp = datetime.combine(date.today(), time()).isoformat()
+    response = client.post(
+        "/admin/check-in", json={"users": group, "timestamp": timestamp}
+    )
+    assert response.status_code == 200
+    assert response.json["timestamp"] == timestamp
+    assert response.json["summary"] == {"checked_in": 2, "no_2g": 1}
+    assert [r["status"] for r in response.json["results"]] == [
+        "checked_in",
+        "checked_in",
+        "no_2g",
+    ]
+
+
+def test_bulk_check_in_command(client, group):
+    runner = client.application.test_cli_runner()
+    result = runner.invoke(
+        args=["bulk-check-in", "--file", "-", "ada.lovelace@spaceteam.at"],
+        input="grace.hopper@spaceteam.at\nnobody@spaceteam.at\n",
+    )
+    assert result.exit_code == 0, result.output
+    assert "Checked in 2 of 3 users" in result.output
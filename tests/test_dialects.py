@@ -0,0 +1,66 @@
+import os
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from space_trace import db
+from space_trace.dialects import day_bucket, hour_bucket, month_bucket
+from space_trace.migrate import copy_database
+from space_trace.models import User, Visit
+
+
+def compile(expression, dialect) -> str:
+    return str(select(expression).compile(dialect=dialect))
+
+
+def test_time_buckets_sqlite():
+    assert "strftime('%H', visits.timestamp)" in compile(
+        hour_bucket(Visit.timestamp), sqlite.dialect()
+    )
+    assert "strftime('%Y-%m-%d', visits.timestamp)" in compile(
+        day_bucket(Visit.timestamp), sqlite.dialect()
+    )
+
+
+def test_time_buckets_postgresql():
+    assert "to_char(visits.timestamp, 'HH24')" in compile(
+        hour_bucket(Visit.timestamp), postgresql.dialect()
+    )
+    assert "to_char(visits.timestamp, 'YYYY-MM')" in compile(
+        month_bucket(Visit.timestamp), postgresql.dialect()
+    )
+
+
+def test_copy_database(client):
+    db_fd, source_path = tempfile.mkstemp()
+    source = create_engine(f"sqlite:///{source_path}")
+    db.metadata.create_all(source)
+    with source.begin() as connection:
+        connection.execute(
+            User.__table__.insert(),
+            [
+                {"id": 1, "email": "ada.lovelace@spaceteam.at", "team": "space"},
+                {"id": 2, "email": "grace.hopper@spaceteam.at", "team": "racing"},
+            ],
+        )
+        connection.execute(
+            Visit.__table__.insert(),
+            [
+                {"user": i % 2 + 1, "timestamp": datetime(2022, 3, i)}
+                for i in range(1, 8)
+            ],
+        )
+
+    with client.application.app_context():
+        copied = copy_database(f"sqlite:///{source_path}", batch_size=3)
+
+        assert copied["users"] == 2
+        assert copied["visits"] == 7
+        assert Visit.query.order_by(Visit.id.desc()).first().timestamp == datetime(
+            2022, 3, 7
+        )
+
+    os.close(db_fd)
+    os.unlink(source_path)
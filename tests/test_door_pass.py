@@ -0,0 +1,156 @@
+from datetime import date, datetime, timedelta
+from time import time
+
+import pytest
+
+from space_trace import app, db, door_pass
+from space_trace.door_pass import DoorPassError
+from space_trace.models import User, Visit
+
+KIOSK = {"Authorization": "Bearer kiosk-key"}
+
+
+@pytest.fixture
+def kiosk(client):
+    app.config["KIOSK_KEYS"] = ["kiosk-key"]
+    yield client
+    app.config.pop("KIOSK_KEYS")
+
+
+@pytest.fixture
+def user(kiosk):
+    with app.app_context():
+        user = User("ada.lovelace@spaceteam.at", "space")
+        user.vaccinated_till = date.today() + timedelta(days=100)
+        db.session.add(user)
+        db.session.commit()
+        return user.email
+
+
+def load(email: str) -> User:
+    return User.query.filter(User.email == email).first()
+
+
+def test_verify(user):
+    with app.app_context():
+        user = load(user)
+        scanned = door_pass.verify(door_pass.issue(user))
+        assert scanned.user_id == user.id
+        assert scanned.team == "space"
+        assert scanned.valid_till.date() == user.vaccinated_till
+
+
+def test_verify_rejects(user):
+    with app.app_context():
+        user = load(user)
+        token = door_pass.issue(user)
+
+        with pytest.raises(DoorPassError) as e:
+            door_pass.verify(token[:-2] + "xx")
+        assert e.value.reason == "invalid"
+
+        # The certificate ran out while the pass was shown
+        with pytest.raises(DoorPassError) as e:
+            door_pass.verify(token, now=datetime.now() + timedelta(days=101))
+        assert e.value.reason == "no_2g"
+
+        app.config["DOOR_PASS_MAX_AGE"] = -1
+        try:
+            with pytest.raises(DoorPassError) as e:
+                door_pass.verify(token)
+            assert e.value.reason == "expired"
+        finally:
+            app.config.pop("DOOR_PASS_MAX_AGE")
+
+
+def test_revoke(user):
+    with app.app_context():
+        user = load(user)
+        token = door_pass.issue(user)
+        door_pass.revoke(user.id)
+
+        with pytest.raises(DoorPassError) as e:
+            door_pass.verify(token)
+        assert e.value.reason == "revoked"
+
+        # Passes issued after the revocation are fine
+        with open(door_pass.deny_list.path(), "w") as file:
+            file.write(f"{user.id} {time() - 10}\n")
+        assert door_pass.verify(door_pass.issue(user)).user_id == user.id
+
+
+def test_old_revocations_are_dropped(user):
+    with app.app_context():
+        user = load(user)
+        with open(door_pass.deny_list.path(), "w") as file:
+            file.write(f"{user.id} {time() - door_pass.max_age() - 10}\n")
+        door_pass.revoke(user.id + 1)
+
+        with open(door_pass.deny_list.path()) as file:
+            assert [line.split()[0] for line in file] == [str(user.id + 1)]
+
+
+def test_kiosk_scan(kiosk, user):
+    with app.app_context():
+        token = door_pass.issue(load(user))
+
+    response = kiosk.post("/kiosk/scan", json={"pass": token}, headers=KIOSK)
+    assert response.status_code == 200
+    assert response.json["ok"] and response.json["checked_in"]
+    assert response.json["team"] == "space"
+
+    # Scanning twice doesn't create a second visit
+    response = kiosk.post("/kiosk/scan", data={"pass": token}, headers=KIOSK)
+    assert response.status_code == 200
+    assert not response.json["checked_in"]
+
+    with app.app_context():
+        assert Visit.query.count() == 1
+
+
+def test_kiosk_scan_rejects(kiosk, user):
+    with app.app_context():
+        token = door_pass.issue(load(user))
+
+    response = kiosk.post("/kiosk/scan", json={"pass": token})
+    assert response.status_code == 401
+
+    response = kiosk.post(
+        "/kiosk/scan", json={"pass": token}, headers={"Authorization": "Bearer x"}
+    )
+    assert response.status_code == 401
+
+    response = kiosk.post("/kiosk/scan", json={"pass": "nope"}, headers=KIOSK)
+    assert response.status_code == 403
+    assert response.json["reason"] == "invalid"
+
+    with app.app_context():
+        assert Visit.query.count() == 0
+
+
+def test_kiosk_is_off_without_keys(client):
+    assert client.post("/kiosk/scan", json={"pass": "x"}).status_code == 404
+
+
+def test_home_shows_pass(kiosk, user):
+    with kiosk.session_transaction() as session:
+        session["username"] = user
+
+    response = kiosk.get("/")
+    assert b'id="door-pass"' in response.data
+
+    token = kiosk.get("/door-pass").json["pass"]
+    with app.app_context():
+        assert door_pass.verify(token).user_id == load(user).id
+
+
+def test_deleting_the_certificate_revokes(kiosk, user):
+    with kiosk.session_transaction() as session:
+        session["username"] = user
+    token = kiosk.get("/door-pass").json["pass"]
+
+    kiosk.post("/cert-delete")
+
+    response = kiosk.post("/kiosk/scan", json={"pass": token}, headers=KIOSK)
+    assert response.status_code == 403
+    assert response.json["reason"] == "revoked"
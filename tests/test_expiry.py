@@ -0,0 +1,140 @@
+import json
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from space_trace import app, db
+from space_trace.expiry import (
+    FileSender,
+    due_notifications,
+    expiring_users,
+    notify_expiring,
+)
+from space_trace.models import ExpiryNotification, User
+from space_trace.profiling import explain, is_full_scan
+
+
+def add_user(email, vaccinated_in=None, tested_in=None):
+    user = User(email, "space")
+    if vaccinated_in is not None:
+        user.vaccinated_till = date.today() + timedelta(days=vaccinated_in)
+    if tested_in is not None:
+        user.tested_till = datetime.now() + tested_in
+    db.session.add(user)
+    return user
+
+
+@pytest.fixture
+def users(client):
+    with app.app_context():
+        add_user("ada.lovelace@spaceteam.at", vaccinated_in=20)
+        add_user("grace.hopper@spaceteam.at", vaccinated_in=3)
+        add_user("alan.turing@spaceteam.at", tested_in=timedelta(hours=20))
+        # Expires soon, but has a test that lasts longer
+        add_user(
+            "edsger.dijkstra@spaceteam.at",
+            vaccinated_in=0,
+            tested_in=timedelta(days=2),
+        )
+        add_user("barbara.liskov@spaceteam.at", vaccinated_in=60)
+        add_user("donald.knuth@spaceteam.at", vaccinated_in=-1)
+        db.session.commit()
+
+
+def test_due_notifications(users):
+    with app.app_context():
+        due = {n.email: n for n in due_notifications()}
+
+    assert sorted(due) == [
+        "ada.lovelace@spaceteam.at",
+        "alan.turing@spaceteam.at",
+        "edsger.dijkstra@spaceteam.at",
+        "grace.hopper@spaceteam.at",
+    ]
+    assert due["ada.lovelace@spaceteam.at"].days == 21
+    assert due["grace.hopper@spaceteam.at"].days == 7
+    assert "vaccination certificate" in due["grace.hopper@spaceteam.at"].message
+    assert "in 3 day(s)" in due["grace.hopper@spaceteam.at"].message
+    assert "Your test" in due["edsger.dijkstra@spaceteam.at"].message
+
+
+def test_notify_expiring_sends_once(users):
+    with app.app_context():
+        assert notify_expiring(FileSender(), batch_size=3) == {"due": 4, "sent": 4}
+        assert notify_expiring(FileSender()) == {"due": 0, "sent": 0}
+        assert ExpiryNotification.query.count() == 4
+
+        # The second reminder comes when it is due
+        user = User.query.filter(User.email == "ada.lovelace@spaceteam.at").first()
+        user.vaccinated_till = date.today() + timedelta(days=5)
+        db.session.commit()
+        assert notify_expiring(FileSender()) == {"due": 1, "sent": 1}
+
+    with open(app.config["EXPIRY_NOTIFICATION_FILE"]) as file:
+        lines = [json.loads(line) for line in file]
+    assert len(lines) == 5
+    assert lines[-1]["email"] == "ada.lovelace@spaceteam.at"
+    assert lines[-1]["days"] == 7
+
+
+def test_failed_batches_are_sent_again(users):
+    class FailingSender:
+        def send(self, notifications):
+            raise ConnectionError()
+
+    with app.app_context():
+        with pytest.raises(ConnectionError):
+            notify_expiring(FailingSender())
+        assert len(due_notifications()) == 4
+
+
+def test_expired_notifications_are_removed(users):
+    with app.app_context():
+        user = User.query.filter(User.email == "donald.knuth@spaceteam.at").first()
+        db.session.add(
+            ExpiryNotification(
+                user.id, datetime.now() - timedelta(days=1), 7, datetime.now()
+            )
+        )
+        db.session.commit()
+        notify_expiring(FileSender())
+        assert ExpiryNotification.query.filter_by(user=user.id).count() == 0
+
+
+def test_expiring_users_use_the_indexes(client):
+    with app.app_context():
+        query = expiring_users(datetime.now(), timedelta(days=21))
+        statement = query.statement.compile(db.engine)
+        parameters = [statement.params[name] for name in statement.positiontup]
+        connection = db.engine.raw_connection()
+        try:
+            plan = explain(connection.cursor(), str(statement), parameters)
+        finally:
+            connection.close()
+
+    assert not is_full_scan(plan), plan
+
+
+def test_notify_expiring_command(users):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["notify-expiring", "--dry-run"])
+    assert result.exit_code == 0, result.output
+    assert "grace.hopper@spaceteam.at" in result.output
+
+    result = runner.invoke(args=["notify-expiring", "--sender", "file"])
+    assert result.exit_code == 0, result.output
+    assert "Sent 4 of 4" in result.output
+
+
+def test_init_db_adds_missing_indexes(client):
+    with app.app_context():
+        db.session.execute("DROP INDEX idx_users_vaccinated_till")
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["init-db"])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        assert "idx_users_vaccinated_till" in {
+            index["name"] for index in db.inspect(db.engine).get_indexes("users")
+        }
@@ -0,0 +1,121 @@
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+from space_trace import db
+from space_trace import export, views
+from space_trace.bulk_export import export_visits, iter_visit_batches
+from space_trace.models import User, Visit
+
+
+@pytest.fixture(autouse=True)
+def no_slack(monkeypatch):
+    monkeypatch.setattr(export, "get_slack_handle_table", lambda: {})
+
+
+def test_get_users_between_is_distinct(client):
+    with client.application.app_context():
+        user = User("ada.lovelace@spaceteam.at", "space")
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Visit(datetime(2022, 3, 1, 8), user.id))
+        db.session.add(Visit(datetime(2022, 3, 2, 8), user.id))
+        db.session.commit()
+
+        users = export.get_users_between(datetime(2022, 3, 1), datetime(2022, 3, 2))
+        assert users.all() == [user]
+
+
+def test_stream_users_csv(client):
+    with client.application.app_context():
+        db.session.add(User("ada.lovelace@spaceteam.at", "space"))
+        db.session.commit()
+
+        lines = list(export.stream_users_csv(User.query))
+
+    assert lines[0].startswith("first name,last name")
+    assert lines[1] == "Ada,Lovelace,space,ada.lovelace@spaceteam.at,@Ada Lovelace\r\n"
+
+
+def test_contacts_csv_is_streamed(admin_client):
+    with admin_client.application.app_context():
+        user = User("ada.lovelace@spaceteam.at", "space")
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Visit(datetime(2022, 3, 1, 8), user.id))
+        db.session.commit()
+
+    res = admin_client.get(
+        "/admin/contacts.csv?startDate=2022-03-01&endDate=2022-03-01"
+    )
+    assert res.status_code == 200
+    assert res.is_streamed
+    assert b"ada.lovelace@spaceteam.at" in res.data
+
+
+def test_contacts_csv_without_visits(admin_client):
+    res = admin_client.get(
+        "/admin/contacts.csv?startDate=2022-03-01&endDate=2022-03-01"
+    )
+    assert res.status_code == 302
+
+
+def test_export_visits_since_last(client, tmp_path):
+    with client.application.app_context():
+        user = User("ada.lovelace@spaceteam.at", "space")
+        db.session.add(user)
+        db.session.commit()
+        for day in range(1, 6):
+            db.session.add(Visit(datetime(2022, 3, day, 8), user.id))
+        db.session.commit()
+
+        result = export_visits(str(tmp_path), batch_size=2)
+        assert result["rows"] == 5
+
+        with gzip.open(result["path"], "rt") as file:
+            rows = [json.loads(line) for line in file]
+        assert rows[0]["email"] == "ada.lovelace@spaceteam.at"
+        assert rows[-1]["timestamp"] == "2022-03-05T08:00:00"
+
+        assert export_visits(str(tmp_path), since_last=True)["path"] is None
+
+        db.session.add(Visit(datetime(2022, 3, 6, 8), user.id))
+        db.session.commit()
+        result = export_visits(str(tmp_path), since_last=True)
+        assert result["rows"] == 1
+        assert result["path"].endswith("visits-6-6.jsonl.gz")
+
+
+def test_visits_export_is_streamed(admin_client, monkeypatch):
+    with admin_client.application.app_context():
+        user = User("ada.lovelace@spaceteam.at", "space")
+        db.session.add(user)
+        db.session.commit()
+        for day in range(1, 8):
+            db.session.add(Visit(datetime(2022, 3, day, 8), user.id))
+        db.session.commit()
+
+    batch_sizes = []
+
+    def small_batches(since_id, **kwargs):
+        for batch in iter_visit_batches(since_id, batch_size=3, **kwargs):
+            batch_sizes.append(len(batch["visit_id"]))
+            yield batch
+
+    monkeypatch.setattr(views, "iter_visit_batches", small_batches)
+
+    res = admin_client.get("/admin/visits-export?format=jsonl&sinceId=1")
+    assert res.status_code == 200
+    assert res.is_streamed
+    rows = [json.loads(line) for line in gzip.decompress(res.data).splitlines()]
+    assert [row["visit_id"] for row in rows] == list(range(2, 8))
+    assert rows[-1]["timestamp"] == "2022-03-07T08:00:00"
+    assert {row["email"] for row in rows} == {"ada.lovelace@spaceteam.at"}
+    assert batch_sizes == [3, 3]
+
+
+def test_visits_export_unknown_format(admin_client):
+    res = admin_client.get("/admin/visits-export?format=csv")
+    assert res.status_code == 302
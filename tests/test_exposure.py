@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from space_trace import db, exposure
+from space_trace.exposure import exposure_matrix, merge_user_intervals
+from space_trace.models import User, Visit
+
+
+def test_merge_user_intervals():
+    users = np.array([2, 1, 1, 1])
+    starts = np.array([0, 10, 0, 30])
+    ends = np.array([5, 20, 12, 40])
+
+    merged = merge_user_intervals(users, starts, ends)
+    assert [list(a) for a in merged] == [[1, 1, 2], [0, 30, 0], [20, 40, 5]]
+
+
+@pytest.mark.parametrize("dense", [True, False])
+def test_exposure_matrix(client, monkeypatch, dense):
+    if not dense:
+        monkeypatch.setattr(exposure, "_DENSE_LIMIT", 0)
+
+    with client.application.app_context():
+        emails = ["ada.lovelace@a.at", "grace.hopper@a.at", "alan.turing@a.at"]
+        users = [User(email, "space") for email in emails]
+        db.session.add_all(users)
+        db.session.commit()
+        ada, grace, alan = [u.id for u in users]
+
+        day = datetime(2022, 3, 1)
+        for user_id, hour in [(ada, 8), (ada, 9), (grace, 12), (alan, 19)]:
+            db.session.add(Visit(day + timedelta(hours=hour), user_id))
+        db.session.commit()
+
+        matrix = exposure_matrix(day, day + timedelta(days=1))
+
+        # Ada is there from 8 till 21, Grace from 12 till 24 and Alan from 19.
+        assert matrix.top_pairs(10) == [
+            (ada, grace, 9.0),
+            (grace, alan, 5.0),
+            (ada, alan, 2.0),
+        ]
+        assert matrix.totals() == [(grace, 14.0), (ada, 11.0), (alan, 7.0)]
+        assert matrix.dense()[0, 1] == 9.0
+
+
+def test_exposure_matrix_without_visits(client):
+    with client.application.app_context():
+        matrix = exposure_matrix(datetime(2022, 3, 1), datetime(2022, 3, 2))
+        assert matrix.top_pairs() == []
+        assert matrix.totals() == []
@@ -0,0 +1,103 @@
+import os
+from datetime import datetime
+from time import time
+
+from space_trace import db
+from space_trace.http_cache import MAX_CACHED_PAGES
+from space_trace.models import User, Visit
+
+
+def add_visit(client):
+    with client.application.app_context():
+        user = User("ada.lovelace@spaceteam.at", "space")
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Visit(datetime.now(), user.id))
+        db.session.commit()
+
+
+def test_guests_get_cached_page(client):
+    first = client.get("/statistic")
+    assert first.cache_control.public
+    assert "Cookie" in first.vary
+    assert first.get_etag()[0] is not None
+
+    # Still the cached page
+    add_visit(client)
+    second = client.get("/statistic")
+    assert second.data == first.data
+    assert b"Currently in the HQ (0)" in second.data
+
+    client.application.config["PAGE_CACHE_TTL"] = 0
+    try:
+        assert b"Currently in the HQ (1)" in client.get("/statistic").data
+    finally:
+        del client.application.config["PAGE_CACHE_TTL"]
+
+
+def test_query_strings_share_the_page(client):
+    cache_dir = client.application.config["PAGE_CACHE_DIR"]
+    first = client.get("/help?utm_source=slack")
+    assert client.get("/help?a=1").data == first.data
+    assert client.get("/help").data == first.data
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_old_pages_are_pruned(client):
+    cache_dir = client.application.config["PAGE_CACHE_DIR"]
+    os.makedirs(cache_dir, exist_ok=True)
+    old = time() - 60
+    for i in range(MAX_CACHED_PAGES + 10):
+        path = os.path.join(cache_dir, f"page-{i}")
+        open(path, "w").close()
+        if i < 5:
+            os.utime(path, (old, old))
+        else:
+            os.utime(path, (old + 55 + i / 100, old + 55 + i / 100))
+
+    client.get("/help")
+
+    names = os.listdir(cache_dir)
+    assert len(names) == MAX_CACHED_PAGES
+    # The expired ones and the oldest of the rest are gone
+    assert "page-4" not in names and "page-5" not in names
+    assert f"page-{MAX_CACHED_PAGES + 9}" in names
+
+
+def test_not_modified(client):
+    etag = client.get("/help").get_etag()[0]
+    res = client.get("/help", headers={"If-None-Match": f'"{etag}"'})
+    assert res.status_code == 304
+    assert res.data == b""
+
+
+def test_users_get_fresh_page(client):
+    add_visit(client)
+    client.get("/statistic")
+
+    with client.session_transaction() as session:
+        session["username"] = "ada.lovelace@spaceteam.at"
+    res = client.get("/statistic")
+    assert res.cache_control.private
+    assert res.cache_control.no_cache
+    assert b"Lovelace" in res.data
+
+
+def test_fingerprinted_static_files(client):
+    page = client.get("/help").data.decode()
+    assert "/static/bootstrap-primer-light.css?v=" in page
+
+    start = page.index("/static/bootstrap-primer-light.css?v=")
+    url = page[start : page.index('"', start)]
+    res = client.get(url)
+    assert res.cache_control.max_age == 365 * 24 * 60 * 60
+    assert res.cache_control.immutable
+    res.close()
+
+
+def test_goots(client):
+    res = client.get("/goots")
+    assert res.mimetype == "image/png"
+    etag = res.get_etag()[0]
+    res = client.get("/goots", headers={"If-None-Match": f'"{etag}"'})
+    assert res.status_code == 304
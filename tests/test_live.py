@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from space_trace import db
+from space_trace.checkin import check_in
+from space_trace.live import broadcaster
+from space_trace.models import User
+
+
+@pytest.fixture
+def user(client):
+    with client.application.app_context():
+        user = User("ada.lovelace@spaceteam.at", "space")
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def test_check_in_is_pushed(client, user):
+    live = broadcaster()
+    # Only a check-in can wake it up that fast.
+    live.interval = 60
+    queue = live.subscribe()
+    try:
+        first = queue.get(timeout=5)
+        assert first["counts"]["active_visits"] == 0
+
+        with client.application.app_context():
+            check_in(user, datetime.now())
+
+        update = queue.get(timeout=5)
+        assert update["counts"] == {
+            "total_users": 1,
+            "total_visits": 1,
+            "active_visits": 1,
+        }
+        assert update["roster"] == {
+            "space": [{"first_name": "Ada", "last_name": "Lovelace"}],
+            "racing": [],
+        }
+    finally:
+        live.unsubscribe(queue)
+        live.interval = 2
+
+
+def read_events(response, count):
+    events = []
+    for chunk in response.response:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith("event:"):
+            name, data = chunk.strip().split("\n")
+            events.append((name[len("event: ") :], json.loads(data[len("data: ") :])))
+        if len(events) == count:
+            break
+    response.close()
+    return events
+
+
+def test_stream_hides_names_from_guests(client, user):
+    response = client.get("/statistic/stream")
+    assert response.mimetype == "text/event-stream"
+    assert read_events(response, 1) == [
+        ("counts", {"total_users": 1, "total_visits": 0, "active_visits": 0})
+    ]
+
+    with client.session_transaction() as session:
+        session["username"] = "ada.lovelace@spaceteam.at"
+    names = [name for name, _ in read_events(client.get("/statistic/stream"), 2)]
+    assert names == ["counts", "roster"]
+
+
+def test_streams_are_limited(client, user):
+    client.application.config["LIVE_MAX_STREAMS"] = 1
+    try:
+        first = client.get("/statistic/stream")
+        assert first.status_code == 200
+        assert client.get("/statistic/stream").status_code == 503
+
+        # Closing a stream frees its place, even if it never started
+        first.close()
+        second = client.get("/statistic/stream")
+        assert second.status_code == 200
+        second.close()
+    finally:
+        del client.application.config["LIVE_MAX_STREAMS"]
@@ -0,0 +1,75 @@
+import json
+import os
+
+from space_trace.metrics import merge, quantile
+
+
+def metric(text: str, line_start: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(line_start):
+            return float(line.split(" ")[-1])
+    raise KeyError(line_start)
+
+
+def test_quantile():
+    buckets = [1, 2, 4]
+    assert quantile(0.5, buckets, [0, 0, 0, 0]) is None
+    assert quantile(0.5, buckets, [10, 0, 0, 0]) == 0.5
+    assert quantile(0.75, buckets, [5, 5, 0, 0]) == 1.5
+    assert quantile(0.99, buckets, [0, 0, 0, 3]) == 4
+
+
+def test_merge():
+    a = {
+        "counters": {"c": {'x="1"': 2}},
+        "histograms": {"h": {"": {"buckets": [1], "counts": [1, 0], "sum": 0.5}}},
+    }
+    b = {
+        "counters": {"c": {'x="1"': 3, 'x="2"': 1}},
+        "histograms": {"h": {"": {"buckets": [1], "counts": [0, 2], "sum": 4.0}}},
+    }
+    merged = merge([a, b])
+    assert merged["counters"] == {"c": {'x="1"': 5, 'x="2"': 1}}
+    assert merged["histograms"]["h"][""] == {
+        "buckets": [1],
+        "counts": [1, 2],
+        "sum": 4.5,
+    }
+    # The inputs are left alone
+    assert a["histograms"]["h"][""]["counts"] == [1, 0]
+
+
+def test_metrics_endpoint(admin_client):
+    for _ in range(3):
+        admin_client.get("/help")
+
+    # The metrics of another worker
+    metrics_dir = admin_client.application.config["METRICS_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    with open(os.path.join(metrics_dir, "1-other.json"), "w") as file:
+        labels = 'endpoint="help",method="GET",status="200"'
+        counters = {"space_trace_http_requests_total": {labels: 10}}
+        json.dump({"counters": counters, "histograms": {}}, file)
+
+    res = admin_client.get("/admin/metrics")
+    assert res.status_code == 200
+    text = res.data.decode()
+
+    requests = (
+        'space_trace_http_requests_total{endpoint="help",method="GET",status="200"}'
+    )
+    assert metric(text, requests) >= 13
+    assert "# TYPE space_trace_http_request_duration_seconds histogram" in text
+    assert (
+        'space_trace_http_request_duration_seconds_bucket{endpoint="help",le="+Inf"}'
+        in text
+    )
+    assert (
+        'space_trace_http_request_duration_seconds_quantile{endpoint="help",quantile="0.99"}'
+        in text
+    )
+    assert metric(text, 'space_trace_db_queries_total{endpoint="help"}') >= 1
+
+
+def test_metrics_require_admin(client):
+    assert client.get("/admin/metrics").status_code == 302
@@ -0,0 +1,42 @@
+from space_trace import db
+from space_trace.models import User, UserRecord, split_name
+from space_trace.statistics import most_frequent_users
+
+
+def test_names():
+    user = User("anna-lena.mueller-lüdenscheidt@spaceteam.at", "space")
+    assert user.first_name() == "Anna-Lena"
+    assert user.last_name() == "Mueller-Lüdenscheidt"
+    assert user.full_name() == "Anna-Lena Mueller-Lüdenscheidt"
+    assert user.team_emoji() == "🚀"
+
+    record = UserRecord(1, "ada.lovelace@spaceteam.at", "racing")
+    assert record.full_name() == "Ada Lovelace"
+    assert record.team_short() == "rt"
+
+
+def test_split_name_is_cached():
+    split_name.cache_clear()
+    split_name("ada.lovelace@spaceteam.at")
+    split_name("ada.lovelace@spaceteam.at")
+    assert split_name.cache_info().hits == 1
+
+
+def test_user_record_is_compact():
+    record = UserRecord(1, "ada.lovelace@spaceteam.at", "space")
+    assert not hasattr(record, "__dict__")
+
+
+def test_listings_return_records(client):
+    with client.application.app_context():
+        db.session.add(User("ada.lovelace@spaceteam.at", "space"))
+        db.session.commit()
+        assert most_frequent_users() == []
+
+        (row,) = db.session.query(*UserRecord.columns).all()
+        record = UserRecord(*row)
+        assert (record.id, record.email, record.team) == (
+            1,
+            "ada.lovelace@spaceteam.at",
+            "space",
+        )
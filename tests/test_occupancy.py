@@ -0,0 +1,75 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from space_trace import db
+from space_trace.models import ArchivedVisit, Visit
+from space_trace.occupancy import (
+    clear_occupancy_cache,
+    daily_peaks,
+    occupancy,
+    over_capacity,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    clear_occupancy_cache()
+    yield
+    clear_occupancy_cache()
+
+
+@pytest.fixture
+def day(client):
+    day = date.today() - timedelta(days=3)
+    midnight = datetime.combine(day, time())
+    with client.application.app_context():
+        # 1 still there from the day before, 3 arriving till 10:00 and one
+        # archived one arriving in the evening.
+        db.session.add(Visit(midnight - timedelta(hours=2), 1))
+        db.session.add(Visit(midnight + timedelta(hours=8), 2))
+        db.session.add(Visit(midnight + timedelta(hours=9, minutes=30), 3))
+        db.session.add(Visit(midnight + timedelta(hours=10), 4))
+        db.session.add(
+            ArchivedVisit(id=99, user=5, timestamp=midnight + timedelta(hours=21))
+        )
+        db.session.commit()
+    return day
+
+
+def test_occupancy_per_hour(client, day):
+    start = datetime.combine(day, time())
+    with client.application.app_context():
+        series = occupancy(start, start + timedelta(days=1))
+
+    assert len(series["data"]) == 24
+    assert series["labels"][8] == start.replace(hour=8).isoformat(timespec="minutes")
+    assert series["data"][:8] == [1] * 8
+    # The first member leaves at 10:00, exactly when the fourth arrives.
+    assert series["data"][8:12] == [2, 3, 3, 3]
+    assert series["data"][20:] == [2, 3, 1, 1]
+
+
+def test_occupancy_per_minute(client, day):
+    start = datetime.combine(day, time(9, 29))
+    with client.application.app_context():
+        series = occupancy(start, start + timedelta(minutes=3), "minute")
+
+    assert series["data"] == [2, 3, 3]
+
+
+def test_daily_peaks_and_capacity(client, day):
+    start = datetime.combine(day, time())
+    with client.application.app_context():
+        peaks = daily_peaks(day, day)
+        ranges = over_capacity(start, start + timedelta(days=1), 2)
+        # Served from the cache the second time.
+        assert daily_peaks(day, day) == peaks
+
+    assert [(p.day, p.peak, p.at) for p in peaks] == [
+        (day, 3, start.replace(hour=9, minute=30))
+    ]
+    assert [(r.start, r.end, r.peak) for r in ranges] == [
+        (start.replace(hour=9, minute=30), start.replace(hour=20), 3),
+        (start.replace(hour=21), start.replace(hour=21, minute=30), 3),
+    ]
@@ -0,0 +1,66 @@
+import logging
+
+from space_trace.profiling import is_full_scan, normalize
+
+
+def test_normalize():
+    assert normalize("SELECT * FROM users WHERE id IN (1, 2, 3)") == normalize(
+        "SELECT *\n  FROM users WHERE id IN (4)"
+    )
+    assert (
+        normalize("SELECT * FROM users WHERE email = 'a''b' AND id = 12")
+        == "SELECT * FROM users WHERE email = ? AND id = ?"
+    )
+    assert normalize("SELECT * FROM users WHERE id IN (?, ?)") == (
+        "SELECT * FROM users WHERE id IN (?)"
+    )
+
+
+def test_is_full_scan():
+    assert is_full_scan(["SCAN visits"])
+    assert not is_full_scan(["SEARCH visits USING INDEX idx_visits_user (user=?)"])
+    assert not is_full_scan(["SCAN visits USING COVERING INDEX idx_visits_user"])
+    assert is_full_scan(["Seq Scan on visits  (cost=0.00..35.50 rows=2550)"])
+
+
+def test_profiling_off_by_default(client, caplog):
+    with caplog.at_level(logging.INFO):
+        client.get("/help")
+    assert not any("queries in" in r.getMessage() for r in caplog.records)
+
+
+def test_slow_query_and_repeats(admin_client, caplog):
+    app = admin_client.application
+    app.config["QUERY_PROFILING"] = True
+    app.config["QUERY_PROFILING_SLOW_MS"] = 0
+    app.config["QUERY_PROFILING_REPEAT"] = 1
+    try:
+        with caplog.at_level(logging.INFO):
+            admin_client.get("/statistic")
+    finally:
+        del app.config["QUERY_PROFILING"]
+        app.config["QUERY_PROFILING_SLOW_MS"] = 50
+        app.config["QUERY_PROFILING_REPEAT"] = 5
+
+    messages = [r.getMessage() for r in caplog.records]
+    assert any(m.startswith("GET /statistic: ") for m in messages)
+    slow = [m for m in messages if m.startswith("Slow query")]
+    assert len(slow) > 0
+    # The plan is logged with the statement
+    assert any("SCAN" in m or "SEARCH" in m for m in slow)
+    assert any(m.startswith("Possible N+1") for m in messages)
+
+
+def test_footer(admin_client):
+    app = admin_client.application
+    app.config["QUERY_PROFILING"] = True
+    app.config["QUERY_PROFILING_FOOTER"] = True
+    try:
+        resp = admin_client.get("/statistic")
+    finally:
+        del app.config["QUERY_PROFILING"]
+        app.config["QUERY_PROFILING_FOOTER"] = False
+
+    body = resp.data.decode()
+    assert "queries in" in body
+    assert body.index("queries in") < body.index("</body>")
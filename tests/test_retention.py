@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from space_trace import db
+from space_trace.bulk_export import iter_visit_batches
+from space_trace.contact_graph import (
+    build_contact_graph,
+    clear_adjacency_cache,
+    day_adjacency,
+)
+from space_trace.export import get_users_between
+from space_trace.exposure import exposure_matrix
+from space_trace.models import ArchivedVisit, User, Visit
+from space_trace.occupancy import clear_occupancy_cache, day_minute_peaks
+from space_trace.retention import archive_visits, purge_visits
+from space_trace.statistics import total_visits
+from space_trace.tracing import find_contacts
+
+
+@pytest.fixture
+def users(client):
+    with client.application.app_context():
+        ada = User("ada.lovelace@spaceteam.at", "space")
+        alan = User("alan.turing@spaceteam.at", "space")
+        db.session.add_all([ada, alan])
+        db.session.commit()
+
+        now = datetime.now()
+        for days in (400, 100, 90, 1):
+            db.session.add(Visit(now - timedelta(days=days), ada.id))
+            db.session.add(Visit(now - timedelta(days=days, hours=1), alan.id))
+        db.session.commit()
+        return ada.id, alan.id
+
+
+def test_archive_moves_old_visits(client, users):
+    with client.application.app_context():
+        assert archive_visits(timedelta(days=60), batch_size=2, pause=0) == 6
+
+        assert Visit.query.count() == 2
+        assert ArchivedVisit.query.count() == 6
+        assert total_visits() == 2
+        assert total_visits(include_archive=True) == 8
+
+
+def test_archive_keeps_newest_visit(client, users):
+    with client.application.app_context():
+        archive_visits(timedelta(days=0), pause=0)
+
+        # The newest id stays, so SQLite never hands it out again.
+        newest = db.session.query(db.func.max(Visit.id)).scalar()
+        assert Visit.query.count() == 1
+        assert Visit.query.first().id == newest
+
+
+def test_archived_visits_are_traceable(client, users):
+    ada, alan = users
+    with client.application.app_context():
+        archive_visits(timedelta(days=60), pause=0)
+        start = datetime.now() - timedelta(days=101)
+
+        assert [c.user.id for c in find_contacts(ada, start)] == [alan]
+        contacts = find_contacts(ada, start, datetime.now() - timedelta(days=50))
+        assert contacts == []
+        contacts = find_contacts(
+            ada, start, datetime.now() - timedelta(days=50), include_archive=True
+        )
+        assert [c.user.id for c in contacts] == [alan]
+
+        end = datetime.now() - timedelta(days=80)
+        assert get_users_between(start, end).count() == 0
+        assert get_users_between(start, end, include_archive=True).count() == 2
+
+
+def test_archived_visits_in_analytics(client, users):
+    ada, alan = users
+    clear_adjacency_cache()
+    with client.application.app_context():
+        archive_visits(timedelta(days=60), pause=0)
+
+        def exported(**kwargs):
+            batches = iter_visit_batches(batch_size=3, **kwargs)
+            return sum((b["visit_id"] for b in batches), [])
+
+        assert len(exported()) == 2
+        ids = exported(include_archive=True)
+        assert len(ids) == 8 and ids == sorted(ids)
+
+        start = datetime.now() - timedelta(days=101)
+        end = datetime.now() - timedelta(days=80)
+        assert exposure_matrix(start, end).top_pairs() == []
+        matrix = exposure_matrix(start, end, include_archive=True)
+        assert [(a, b) for a, b, _ in matrix.top_pairs()] == [(ada, alan)]
+
+        graph = build_contact_graph(ada, start)
+        assert [e.user.id for e in graph.exposures] == [ada]
+        graph = build_contact_graph(ada, start, include_archive=True)
+        assert [e.user.id for e in graph.exposures] == [ada, alan]
+    clear_adjacency_cache()
+
+
+def test_purge_deletes_from_both_tables(client, users):
+    with client.application.app_context():
+        archive_visits(timedelta(days=60), pause=0)
+        assert purge_visits(timedelta(days=95), pause=0) == 4
+
+        assert Visit.query.count() == 2
+        assert ArchivedVisit.query.count() == 2
+
+
+def test_purge_deletes_newest_visit(client, users):
+    with client.application.app_context():
+        assert purge_visits(timedelta(days=0), pause=0) == 8
+        assert Visit.query.count() == 0
+
+
+def test_cached_days_forget_moved_visits(client, users):
+    ada, alan = users
+    clear_adjacency_cache()
+    clear_occupancy_cache()
+    with client.application.app_context():
+        day = (datetime.now() - timedelta(days=100)).date()
+        assert alan in day_adjacency(day)[ada]
+        assert alan in day_adjacency(day, include_archive=True)[ada]
+        assert day_minute_peaks(day, day)[day].max() == 2
+
+        archive_visits(timedelta(days=60), pause=0)
+        assert day_adjacency(day) == {}
+        assert alan in day_adjacency(day, include_archive=True)[ada]
+        # The occupancy counts the archived visits as well
+        assert day_minute_peaks(day, day)[day].max() == 2
+
+        purge_visits(timedelta(days=95), pause=0)
+        assert day_adjacency(day, include_archive=True) == {}
+        assert day_minute_peaks(day, day)[day].max() == 0
+    clear_adjacency_cache()
+    clear_occupancy_cache()
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from space_trace import db
+from space_trace.models import User
+from space_trace.routing import is_read_only, read_engine, read_only
+
+
+def test_read_only_uses_read_engine(client):
+    with client.application.app_context():
+        db.session.add(User("ada.lovelace@spaceteam.at", "space"))
+        db.session.commit()
+
+        with read_only():
+            assert db.session.get_bind() is read_engine(client.application)
+            assert User.query.count() == 1
+
+        assert db.session.get_bind() is db.engine
+
+
+def test_read_only_rejects_writes(client):
+    with client.application.app_context():
+        with read_only():
+            with pytest.raises(OperationalError):
+                db.session.execute(
+                    User.__table__.insert().values(email="a.b@c.at", team="space")
+                )
+        db.session.rollback()
+
+
+def test_flush_goes_to_primary(client):
+    with client.application.app_context():
+        with read_only():
+            db.session.add(User("ada.lovelace@spaceteam.at", "space"))
+            db.session.flush()
+        db.session.commit()
+        assert User.query.count() == 1
+
+
+def test_read_only_decorator_is_thread_safe():
+    @read_only()
+    def reading(barrier):
+        # Every thread is inside the function at the same time
+        barrier.wait()
+        return is_read_only()
+
+    barrier = threading.Barrier(8)
+    results = []
+
+    def run():
+        results.append(reading(barrier))
+        results.append(is_read_only())
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 8
+    assert results.count(False) == 8
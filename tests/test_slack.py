@@ -0,0 +1,112 @@
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from urllib.parse import parse_qs
+
+import pytest
+
+from space_trace import db
+from space_trace.models import SlackSync, SlackUser
+from space_trace.slack import get_slack_handle_table, sync_slack_directory
+
+
+def member(id: str, email: str, display_name: str, updated: int = 1):
+    return {
+        "id": id,
+        "updated": updated,
+        "profile": {
+            "email": email,
+            "display_name": display_name,
+            "real_name": display_name.title(),
+        },
+    }
+
+
+class SlackStub(BaseHTTPRequestHandler):
+    """Serves users.list in pages of two members."""
+
+    members = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        cursor = int(parse_qs(body).get("cursor", ["0"])[0])
+        page = self.members[cursor : cursor + 2]
+        next_cursor = str(cursor + 2) if cursor + 2 < len(self.members) else ""
+
+        data = json.dumps(
+            {
+                "ok": True,
+                "members": page,
+                "response_metadata": {"next_cursor": next_cursor},
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slack_stub(client):
+    server = HTTPServer(("127.0.0.1", 0), SlackStub)
+    Thread(target=server.serve_forever, daemon=True).start()
+    client.application.config[
+        "SLACK_API_URL"
+    ] = f"http://127.0.0.1:{server.server_port}/"
+    yield SlackStub
+    server.shutdown()
+    client.application.config.pop("SLACK_API_URL")
+
+
+def test_sync_follows_pagination(client, slack_stub):
+    slack_stub.members = [
+        member("U1", "ada.lovelace@spaceteam.at", "ada"),
+        member("U2", "grace.hopper@spaceteam.at", ""),
+        {"id": "B1", "updated": 1, "profile": {"real_name": "Some bot"}},
+        member("U3", "alan.turing@spaceteam.at", "alan"),
+    ]
+
+    with client.application.app_context():
+        sync = sync_slack_directory()
+
+        assert sync.members == 3
+        assert get_slack_handle_table() == {
+            "ada.lovelace@spaceteam.at": "@ada",
+            "grace.hopper@spaceteam.at": "@",
+            "alan.turing@spaceteam.at": "@alan",
+        }
+
+
+def test_sync_is_incremental(client, slack_stub):
+    slack_stub.members = [
+        member("U1", "ada.lovelace@spaceteam.at", "ada"),
+        member("U2", "grace.hopper@spaceteam.at", "grace"),
+    ]
+
+    with client.application.app_context():
+        sync_slack_directory()
+
+        slack_stub.members = [
+            member("U1", "ada.lovelace@spaceteam.at", "countess", updated=2),
+        ]
+        sync = sync_slack_directory()
+
+        # One changed and one left
+        assert sync.changed == 2
+        assert db.session.query(SlackUser.handle).all() == [("@countess",)]
+        assert SlackSync.query.all() == [sync]
+
+
+def test_handle_table_falls_back_on_errors(client):
+    client.application.config["SLACK_API_URL"] = "http://127.0.0.1:1/"
+    client.application.config["SLACK_SYNC_TIMEOUT"] = 1
+
+    with client.application.app_context():
+        assert get_slack_handle_table() == {}
+
+    client.application.config.pop("SLACK_API_URL")
+    client.application.config.pop("SLACK_SYNC_TIMEOUT")
@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+# Take long to import and are only needed for uploads, logins and the Slack sync
+HEAVY_MODULES = ["PIL", "pyzbar", "pdf2image", "cose", "onelogin", "slack_sdk"]
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted(sys.modules)}}))
+"""
+
+
+def import_in_new_process(module: str) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(module=module)],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def test_import_is_lazy():
+    lazy = import_in_new_process("space_trace")
+    warm = import_in_new_process("space_trace.wsgi")
+    print(f"space_trace: {lazy['seconds']:.2f}s, wsgi: {warm['seconds']:.2f}s")
+
+    for module in HEAVY_MODULES:
+        assert module not in lazy["modules"]
+        assert module in warm["modules"]
+    assert lazy["seconds"] < warm["seconds"]
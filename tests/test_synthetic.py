@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from space_trace import db
+from space_trace.models import User, UserActivity, Visit
+from space_trace.synthetic import generate_users, generate_visits
+
+
+def test_generate_users(client):
+    with client.application.app_context():
+        db.session.add(User("anna.gruber@example.com", "space"))
+        db.session.commit()
+
+        ids = generate_users(2000, certificates=True, seed=1)
+        assert len(ids) == 2000
+
+        users = User.query.filter(User.id.in_(ids)).all()
+        emails = {user.email for user in users}
+        assert len(emails) == 2000
+        assert "anna.gruber@example.com" not in emails
+        # More than all the combinations of names, and they still have one
+        assert all(user.first_name() and user.last_name() for user in users)
+        assert {user.team for user in users} == {"space", "racing"}
+        assert any(user.vaccinated_till is not None for user in users)
+        assert any(user.tested_till is not None for user in users)
+
+
+def test_generate_visits(client):
+    with client.application.app_context():
+        ids = generate_users(50, seed=1)
+        inserted = generate_visits(5000, ids, days=30, seed=1, batch_size=1000)
+        assert inserted == 5000
+
+        visits = Visit.query.order_by(Visit.id).all()
+        assert len(visits) == 5000
+        assert {visit.user for visit in visits} <= set(ids)
+
+        timestamps = [visit.timestamp for visit in visits]
+        assert timestamps == sorted(timestamps)
+        assert timestamps[0] >= datetime.now() - timedelta(days=31)
+        assert timestamps[-1] <= datetime.now()
+
+        # Afternoons are busier than nights
+        afternoon = sum(1 for t in timestamps if 16 <= t.hour < 20)
+        night = sum(1 for t in timestamps if 2 <= t.hour < 6)
+        assert afternoon > 10 * night
+
+
+def test_generate_data_command(client):
+    runner = client.application.test_cli_runner()
+    result = runner.invoke(
+        args=["generate-data", "--users", "20", "--visits", "300", "--yes"]
+    )
+    assert result.exit_code == 0, result.output
+
+    with client.application.app_context():
+        assert User.query.count() == 20
+        assert Visit.query.count() == 300
+        assert db.session.query(db.func.sum(UserActivity.total_visits)).scalar() == 300
@@ -0,0 +1,132 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from space_trace import db
+from space_trace.contact_graph import build_contact_graph, clear_adjacency_cache
+from space_trace.models import User, Visit
+from space_trace.tracing import covered_days, find_contacts, merge_intervals
+
+
+@pytest.fixture(autouse=True)
+def empty_adjacency_cache():
+    # Every test has its own database but the cache lives in the process.
+    clear_adjacency_cache()
+
+
+def add_user(email: str, team: str = "space") -> User:
+    user = User(email, team)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def add_visits(user: User, *timestamps: datetime):
+    for timestamp in timestamps:
+        db.session.add(Visit(timestamp, user.id))
+    db.session.commit()
+
+
+def test_merge_intervals():
+    a = datetime(2022, 3, 1, 8)
+    intervals = [
+        (a + timedelta(hours=4), a + timedelta(hours=6)),
+        (a, a + timedelta(hours=5)),
+        (a + timedelta(hours=10), a + timedelta(hours=11)),
+    ]
+    assert merge_intervals(intervals) == [
+        (a, a + timedelta(hours=6)),
+        (a + timedelta(hours=10), a + timedelta(hours=11)),
+    ]
+
+
+def test_covered_days_excludes_end():
+    start = datetime(2022, 3, 1, 12)
+    end = datetime(2022, 3, 2, 0)
+    assert covered_days([(start, end)]) == [date(2022, 3, 1)]
+
+
+def test_find_contacts(client):
+    with client.application.app_context():
+        infected = add_user("ada.lovelace@spaceteam.at")
+        contact = add_user("grace.hopper@spaceteam.at")
+        stranger = add_user("margaret.hamilton@racing.at", "racing")
+
+        add_visits(infected, datetime(2022, 3, 1, 10), datetime(2022, 3, 2, 10))
+        # Overlaps 6h on the first day and twice on the second day (which
+        # must not be counted twice).
+        add_visits(
+            contact,
+            datetime(2022, 3, 1, 16),
+            datetime(2022, 3, 2, 8),
+            datetime(2022, 3, 2, 9),
+        )
+        # Left 12h before the infected arrived.
+        add_visits(stranger, datetime(2022, 2, 28, 22))
+
+        contacts = find_contacts(infected.id, datetime(2022, 3, 1))
+
+        assert len(contacts) == 1
+        assert contacts[0].user.id == contact.id
+        assert contacts[0].overlap == timedelta(hours=6 + 11)
+        assert contacts[0].days == [date(2022, 3, 1), date(2022, 3, 2)]
+
+
+def test_find_contacts_respects_start(client):
+    with client.application.app_context():
+        infected = add_user("ada.lovelace@spaceteam.at")
+        contact = add_user("grace.hopper@spaceteam.at")
+
+        add_visits(infected, datetime(2022, 3, 1, 10))
+        add_visits(contact, datetime(2022, 3, 1, 10))
+
+        contacts = find_contacts(infected.id, datetime(2022, 3, 1, 20))
+        assert contacts[0].overlap == timedelta(hours=2)
+        assert find_contacts(infected.id, datetime(2022, 3, 2)) == []
+
+
+def test_contact_graph_follows_hops_in_order(client):
+    with client.application.app_context():
+        infected = add_user("ada.lovelace@spaceteam.at")
+        first = add_user("grace.hopper@spaceteam.at")
+        second = add_user("margaret.hamilton@spaceteam.at")
+        earlier = add_user("katherine.johnson@spaceteam.at")
+
+        add_visits(infected, datetime(2022, 3, 1, 10))
+        add_visits(
+            first,
+            datetime(2022, 2, 28, 20),
+            datetime(2022, 3, 1, 12),
+            datetime(2022, 3, 3, 10),
+        )
+        add_visits(second, datetime(2022, 3, 3, 12))
+        # Met the first contact till 06:00, after the start but before the
+        # first contact was exposed at 12:00.
+        add_visits(earlier, datetime(2022, 2, 28, 18))
+        met = find_contacts(first.id, datetime(2022, 3, 1), datetime(2022, 3, 1, 12))
+        assert [c.user.id for c in met] == [earlier.id]
+
+        graph = build_contact_graph(infected.id, datetime(2022, 3, 1), depth=3)
+
+        hops = {e.user.email: (e.hop, e.via) for e in graph.exposures}
+        assert hops == {
+            infected.email: (0, None),
+            first.email: (1, infected),
+            second.email: (2, first),
+        }
+        assert len(graph.edges) == 2
+        assert graph.edges[0].overlap == timedelta(hours=10)
+
+
+def test_contact_graph_respects_depth(client):
+    with client.application.app_context():
+        infected = add_user("ada.lovelace@spaceteam.at")
+        first = add_user("grace.hopper@spaceteam.at")
+        second = add_user("margaret.hamilton@spaceteam.at")
+
+        add_visits(infected, datetime(2022, 3, 1, 10))
+        add_visits(first, datetime(2022, 3, 1, 12), datetime(2022, 3, 3, 10))
+        add_visits(second, datetime(2022, 3, 3, 12))
+
+        graph = build_contact_graph(infected.id, datetime(2022, 3, 1), depth=1)
+        assert [e.user.id for e in graph.exposures] == [infected.id, first.id]
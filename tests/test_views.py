@@ -1,4 +1,11 @@
+import sqlite3
+from datetime import date, timedelta
+
 import pytest
+from sqlalchemy.exc import OperationalError
+
+from space_trace import db
+from space_trace.models import User
 
 
 def test_empty_statistic(client):
@@ -42,3 +49,48 @@ def test_admin_without_login(client):
 
     res = client.get("/admin")
     assert res.status_code == 302
+
+
+def test_login_debug_with_email(client):
+    env = client.application.config["ENV"]
+    client.application.config["ENV"] = "development"
+    try:
+        res = client.get("/login-debug?email=ada.lovelace@spaceteam.at&team=racing")
+        assert res.status_code == 302
+        res = client.get("/login-debug?email=ada.lovelace@spaceteam.at&team=none")
+        assert res.status_code == 400
+    finally:
+        client.application.config["ENV"] = env
+
+    with client.session_transaction() as session:
+        assert session["username"] == "ada.lovelace@spaceteam.at"
+    with client.application.app_context():
+        user = User.query.filter(User.email == "ada.lovelace@spaceteam.at").one()
+        assert user.team == "racing"
+
+
+def test_login_debug_only_in_development(client):
+    res = client.get("/login-debug?email=ada.lovelace@spaceteam.at")
+    assert res.status_code == 404
+
+
+def test_database_locked(client, monkeypatch):
+    import space_trace.views
+
+    def locked(*args):
+        raise OperationalError(
+            "INSERT", {}, sqlite3.OperationalError("database is locked")
+        )
+
+    with client.application.app_context():
+        user = User("ada.lovelace@spaceteam.at", "space")
+        user.vaccinated_till = date.today() + timedelta(days=30)
+        db.session.add(user)
+        db.session.commit()
+    with client.session_transaction() as session:
+        session["username"] = "ada.lovelace@spaceteam.at"
+
+    monkeypatch.setattr(space_trace.views, "check_in", locked)
+    res = client.post("/")
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"